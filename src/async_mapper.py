@@ -0,0 +1,50 @@
+from mapper import gpumap
+from device import get_device
+from gpu_list import GpuList
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import asyncio
+
+_executor = None
+_executor_lock = Lock()
+
+# maps that can be in flight at once on the shared executor
+max_workers = 4
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gpumap")
+        return _executor
+
+
+def run_map(func, _list, kernel, backend, chunk_size, devices, stats):
+    if backend in ("numpy", "pool", "auto") or devices is not None:
+        # nothing to make current, or the device that is picked or every shard does it itself
+        return gpumap(func, _list, kernel, backend, chunk_size, devices, stats)
+    # the worker thread has to make the device current before using it
+    device = get_device(_list.device if isinstance(_list, GpuList) and backend is None else backend)
+    device.activate()
+    try:
+        return gpumap(func, _list, kernel, device, chunk_size, stats=stats)
+    finally:
+        device.deactivate()
+
+
+def gpumap_async(func, _list, kernel=None, backend=None, chunk_size=None, devices=None, stats=None,
+                 executor=None):
+    # serializing, launching and unpacking all happen on the executor, the caller gets a
+    # concurrent.futures.Future of the results straight away. the list and the closure
+    # variables must not be touched until the future is done
+    executor = get_executor() if executor is None else executor
+    return executor.submit(run_map, func, _list, kernel, backend, chunk_size, devices, stats)
+
+
+async def gpumap_await(func, _list, kernel=None, backend=None, chunk_size=None, devices=None, stats=None,
+                       executor=None):
+    # the asyncio flavour of gpumap_async, the event loop keeps running while the map does
+    return await asyncio.wrap_future(gpumap_async(func, _list, kernel, backend, chunk_size, devices, stats,
+                                                  executor))
@@ -0,0 +1,2 @@
+# end to end benchmarks of the map workloads, run from src with python -m benchmarks. import
+# the submodules directly so that python -m benchmarks.phases does not load phases twice
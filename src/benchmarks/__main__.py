@@ -0,0 +1,41 @@
+from benchmarks.harness import get_backends, run_benchmarks, compare, load, save
+from benchmarks.workloads import workloads
+
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="time the map workloads on every backend against the builtin map")
+    parser.add_argument("--workloads", nargs="+", choices=sorted(workloads), help="default: all of them")
+    parser.add_argument("--backends", nargs="+", help="default: %s" % " ".join(get_backends()))
+    parser.add_argument("--sizes", nargs="+", type=int, help="default: the sizes of each workload")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size, the fastest is kept")
+    parser.add_argument("--output", help="write the results here instead of to stdout")
+    parser.add_argument("--baseline", help="results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown that counts as a regression")
+    parser.add_argument("--compare", metavar="RESULTS", help="check stored results instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        results = load(args.compare)
+    else:
+        results = run_benchmarks(args.workloads, args.backends, args.sizes, args.repeat)
+        if args.output is not None:
+            save(results, args.output)
+        else:
+            json.dump(results, sys.stdout, indent=1, sort_keys=True)
+            print()
+
+    if args.baseline is None:
+        return 0
+    regressions = compare(load(args.baseline), results, args.threshold)
+    for regression in regressions:
+        print("REGRESSION {workload} {backend} size {size}: {reason}".format(**regression), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
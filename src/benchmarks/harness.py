@@ -0,0 +1,141 @@
+from benchmarks.workloads import workloads as all_workloads
+from mapper import gpumap
+from device import available_devices
+from stats import StatsRecorder, add_hook, remove_hook
+
+from time import perf_counter
+import datetime
+import platform
+import random
+import pickle
+import json
+import math
+import os
+
+# the cpu baseline every backend is compared to
+baseline_backend = "builtin"
+
+
+def get_backends():
+    # builtin map, every device that can be created here and the host python backends
+    return [baseline_backend] + available_devices() + ["numpy", "pool"]
+
+
+def get_map_func(backend):
+    if backend == baseline_backend:
+        return lambda func, _list: list(map(func, _list))
+    return lambda func, _list: gpumap(func, _list, backend=backend)
+
+
+def snapshot(value):
+    # plain values of everything a run produced, objects become dicts of their fields
+    if isinstance(value, (list, tuple)):
+        return [snapshot(item) for item in value]
+    if hasattr(value, "__dict__"):
+        return {name: snapshot(field) for name, field in vars(value).items()}
+    return value
+
+
+def matches(expected, actual):
+    # floats may differ in the last digits, e.g. 32 bit math on a gpu
+    if isinstance(expected, list):
+        return isinstance(actual, list) and len(expected) == len(actual) and \
+            all(matches(e, a) for e, a in zip(expected, actual))
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and expected.keys() == actual.keys() and \
+            all(matches(expected[name], actual[name]) for name in expected)
+    if isinstance(expected, float) or isinstance(actual, float):
+        return math.isclose(expected, actual, rel_tol=1e-3, abs_tol=1e-3)
+    return expected == actual
+
+
+def time_runs(workload, backend, payload, repeat):
+    # fastest of repeat runs, each on a fresh copy of the data. the phases are the ones of
+    # the gpumap calls in the fastest run
+    map_func = get_map_func(backend)
+    best = None
+    for _ in range(repeat):
+        data = pickle.loads(payload)
+        recorder = StatsRecorder()
+        add_hook(recorder)
+        try:
+            start_time = perf_counter()
+            out = workload.run(map_func, data)
+            duration = perf_counter() - start_time
+        finally:
+            remove_hook(recorder)
+        if best is None or duration < best[0]:
+            best = duration, out, recorder.calls
+    duration, out, calls = best
+    phases = {}
+    for stats in calls:
+        for name, phase_time in stats.phases.items():
+            phases[name] = phases.get(name, 0.0) + phase_time
+    return duration, snapshot(out), phases
+
+
+def run_benchmarks(workloads=None, backends=None, sizes=None, repeat=3, seed=0):
+    # times every workload at every size on every backend. each backend runs once untimed
+    # first so compiling and tuning are left out, a backend that fails is recorded with its
+    # error instead of stopping the sweep
+    workloads = list(all_workloads) if workloads is None else workloads
+    backends = get_backends() if backends is None else backends
+    results = []
+    for workload_name in workloads:
+        workload = all_workloads[workload_name]
+        for size in (workload.sizes if sizes is None else sizes):
+            payload = pickle.dumps(workload.make_data(size, random.Random(seed)))
+            cpu_time, expected, _ = time_runs(workload, baseline_backend, payload, repeat)
+            results.append({"workload": workload_name, "backend": baseline_backend, "size": size,
+                            "time": cpu_time, "speedup": 1.0, "ok": True, "phases": {}})
+            for backend in backends:
+                if backend == baseline_backend or backend in workload.skip_backends:
+                    continue
+                result = {"workload": workload_name, "backend": backend, "size": size}
+                try:
+                    time_runs(workload, backend, payload, 1)
+                    duration, out, phases = time_runs(workload, backend, payload, repeat)
+                except Exception as e:
+                    result["error"] = "%s: %s" % (type(e).__name__, e)
+                else:
+                    result.update({"time": duration, "speedup": cpu_time / duration,
+                                   "ok": matches(expected, out), "phases": phases})
+                results.append(result)
+    return {"meta": {"created": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+                     "platform": platform.platform(), "repeat": repeat, "seed": seed},
+            "results": results}
+
+
+def compare(baseline, current, threshold=0.25):
+    # runs whose speedup over the builtin map dropped by more than threshold, or that worked
+    # in the baseline and now fail or give wrong results. speedups rather than times are
+    # compared so a baseline from a slower or busier machine still works
+    old_results = {(r["workload"], r["backend"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = old_results.get((result["workload"], result["backend"], result["size"]))
+        if result["backend"] == baseline_backend or old is None or "time" not in old or not old["ok"]:
+            continue
+        regression = {"workload": result["workload"], "backend": result["backend"], "size": result["size"],
+                      "baseline": old["speedup"], "speedup": result.get("speedup")}
+        if "error" in result:
+            regression["reason"] = result["error"]
+        elif not result["ok"]:
+            regression["reason"] = "wrong results"
+        elif result["speedup"] * (1 + threshold) < old["speedup"]:
+            regression["reason"] = "speedup %.2fx, was %.2fx" % (result["speedup"], old["speedup"])
+        else:
+            continue
+        regressions.append(regression)
+    return regressions
+
+
+def save(results, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def load(path):
+    with open(path, "r") as f:
+        return json.load(f)
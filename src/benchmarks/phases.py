@@ -0,0 +1,153 @@
+from examiner import FunctionCallExaminer
+from mapper import Mapper
+from data_model import ExtractedClasses
+from serialization import ListSerializer
+from util import indent
+from benchmarks.harness import save
+
+from time import perf_counter
+import importlib.util
+import tracemalloc
+import argparse
+import datetime
+import platform
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+phases = ["trace", "codegen", "to_bytes", "from_bytes", "create_output_list"]
+
+
+def make_source(depth, fields):
+    # Level1 holds Level2 holds ... Level<depth>, each with fields int fields. total() reads
+    # every field on the way down, so tracing and code generation grow with both
+    lines = []
+    for level in range(depth, 0, -1):
+        lines.append("class Level%d:" % level)
+        lines.append(indent(1) + "def __init__(self, v):")
+        for i in range(fields):
+            lines.append(indent(2) + "self.f%d = v + %d" % (i, i))
+        if level != depth:
+            lines.append(indent(2) + "self.child = Level%d(v)" % (level + 1))
+        lines.append("")
+        lines.append(indent(1) + "def total(self):")
+        terms = ["self.f%d" % i for i in range(fields)]
+        if level != depth:
+            terms.append("self.child.total()")
+        lines.append(indent(2) + "return " + " + ".join(terms))
+        lines.append("")
+        lines.append("")
+    lines.append("def bump(o):")
+    lines.append(indent(1) + "o.f0 += 1")
+    lines.append(indent(1) + "return o.total()")
+    return "\n".join(lines) + "\n"
+
+
+def load_module(directory, depth, fields):
+    # the classes are written to a real module so that the translator can read their source
+    # and pickle can find them
+    name = "phase_objects_d%d_f%d" % (depth, fields)
+    path = os.path.join(directory, name + ".py")
+    with open(path, "w") as f:
+        f.write(make_source(depth, fields))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, repeat):
+    # fastest of repeat runs, then one more under tracemalloc since tracing slows it down
+    best = None
+    for _ in range(repeat):
+        start_time = perf_counter()
+        func()
+        duration = perf_counter() - start_time
+        best = duration if best is None else min(best, duration)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def get_phase_funcs(module, length):
+    # every phase on its own, with the state they need set up beforehand. trace and codegen
+    # work on one element whatever the length of the list is
+    items = [module.Level1(i) for i in range(length)]
+    class_repr = ExtractedClasses().extract(items[0])
+
+    mapper = Mapper(module.bump, items)
+    mapper.prepare_closure_vars()
+    mapper.prepare_signature()
+    kernel = mapper.prepare_kernel(None)
+
+    serializer = ListSerializer(class_repr, items)
+    data = serializer.to_bytes()
+    out_serializer = ListSerializer(class_repr, length=length)
+    return {
+        "trace": (1, lambda: FunctionCallExaminer.runfunc(module.bump, items[0])),
+        "codegen": (1, kernel._build_kernel),
+        "to_bytes": (length, serializer.to_bytes),
+        "from_bytes": (length, lambda: serializer.from_bytes(data)),
+        "create_output_list": (length, lambda: out_serializer.create_output_list(data, items[0])),
+    }
+
+
+def run_phase_benchmarks(depths=(1, 2, 4), fields=(2, 8, 32), lengths=(100, 10000), repeat=5, phase_names=None):
+    # fields must be at least 1 since bump() writes f0. items_per_sec counts list elements for
+    # the serializer phases and calls for trace and codegen
+    phase_names = phases if phase_names is None else phase_names
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for depth in depths:
+            for field_count in fields:
+                module = load_module(directory, depth, field_count)
+                try:
+                    for length in lengths:
+                        funcs = get_phase_funcs(module, length)
+                        for phase in phase_names:
+                            if phase in ("trace", "codegen") and length != lengths[0]:
+                                continue
+                            items, func = funcs[phase]
+                            duration, peak = measure(func, repeat)
+                            results.append({"phase": phase, "depth": depth, "fields": field_count,
+                                            "length": items, "time": duration,
+                                            "items_per_sec": items / duration if duration > 0 else None,
+                                            "peak_bytes": peak})
+                finally:
+                    del sys.modules[module.__name__]
+    finally:
+        shutil.rmtree(directory)
+    return {"meta": {"created": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+                     "platform": platform.platform(), "repeat": repeat},
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.phases",
+                                     description="time tracing, code generation and (de)serialization on their own")
+    parser.add_argument("--phases", nargs="+", choices=phases, help="default: all of them")
+    parser.add_argument("--depths", nargs="+", type=int, default=[1, 2, 4], help="levels of nested objects")
+    parser.add_argument("--fields", nargs="+", type=int, default=[2, 8, 32], help="int fields per level")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[100, 10000], help="list lengths to serialize")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per phase, the fastest is kept")
+    parser.add_argument("--output", help="write the results here instead of to stdout")
+    args = parser.parse_args(argv)
+    results = run_phase_benchmarks(args.depths, args.fields, args.lengths, args.repeat, args.phases)
+    if args.output is not None:
+        save(results, args.output)
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+from nbody import Body
+from test_sort import bubblesort
+from test_util import TestClassA, TestClassB, TestClassC
+
+import math
+
+
+class Workload:
+    # one map workload. make_data builds the input of a size once, every run gets a fresh
+    # copy of it and returns what it produced so it can be compared to the builtin map
+    name = None
+    sizes = []
+    # backends that cannot run the workload correctly, e.g. pool drops writes to closures
+    skip_backends = ()
+
+    def make_data(self, size, rng):
+        raise NotImplementedError
+
+    def run(self, map_func, data):
+        raise NotImplementedError
+
+
+def primitive_thing(n):
+    for i in range(1000):
+        n += 1
+    a = n
+    for i in range(1000):
+        a += 1
+
+    return a
+
+
+class PrimitiveLoop(Workload):
+    name = "primitive"
+    sizes = [100, 1000, 10000]
+
+    def make_data(self, size, rng):
+        return [rng.randint(0, 30) for _ in range(size)]
+
+    def run(self, map_func, items):
+        return map_func(primitive_thing, items)
+
+
+class BubbleSort(Workload):
+    # size is the number of lists, each of them list_size long
+    name = "bubblesort"
+    sizes = [100, 1000, 5000]
+    list_size = 32
+
+    def make_data(self, size, rng):
+        return [[rng.randint(0, 1000000) for _ in range(self.list_size)] for _ in range(size)]
+
+    def run(self, map_func, lists):
+        map_func(bubblesort, lists)
+        return lists
+
+
+class NBody(Workload):
+    # one step of the simulation in nbody.py with the bodies as a closure list
+    name = "nbody"
+    sizes = [16, 128, 512]
+    skip_backends = ("pool",)
+    dt = 0.01
+    padding = 0.0000001
+
+    def make_data(self, size, rng):
+        rand_pos = lambda: rng.uniform(-1000, 1000)
+        rand_vel = lambda: rng.uniform(-10, 10)
+        rand_mass = lambda: rng.uniform(-20, 20)
+        return [Body(rand_pos(), rand_pos(), rand_pos(), rand_vel(), rand_vel(), rand_vel(), rand_mass())
+                for _ in range(size)]
+
+    def run(self, map_func, bodies):
+        dt = self.dt
+        padding = self.padding
+
+        def calc_vel(i):
+            b1 = bodies[i]
+            for b2 in bodies:
+                d_pos = b1.pos.sub(b2.pos)
+                distance = d_pos.length() + padding
+                mag = dt / math.pow(distance, 3)
+                b1.vel = b1.vel.sub(d_pos.scale(b2.mass).scale(mag))
+
+        map_func(calc_vel, list(range(len(bodies))))
+
+        def update(body):
+            body.pos = body.pos.add(body.vel.scale(dt))
+
+        map_func(update, bodies)
+        return bodies
+
+
+class Flag:
+    def __init__(self, thing):
+        self.thing = thing
+
+
+def identity(b):
+    return b
+
+
+class NestedObjects(Workload):
+    # the map in TestMapper.test_map with smaller closure lists so the cpu baseline stays
+    # quick enough to sweep
+    name = "nested"
+    sizes = [100, 1000, 5000]
+    a_size = 200
+    b_size = 100
+
+    def make_data(self, size, rng):
+        items = [TestClassA(rng.randint(0, 30), rng.randint(0, 30), rng.randint(0, 30),
+                            TestClassB(rng.randint(0, 30), rng.randint(0, 30), rng.randint(0, 30)))
+                 for _ in range(size)]
+        a_list = [TestClassC(i + 1) for i in range(self.a_size)]
+        b_list = [TestClassC(1) for _ in range(self.b_size)]
+        return items, a_list, b_list, Flag(True)
+
+    def run(self, map_func, data):
+        items, a_list, b_list, something = data
+        last = len(a_list) - 1
+
+        def thing(a):
+            step = 2.3
+            if something.thing:
+                x = int(math.floor(step))
+                for i in range(0, a_list[last].i, x):
+                    a.increment_all(1)
+            b = TestClassA(a.a, a.a + a.b, a.a + a.b + a.c, TestClassB(a.o.x, a.o.x + a.o.y, a.o.x + a.o.y + a.o.z))
+            for c in b_list:
+                b.increment_all(c.i)
+            return identity(b)
+
+        return map_func(thing, items), items
+
+
+workloads = {workload.name: workload for workload in [NBody(), BubbleSort(), PrimitiveLoop(), NestedObjects()]}
@@ -1,5 +1,6 @@
 builtin = """
 #include <stdio.h>
+#include <stdint.h>
 
 template<typename T, typename... Args>
 __device__ void print(T first , Args... args) {}
@@ -7,27 +8,27 @@ __device__ void print(T first , Args... args) {}
 template <class T>
 class ListOfLists {
     public:
-        int list_length;
+        int64_t list_length;
         T items[];
 };
 
 template <class T>
 class List_Ptr {
     public:
-        int length;
+        int64_t length;
         T *items;
-        __device__ T& operator [](int i) {return items[i];};
+        __device__ T& operator [](int64_t i) {return items[i];};
 };
 
 template<class T>
-__device__ int len(List_Ptr<T> &l) {
+__device__ int64_t len(List_Ptr<T> &l) {
     return l.length;
 }
 
 template <class T>
 class List_PtrIterator {
     public:
-        int curr_idx;
+        int64_t curr_idx;
         List_Ptr<T> &list;
         __device__ List_PtrIterator(List_Ptr<T> &list) : list(list), curr_idx(0) {};
         __device__ T& next();
@@ -49,20 +50,20 @@ __device__ bool List_PtrIterator<T>::has_next() {
 template <class T>
 class List {
     public:
-        int length;
+        int64_t length;
         T items[];
-        __device__ T& operator [](int i) {return items[i];};
+        __device__ T& operator [](int64_t i) {return items[i];};
 };
 
 template<class T>
-__device__ int len(List<T> &l) {
+__device__ int64_t len(List<T> &l) {
     return l.length;
 }
 
 template <class T>
 class ListIterator {
     public:
-        int curr_idx;
+        int64_t curr_idx;
         List<T> &list;
         __device__ ListIterator(List<T> &list) : list(list), curr_idx(0) {};
         __device__ T& next();
@@ -83,17 +84,17 @@ __device__ bool ListIterator<T>::has_next() {
 
 class RangeIterator {
     public:
-        int stop;
-        int start;
-        int step;
-        int last;
+        int64_t stop;
+        int64_t start;
+        int64_t step;
+        int64_t last;
         bool started;
-        __device__ RangeIterator(int, int, int);
-        __device__ int next();
+        __device__ RangeIterator(int64_t, int64_t, int64_t);
+        __device__ int64_t next();
         __device__ bool has_next();
 };
 
-__device__ RangeIterator::RangeIterator(int start, int stop, int step) {
+__device__ RangeIterator::RangeIterator(int64_t start, int64_t stop, int64_t step) {
     this->stop = stop;
     this->start = start;
     this->step = step;
@@ -101,8 +102,8 @@ __device__ RangeIterator::RangeIterator(int start, int stop, int step) {
     this->started = false;
 }
 
-__device__ int RangeIterator::next() {
-    int next = this->last;
+__device__ int64_t RangeIterator::next() {
+    int64_t next = this->last;
     this->last += step;
     return next;
 }
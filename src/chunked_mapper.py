@@ -0,0 +1,164 @@
+from serialization import ListSerializer
+from util import time_func
+from stats import MapStats, collecting, finish_call
+from mapper import Mapper
+from gpu_list import GpuList
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from operator import itemgetter
+from time import perf_counter
+import numpy
+
+
+class ChunkedMapper(Mapper):
+    # maps the list a chunk at a time so it never has to fit on the device at once. a device
+    # thread copies, runs and copies back one chunk while this thread serializes the next
+    # one and unpacks the previous one
+    default_budget = 64 * 1024 * 1024
+
+    def __init__(self, func, _list, chunk_size="auto", device=None):
+        if isinstance(_list, GpuList):
+            raise TypeError("GPUMAP: a GpuList is already on the device and cannot be chunked")
+        Mapper.__init__(self, func, _list, device)
+        if isinstance(self.candidate_in, list):
+            raise TypeError("GPUMAP: lists of lists cannot be chunked")
+        if chunk_size != "auto" and chunk_size < 1:
+            raise ValueError("GPUMAP: chunk_size must be positive")
+        self.chunk_size = chunk_size
+        self.results_in = None
+        self.results_out = None
+
+    def get_chunk_size(self):
+        if self.chunk_size != "auto":
+            return self.chunk_size
+        # a quarter of what is free leaves room for the closures and the chunk in flight
+        free_memory = self.device.get_free_memory()
+        budget = free_memory // 4 if free_memory is not None else self.default_budget
+        item_size = ListSerializer.project_size(self.candidate_in_repr, self.candidate_in, 1)
+        if self.entry_point.return_type != type(None):
+            item_size += ListSerializer.project_size(self.candidate_out_repr, self.candidate_out, 1)
+        return max(1, budget // item_size)
+
+    def prepare_map(self, kernel):
+        time_func("serialize closure vars", self.prepare_closure_vars)
+
+        signature_key = self.prepare_signature()
+        self.check_entry_point()
+        self.rest = self.list[1:] if self.traced else list(self.list)
+        self.length = len(self.rest)
+        self.load_kernel(signature_key, kernel)
+
+    def get_chunks(self, chunk_size):
+        for start in range(0, self.length, chunk_size):
+            yield self.rest[start:start + chunk_size]
+
+    def run_chunk(self, func, in_serializer, input_bytes):
+        self.device.activate()
+        try:
+            length = in_serializer.length
+            in_ptr = self.to_device(input_bytes)
+            args = [in_ptr]
+            if self.entry_point.return_type != type(None):
+                output_bytes_len = ListSerializer.project_size(self.candidate_out_repr, self.candidate_out, length)
+                out_ptr = self.alloc(output_bytes_len)
+                args.append(out_ptr)
+            args.append(numpy.int64(length))
+            args.extend(map(itemgetter(2), self.closure_vars))
+            self.launch_map(func, args, length)
+            result_in_bytes = self.copy_input_back(in_ptr, len(input_bytes))
+            result_out_bytes = None
+            if self.entry_point.return_type != type(None):
+                result_out_bytes = self.from_device(out_ptr, output_bytes_len)
+            return in_serializer, result_in_bytes, result_out_bytes
+        finally:
+            self.device.deactivate()
+
+    def unpack_chunk(self, in_serializer, result_in_bytes, result_out_bytes):
+        result_in_list = self.unpack_input(in_serializer, result_in_bytes)
+        if result_out_bytes is None:
+            return result_in_list, [None for _ in result_in_list]
+        out_serializer = ListSerializer(self.candidate_out_repr, length=in_serializer.length)
+        return result_in_list, out_serializer.create_output_list(result_out_bytes, self.candidate_out)
+
+    def stream(self, func, chunks):
+        # yields the results of every chunk. the next chunk is serialized while the device works
+        # on the current one, and the current one is unpacked while the device works on the next
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            running = None
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                in_serializer = ListSerializer(self.candidate_in_repr, chunk)
+                input_bytes = in_serializer.to_bytes()
+                finished = running.result() if running is not None else None
+                running = executor.submit(self.run_chunk, func, in_serializer, input_bytes)
+                if finished is not None:
+                    yield self.unpack_chunk(*finished)
+            if running is not None:
+                yield self.unpack_chunk(*running.result())
+
+    def perform_map(self):
+        # serializing and unpacking are interleaved with the kernels, so they are timed together
+        time_func("run kernel", self.stream_chunks, self.get_kernel_func())
+
+    def stream_chunks(self, func):
+        self.results_in = [self.candidate_in] if self.traced else []
+        self.results_out = [self.candidate_out] if self.traced else []
+        for result_in_list, result_out_list in self.stream(func, self.get_chunks(self.get_chunk_size())):
+            self.results_in.extend(result_in_list)
+            self.results_out.extend(result_out_list)
+
+    def unpack_results(self):
+        self.deserialize_closure_vars()
+        return self.results_in, self.results_out
+
+
+def iter_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def gpumap_iter(func, iterable, batch_size, kernel=None, backend=None, stats=None):
+    # maps any iterable batch_size elements at a time and yields the results in order. at most
+    # a couple of batches are held at once, whatever the length of the iterable.
+    # writes to closure variables are copied back once the generator is exhausted or closed,
+    # that is also when the stats are finished. their total includes the time the caller
+    # spent between results
+    if batch_size < 1:
+        raise ValueError("GPUMAP: batch_size must be positive")
+    batches = iter_batches(iterable, batch_size)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return
+    stats = MapStats() if stats is None else stats
+    stats.name = "gpumap_iter"
+    start_time = perf_counter()
+    # the first batch discovers the types, every batch after it reuses its kernel and closures
+    with collecting(stats):
+        mapper = ChunkedMapper(func, first_batch, batch_size, device=backend)
+        mapper.device.activate()
+        try:
+            mapper.prepare_map(kernel)
+            func = mapper.get_kernel_func()
+        finally:
+            mapper.device.deactivate()
+    try:
+        if mapper.traced:
+            stats.elements += 1
+            yield mapper.candidate_out
+        for result_in_list, result_out_list in mapper.stream(func, chain([mapper.rest], batches)):
+            stats.elements += len(result_out_list)
+            yield from result_out_list
+    finally:
+        mapper.device.activate()
+        try:
+            mapper.deserialize_closure_vars()
+        finally:
+            mapper.device.deactivate()
+        stats.add_phase("total", perf_counter() - start_time)
+        finish_call(stats)
@@ -1,4 +1,5 @@
 from util import indent
+from stats import logger
 
 from data_model import primitive_map, ClassRepresentation, convert_float
 
@@ -52,7 +53,7 @@ class ClassDefGenerator:
             for ref_list in ref_lists:
                 iter_ref_list = iter(ref_list)
                 whole_ref_list = [True] + [False if t in primitive_map else next(iter_ref_list) for t in method.arg_types[1:]]
-                print(method.cls, method.name, whole_ref_list)
+                logger.debug("method %s.%s refs %s", method.cls, method.name, whole_ref_list)
                 protos.append(self.method(class_repr, method, refs=whole_ref_list))
         return "\n".join(protos)
 
@@ -0,0 +1,26 @@
+from scanner import define_scan_kernels, scan_funcs
+
+
+# the inclusive scan of the keep flags gives every kept value its slot in the compacted list
+_gather_body = """
+    if (thread_id < length) {
+        int64_t offset = offsets->items[thread_id];
+        int64_t previous = thread_id > 0 ? offsets->items[thread_id - 1] : 0;
+        if (offset != previous) {
+            compact->items[offset - 1] = values->items[thread_id];
+            indices->items[offset - 1] = thread_id;
+        }
+        if (thread_id == length - 1) {
+            compact->length = offset;
+            indices->length = offset;
+        }
+    }"""
+
+compaction_funcs = scan_funcs + ["gather_kernel"]
+
+
+def define_compaction_kernels(device, item_type):
+    kernels = define_scan_kernels(device, "int64_t", lambda a, b: "{a} + {b}".format(a=a, b=b))
+    params = "List<{t}> *values, List<int64_t> *offsets, List<{t}> *compact, List<int64_t> *indices, int64_t length"
+    kernels += device.define_kernel("gather_kernel", params.format(t=item_type), _gather_body)
+    return kernels
@@ -0,0 +1,75 @@
+from device import DeviceBackend
+from disk_cache import disk_cache
+
+from pycuda import autoinit
+import pycuda.driver as cuda
+from pycuda.compiler import compile as nvcc_compile
+
+
+class CudaDevice(DeviceBackend):
+    name = "cuda"
+    shared_memory = True
+    options = ["--std=c++11", "-Wno-deprecated-gpu-targets"]
+
+    def __init__(self, index=None):
+        # index picks the gpu, every other gpu than the one autoinit chose gets its primary
+        # context and is called cuda:<index>
+        device = autoinit.device if index is None else cuda.Device(index)
+        if index is None or device.pci_bus_id() == autoinit.device.pci_bus_id():
+            self.context = autoinit.context
+        else:
+            self.context = device.retain_primary_context()
+        if index is not None:
+            self.name = "cuda:%d" % index
+        self.arch = "sm_%d%d" % device.compute_capability()
+
+    def cache_key(self):
+        # modules are only valid in the context they were loaded in
+        return self.name, id(self.context)
+
+    def to_device(self, data):
+        return cuda.to_device(data)
+
+    def alloc(self, size):
+        return cuda.mem_alloc(size)
+
+    def from_device(self, ptr, size):
+        data = bytearray(size)
+        cuda.memcpy_dtoh(data, ptr)
+        return data
+
+    def free(self, ptr):
+        ptr.free()
+
+    def compile(self, source, func_name):
+        return self.compile_functions(source, [func_name])[0]
+
+    def compile_functions(self, source, func_names):
+        cache_options = self.options + [self.arch]
+        cubin = disk_cache.get(source, cache_options)
+        if cubin is None:
+            cubin = nvcc_compile(source, options=self.options, no_extern_c=True, arch=self.arch, cache_dir=False)
+            disk_cache.put(source, cache_options, cubin)
+        module = cuda.module_from_buffer(cubin)
+        return [module.get_function(func_name) for func_name in func_names]
+
+    def launch(self, func, args, block, grid):
+        func(*args, block=block, grid=grid)
+        cuda.Context.synchronize()
+
+    def tuning_key(self):
+        # gpus of the same architecture share their launch configurations
+        return "%s-%s" % (CudaDevice.name, self.arch)
+
+    def max_block_size(self, func):
+        # registers and shared memory of the kernel limit how many threads a block can hold
+        return func.get_attribute(cuda.function_attribute.MAX_THREADS_PER_BLOCK)
+
+    def get_free_memory(self):
+        return cuda.mem_get_info()[0]
+
+    def activate(self):
+        self.context.push()
+
+    def deactivate(self):
+        cuda.Context.pop()
@@ -1,7 +1,11 @@
 class double(float):
     pass
 
-primitive_map = {int: "i", float: "d", bool: "?", type(None): "P", double: "d"}
+# list lengths and offsets
+class int64_t(int):
+    pass
+
+primitive_map = {int: "i", float: "d", bool: "?", type(None): "P", double: "d", int64_t: "q"}
 built_in_functions = {
     "len": "len",
     "print": "print",
@@ -27,6 +31,12 @@ def convert_float(_type):
     else:
         return _type
 
+def get_layout(class_repr):
+    if isinstance(class_repr, ClassRepresentation):
+        return class_repr.get_layout()
+    else:
+        return convert_float(class_repr)
+
 class Functions:
     def __init__(self):
         self.functions = {}
@@ -93,7 +103,13 @@ class ClassRepresentation:
                           self.field_types))
         return fmt
 
+    def get_layout(self):
+        # hashable description of the memory layout, used as part of kernel cache keys
+        return self.raw_type, tuple(zip(self.field_names, map(get_layout, self.field_types)))
+
     def add_method(self, method):
+        # a method seen by several traces is only defined once
+        self.methods = [m for m in self.methods if m.name != method.name]
         self.methods.append(method)
 
     def __hash__(self):
@@ -0,0 +1,210 @@
+# every template strides over the list by the size of the grid, so any length runs with a bounded grid
+_main_func = """
+extern "C" {{
+#include <stdio.h>
+__global__ void map_kernel(List<{in_type}> *in, List<{out_type}> *out, int64_t length{closure_params}) {{
+    for (int64_t thread_id = blockIdx.x * (int64_t) blockDim.x + threadIdx.x; thread_id < length;
+         thread_id += (int64_t) blockDim.x * gridDim.x) {{
+        {in_type} &in_item = in->items[thread_id];
+        out->items[thread_id] = {func_name}(in_item{closure_args});
+    }}
+}}
+}}
+"""
+
+_foreach_func = """
+extern "C" {{
+#include <stdio.h>
+__global__ void map_kernel(List<{in_type}> *in, int64_t length{closure_params}) {{
+    for (int64_t thread_id = blockIdx.x * (int64_t) blockDim.x + threadIdx.x; thread_id < length;
+         thread_id += (int64_t) blockDim.x * gridDim.x) {{
+        {in_type} &in_item = in->items[thread_id];
+        {func_name}(in_item{closure_args});
+    }}
+}}
+}}
+"""
+
+_list_of_list_func = """
+extern "C" {{
+#include <stdio.h>
+__global__ void map_kernel(ListOfLists<{in_type}> *in, List<{out_type}> *out, int64_t length{closure_params}) {{
+    for (int64_t thread_id = blockIdx.x * (int64_t) blockDim.x + threadIdx.x; thread_id < length;
+         thread_id += (int64_t) blockDim.x * gridDim.x) {{
+        List_Ptr<{in_type}> in_list = {{in->list_length, &(in->items[thread_id * in->list_length])}};
+        out->items[thread_id] = {func_name}(in_list{closure_args});
+    }}
+}}
+}}
+"""
+
+_list_of_list_foreach = """
+extern "C" {{
+#include <stdio.h>
+__global__ void map_kernel(ListOfLists<{in_type}> *in, int64_t length{closure_params}) {{
+    for (int64_t thread_id = blockIdx.x * (int64_t) blockDim.x + threadIdx.x; thread_id < length;
+         thread_id += (int64_t) blockDim.x * gridDim.x) {{
+        List_Ptr<{in_type}> in_list = {{in->list_length, &(in->items[thread_id * in->list_length])}};
+        {func_name}(in_list{closure_args});
+    }}
+}}
+}}
+"""
+
+# wraps a kernel body, which runs once for every thread_id below num_threads
+_kernel_def = """
+__global__ void {name}(int64_t num_threads, {params}) {{
+    for (int64_t thread_id = blockIdx.x * (int64_t) blockDim.x + threadIdx.x; thread_id < num_threads;
+         thread_id += (int64_t) blockDim.x * gridDim.x) {{
+{body}
+    }}
+}}
+"""
+
+# runs the body once for every block below num_blocks. the threads of a block run it together,
+# so they can share memory and wait for each other with __syncthreads()
+_block_kernel_def = """
+__global__ void {name}(int64_t num_blocks, {params}) {{
+    for (int64_t block = blockIdx.x; block < num_blocks; block += gridDim.x) {{
+{body}
+        __syncthreads();
+    }}
+}}
+"""
+
+
+class DeviceBackend:
+    # everything Mapper needs from a device: memory, compilation and launches.
+    # the launch templates are written in the cuda dialect the translator emits
+    name = None
+    prelude = ""
+    main_func = _main_func
+    foreach_func = _foreach_func
+    list_of_list_func = _list_of_list_func
+    list_of_list_foreach = _list_of_list_foreach
+    kernel_def = _kernel_def
+    block_kernel_def = _block_kernel_def
+    # reductions and scans fold each block in shared memory on devices that have it
+    shared_memory = False
+
+    def cache_key(self):
+        # compiled kernels can be shared between devices with the same key
+        return self.name
+
+    def to_device(self, data):
+        raise NotImplementedError()
+
+    def alloc(self, size):
+        raise NotImplementedError()
+
+    def from_device(self, ptr, size):
+        raise NotImplementedError()
+
+    def free(self, ptr):
+        raise NotImplementedError()
+
+    def compile(self, source, func_name):
+        raise NotImplementedError()
+
+    def compile_functions(self, source, func_names):
+        return [self.compile(source, func_name) for func_name in func_names]
+
+    def define_kernel(self, name, params, body):
+        return self.kernel_def.format(name=name, params=params, body=body)
+
+    def define_block_kernel(self, name, params, body):
+        return self.block_kernel_def.format(name=name, params=params, body=body)
+
+    def launch(self, func, args, block, grid):
+        raise NotImplementedError()
+
+    def tuning_key(self):
+        # launch configurations are tuned separately for every key, it has to stay the same across runs
+        return self.name
+
+    def max_block_size(self, func):
+        # largest block func can be launched with, None when there is no limit
+        return None
+
+    def get_free_memory(self):
+        # bytes left for new buffers, None when the device cannot tell
+        return None
+
+    def activate(self):
+        # called by threads other than the one that created the device before they use it
+        pass
+
+    def deactivate(self):
+        pass
+
+
+def free_on(device, ptr):
+    # buffers can be freed while another device is active, outside of any map or by the
+    # garbage collector
+    device.activate()
+    try:
+        device.free(ptr)
+    finally:
+        device.deactivate()
+
+
+_device_factories = {}
+_devices = {}
+
+
+def register_device(name, factory):
+    _device_factories[name] = factory
+    _devices.pop(name, None)
+
+
+def unregister_device(name):
+    _device_factories.pop(name, None)
+    _devices.pop(name, None)
+
+
+def get_device(device=None):
+    if isinstance(device, DeviceBackend):
+        return device
+    if device is None:
+        return get_default_device()
+    if device not in _device_factories and device.startswith("cuda:") and device[5:].isdigit():
+        register_device(device, lambda: _create_cuda_device(int(device[5:])))
+    if device not in _device_factories:
+        raise ValueError("GPUMAP: unknown device %s" % device)
+    if device not in _devices:
+        _devices[device] = _device_factories[device]()
+    return _devices[device]
+
+
+def available_devices():
+    # names of the registered devices that can be created here
+    names = []
+    for name in _device_factories:
+        try:
+            get_device(name)
+        except Exception:
+            continue
+        names.append(name)
+    return names
+
+
+def get_default_device():
+    try:
+        return get_device("cuda")
+    except Exception:
+        # no pycuda or no usable gpu
+        return get_device("host")
+
+
+def _create_cuda_device(index=None):
+    from cuda_device import CudaDevice
+    return CudaDevice(index)
+
+
+def _create_host_device():
+    from host_device import HostDevice
+    return HostDevice()
+
+
+register_device("cuda", _create_cuda_device)
+register_device("host", _create_host_device)
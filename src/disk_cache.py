@@ -0,0 +1,141 @@
+import hashlib
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class DiskCache:
+    source_suffix = ".src"
+    artifact_suffix = ".bin"
+
+    def __init__(self, cache_dir=None, max_bytes=256 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = os.getenv("GPUMAP_CACHE_DIR",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "gpumap"))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def get_key(source, options):
+        h = hashlib.sha256()
+        h.update(source.encode("utf-8"))
+        for option in options:
+            h.update(b"\0")
+            h.update(option.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def get(self, source, options):
+        path = self._path(self.get_key(source, options), self.artifact_suffix)
+        try:
+            with open(path, "rb") as f:
+                artifact = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # bump the access time so eviction is least recently used
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return artifact
+
+    def get_source(self, source, options):
+        path = self._path(self.get_key(source, options), self.source_suffix)
+        try:
+            with open(path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, source, options, artifact):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = self.get_key(source, options)
+        # the artifact goes in last so a reader never sees an entry without its source
+        self._write_atomic(self._path(key, self.source_suffix), source.encode("utf-8"))
+        self._write_atomic(self._path(key, self.artifact_suffix), artifact)
+        self.evict()
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _entries(self):
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            key, suffix = os.path.splitext(name)
+            if name.startswith(".") or suffix not in (self.source_suffix, self.artifact_suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            size, last_used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+        return entries
+
+    def size(self):
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        return sum(size for size, _ in self._entries().values())
+
+    def evict(self):
+        with self._lock():
+            entries = self._entries()
+            total = sum(size for size, _ in entries.values())
+            for key, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+                if total <= self.max_bytes:
+                    break
+                for suffix in (self.artifact_suffix, self.source_suffix):
+                    try:
+                        os.unlink(self._path(key, suffix))
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        with self._lock():
+            for key in self._entries():
+                for suffix in (self.artifact_suffix, self.source_suffix):
+                    try:
+                        os.unlink(self._path(key, suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def _lock(self):
+        return _FileLock(os.path.join(self.cache_dir, ".lock"))
+
+
+class _FileLock:
+    # serializes eviction between processes sharing a cache directory
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+
+disk_cache = DiskCache()
@@ -0,0 +1,170 @@
+from data_model import ExtractedClasses, ClassRepresentation, primitive_map
+from serialization import length_format
+from device import get_device
+from gpu_list import GpuList
+from pool_mapper import can_map
+from stats import logger, current_stats
+
+from threading import Lock
+from time import perf_counter
+import struct
+import os
+
+
+def get_size(obj, classes=None):
+    # bytes obj takes up once serialized, 0 for things that are not copied to the device
+    classes = ExtractedClasses() if classes is None else classes
+    if isinstance(obj, list):
+        return struct.calcsize(length_format) + (len(obj) * get_size(obj[0], classes) if obj else 0)
+    if callable(obj) or obj is None:
+        return 0
+    class_repr = classes.extract(obj)
+    if isinstance(class_repr, ClassRepresentation):
+        return struct.calcsize(class_repr.get_format())
+    return struct.calcsize(primitive_map[class_repr])
+
+
+def get_closure_objects(func):
+    if not func.__closure__:
+        return []
+    return [cell.cell_contents for cell in func.__closure__]
+
+
+class CostModel:
+    # estimates how long the rest of a map takes on the builtin map, the pool and the default
+    # device. the cpu time per element comes from running element 0 in python, the rates and
+    # overheads from what earlier auto calls measured. nothing is known about a kernel before
+    # it ran once, so its time on the device counts as 0 until then. compiling is paid once,
+    # so it is spread over as many calls as the function already had
+    serialize_rate = 10e6
+    transfer_rate = 1e9
+    compile_time = 1.0
+    device_overhead = 1e-3
+    pool_overhead = 0.02
+    # weight of a new measurement against what was known so far
+    learning_rate = 0.5
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.rates = {"serialize_rate": self.serialize_rate, "transfer_rate": self.transfer_rate,
+                          "compile_time": self.compile_time, "device_overhead": self.device_overhead,
+                          "pool_overhead": self.pool_overhead}
+            self.kernel_times = {}
+            self.compiled = set()
+            self.calls = {}
+
+    def learn(self, name, value):
+        with self.lock:
+            self.rates[name] += self.learning_rate * (value - self.rates[name])
+
+    @staticmethod
+    def get_key(func, device):
+        return func.__code__, device.cache_key()
+
+    def can_use_pool(self, func, _list):
+        # the pool drops writes to closure variables and cannot map lists of lists, so only
+        # functions that close over nothing that can be written to go there. off the main
+        # thread only functions that can be sent to the shared pool can use it
+        if not can_map(func) or isinstance(_list[0], list):
+            return False
+        return all(callable(obj) or type(obj) in primitive_map for obj in get_closure_objects(func))
+
+    def estimate(self, func, device, length, cpu_time, item_bytes, closure_bytes, use_pool):
+        # seconds for each backend to map length elements that each take cpu_time in python
+        # and item_bytes to send and bring back
+        with self.lock:
+            rates = dict(self.rates)
+            key = self.get_key(func, device)
+            kernel_time = self.kernel_times.get(key, 0.0)
+            compile_time = 0.0 if key in self.compiled else rates["compile_time"] / (self.calls.get(key, 0) + 1)
+            self.calls[key] = self.calls.get(key, 0) + 1
+        data_bytes = length * item_bytes + closure_bytes
+        estimates = {"builtin": length * cpu_time}
+        estimates[device.name] = rates["device_overhead"] + compile_time + \
+            data_bytes / rates["serialize_rate"] + data_bytes / rates["transfer_rate"] + length * kernel_time
+        if use_pool:
+            estimates["pool"] = rates["pool_overhead"] + length * cpu_time / (os.cpu_count() or 1) + \
+                length * item_bytes / rates["serialize_rate"]
+        return estimates
+
+    def record_device(self, func, device, length, stats):
+        # learns from the phases of a map of length elements on device
+        phases = stats.phases
+        data_bytes = stats.bytes_in + stats.bytes_out
+        transfer = phases.get("transfer", 0.0)
+        host = phases.get("serialize closure vars", 0.0) + phases.get("serialize input", 0.0) + \
+            phases.get("deserialize", 0.0) - transfer
+        if data_bytes and host > 0:
+            self.learn("serialize_rate", data_bytes / host)
+        if data_bytes and transfer > 0:
+            self.learn("transfer_rate", data_bytes / transfer)
+        if "compile" in phases:
+            self.learn("compile_time", phases["compile"])
+        kernel = phases.get("run kernel", 0.0)
+        with self.lock:
+            key = self.get_key(func, device)
+            self.compiled.add(key)
+            self.kernel_times[key] = kernel / max(length, 1)
+        rest = phases.get("device", 0.0) - host - transfer - kernel - phases.get("compile", 0.0) - \
+            phases.get("first_call", 0.0) - phases.get("code generator", 0.0)
+        self.learn("device_overhead", max(rest, 0.0))
+
+    def record_pool(self, length, cpu_time, duration):
+        self.learn("pool_overhead", max(duration - length * cpu_time / (os.cpu_count() or 1), 0.0))
+
+
+cost_model = CostModel()
+
+
+def auto_map(func, _list, kernel=None, chunk_size=None, devices=None):
+    # maps element 0 in python to time it, then the rest of the list goes wherever the cost
+    # model expects it to finish first. the choice and the estimates end up in the stats
+    from mapper import map_list
+    if devices is not None:
+        raise TypeError("GPUMAP: devices cannot be combined with backend or chunk_size")
+    stats = current_stats()
+    gpu_lists = [obj for obj in [_list] + get_closure_objects(func) if isinstance(obj, GpuList)]
+    if gpu_lists:
+        # the data is on the device already and python cannot read it
+        stats.dispatch = {"backend": gpu_lists[0].device.name, "reason": "GpuList"}
+        return map_list(func, _list, kernel, gpu_lists[0].device, chunk_size)
+    if not _list:
+        stats.backend = "builtin"
+        return []
+
+    device = get_device()
+    start_time = perf_counter()
+    first_out = func(_list[0])
+    cpu_time = perf_counter() - start_time
+    rest = _list[1:]
+    if not rest:
+        stats.backend = "builtin"
+        stats.dispatch = {"backend": "builtin", "cpu_time": cpu_time, "estimates": {}}
+        return [first_out]
+
+    classes = ExtractedClasses()
+    item_bytes = 2 * get_size(_list[0], classes) + get_size(first_out, classes)
+    closure_bytes = 2 * sum(get_size(obj, classes) for obj in get_closure_objects(func))
+    use_pool = chunk_size is None and cost_model.can_use_pool(func, _list)
+    estimates = cost_model.estimate(func, device, len(rest), cpu_time, item_bytes, closure_bytes, use_pool)
+    backend = min(estimates, key=estimates.get)
+    stats.dispatch = {"backend": backend, "cpu_time": cpu_time, "estimates": estimates}
+    logger.debug("dispatching %s to %s, estimates %r", func.__name__, backend, estimates)
+
+    start_time = perf_counter()
+    if backend == "builtin":
+        stats.backend = "builtin"
+        results = list(map(func, rest))
+    elif backend == "pool":
+        results = map_list(func, rest, kernel, "pool")
+        cost_model.record_pool(len(rest), cpu_time, perf_counter() - start_time)
+    else:
+        results = map_list(func, rest, kernel, device, chunk_size)
+        stats.add_phase("device", perf_counter() - start_time)
+        cost_model.record_device(func, device, len(rest), stats)
+    stats.dispatch["time"] = perf_counter() - start_time
+    return [first_out] + results
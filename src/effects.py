@@ -0,0 +1,204 @@
+from func_def import parse_function
+
+import ast
+
+# builtins the kernels can call, none of them writes to what it is given
+read_only_builtins = {"len", "range", "print", "abs", "min", "max", "int", "float", "bool", "round", "pow"}
+
+
+def get_root(node):
+    # a in a.b[i].c
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def get_fields(node):
+    # ("b",) for a.b[i].c, fields after an item are not followed
+    fields = []
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        if isinstance(node, ast.Subscript):
+            fields = []
+        else:
+            fields.append(node.attr)
+        node = node.value
+    return tuple(reversed(fields))
+
+
+def get_common_prefix(paths):
+    paths = list(paths)
+    prefix = paths[0]
+    for path in paths[1:]:
+        i = 0
+        while i < min(len(prefix), len(path)) and prefix[i] == path[i]:
+            i += 1
+        prefix = prefix[:i]
+    return prefix
+
+
+def get_bound_names(target):
+    # names a target binds, a.x = ... or a[i] = ... bind nothing
+    if isinstance(target, ast.Name):
+        return [target.id]
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return [name for element in target.elts for name in get_bound_names(element)]
+    if isinstance(target, ast.Starred):
+        return get_bound_names(target.value)
+    return []
+
+
+def get_assignments(func_def):
+    # (value, targets) of everything that binds a name
+    for node in ast.walk(func_def):
+        if isinstance(node, ast.Assign):
+            yield node.value, node.targets
+        elif isinstance(node, (ast.AugAssign, ast.AnnAssign)) and node.value is not None:
+            yield node.value, [node.target]
+        elif isinstance(node, (ast.For, ast.comprehension)):
+            yield node.iter, [node.target]
+
+
+def get_write_targets(func_def):
+    for node in ast.walk(func_def):
+        if isinstance(node, ast.Assign):
+            yield from node.targets
+        elif isinstance(node, (ast.AugAssign, ast.AnnAssign)):
+            yield node.target
+        elif isinstance(node, ast.Delete):
+            yield from node.targets
+
+
+def get_arg_names(func):
+    return [arg.arg for arg in parse_function(func).body[0].args.args]
+
+
+class WriteAnalyzer:
+    # finds the fields a function can write through one of its arguments, as paths from the
+    # argument. () means anything reachable from it. every local bound to something computed
+    # from the argument may refer to the same objects, e.g. b = bodies[i], for c in b_list or
+    # o = a.o. a local bound to a plain field like a.o stands for that field, anything else
+    # computed from it stands for the whole argument. assigning to a field or an item through
+    # one of them is a write, and so is handing one to a function or method that writes
+    # through its parameter. calls are followed into the Functions, the constructors and the
+    # methods of the ExtractedClasses the map traced. the builtins in read_only_builtins only
+    # read what they are given, anything else that was not traced may write all of it, and so
+    # does calling a method that was not traced on it
+    def __init__(self, functions, classes):
+        self.functions = functions
+        self.classes = classes
+        self.results = {}
+
+    def get_methods(self, name):
+        return [method for class_repr in self.classes.classes.values()
+                for method in class_repr.methods if method.name == name]
+
+    def get_writes(self, func, param):
+        key = func.__code__, param
+        if key not in self.results:
+            # recursive calls are assumed not to write, the outer call decides
+            self.results[key] = set()
+            self.results[key] = self.find_writes(func, param)
+        return self.results[key]
+
+    def get_path(self, node, aliases):
+        # what node may refer to, None when it has nothing to do with the argument
+        root = get_root(node)
+        if root in aliases:
+            return aliases[root] + get_fields(node)
+        paths = [aliases[n.id] for n in ast.walk(node) if isinstance(n, ast.Name) and n.id in aliases]
+        return get_common_prefix(paths) if paths else None
+
+    def find_writes(self, func, param):
+        func_def = parse_function(func).body[0]
+        aliases = {param: ()}
+        changed = True
+        while changed:
+            changed = False
+            for value, targets in get_assignments(func_def):
+                path = self.get_path(value, aliases)
+                if path is None:
+                    continue
+                for target in targets:
+                    for name in get_bound_names(target):
+                        new_path = path if name not in aliases else get_common_prefix([aliases[name], path])
+                        if aliases.get(name) != new_path:
+                            aliases[name] = new_path
+                            changed = True
+
+        writes = set()
+        for target in get_write_targets(func_def):
+            # rebinding a local is not a write, assigning to a field or an item is
+            if isinstance(target, (ast.Attribute, ast.Subscript)) and get_root(target) in aliases:
+                writes.add(aliases[get_root(target)] + get_fields(target))
+        for node in ast.walk(func_def):
+            if isinstance(node, ast.Call):
+                writes.update(self.get_call_writes(node, aliases))
+        return writes
+
+    def get_call_writes(self, call, aliases):
+        args = [(i, self.get_path(arg, aliases)) for i, arg in enumerate(call.args)]
+        args = [(i, path) for i, path in args if path is not None]
+        keywords = [(keyword.arg, self.get_path(keyword.value, aliases)) for keyword in call.keywords]
+        keywords = [(name, path) for name, path in keywords if path is not None]
+        if isinstance(call.func, ast.Name):
+            name = call.func.id
+            if name in self.functions.functions:
+                return self.get_callee_writes(self.functions.functions[name].func, 0, args, keywords)
+            if name in self.classes.classes:
+                # the constructor runs like any other method, one that was not traced only
+                # stores what it is given
+                constructors = [method for method in self.classes.classes[name].methods if method.is_constructor()]
+                writes = set()
+                for method in constructors:
+                    writes.update(self.get_callee_writes(method.func, 1, args, keywords))
+                return writes
+            if name in read_only_builtins:
+                return set()
+        elif isinstance(call.func, ast.Attribute):
+            receiver = self.get_path(call.func.value, aliases)
+            if receiver is not None:
+                args = [(-1, receiver)] + args
+            methods = self.get_methods(call.func.attr)
+            if not methods:
+                # math.sqrt(b.x) and the like
+                return {receiver} if receiver is not None else set()
+            writes = set()
+            for method in methods:
+                writes.update(self.get_callee_writes(method.func, 1, args, keywords))
+            return writes
+        # nothing is known about what else is called, so it may write anything it is given
+        paths = [path for i, path in args] + [path for name, path in keywords]
+        return {get_common_prefix(paths)} if paths else set()
+
+    def get_callee_writes(self, func, offset, args, keywords):
+        # offset skips self for methods, index -1 is the object the method is called on
+        arg_names = get_arg_names(func)
+        params = [(name, path) for name, path in keywords if name is not None]
+        for i, path in args:
+            if 0 <= i + offset < len(arg_names):
+                params.append((arg_names[i + offset], path))
+        writes = set()
+        for name, path in params:
+            writes.update(path + written for written in self.get_writes(func, name))
+        return writes
+
+
+def find_written_closures(func, closure_names, functions, classes):
+    # the names in closure_names that func may write to, all of them when its source cannot be read
+    analyzer = WriteAnalyzer(functions, classes)
+    written = set()
+    for name in closure_names:
+        try:
+            if analyzer.get_writes(func, name):
+                written.add(name)
+        except (OSError, TypeError, SyntaxError):
+            return set(closure_names)
+    return written
+
+
+def find_written_fields(func, functions, classes):
+    # the fields of its argument func may write to, everything when its source cannot be read
+    try:
+        return WriteAnalyzer(functions, classes).get_writes(func, get_arg_names(func)[0])
+    except (OSError, TypeError, SyntaxError, IndexError):
+        return {()}
@@ -1,6 +1,9 @@
 import sys
+import threading
 from types import BuiltinFunctionType
 
+from stats import logger
+
 class FunctionCall:
     def __init__(self, cls, name, args, types, function=None):
         self.cls = cls
@@ -21,7 +24,9 @@ class FunctionCall:
 
 
 class FunctionCallExaminer:
-    calls = None
+    # settrace is per thread, so every thread keeps its own examiner
+    local = threading.local()
+
     def __init__(self):
         self.results = []
         self.prev_call = {}
@@ -29,16 +34,22 @@ class FunctionCallExaminer:
 
     @staticmethod
     def runfunc(func, *args):
-        FunctionCallExaminer.calls = FunctionCallExaminer()
-        FunctionCallExaminer.calls.top_level_func = func
-        sys.settrace(tracefunc)
-        ret_val = func(*args)
-        sys.settrace(None)
-        return ret_val
+        calls = FunctionCallExaminer()
+        calls.top_level_func = func
+        FunctionCallExaminer.local.calls = calls
+        sys.settrace(calls.tracefunc)
+        try:
+            return func(*args)
+        finally:
+            sys.settrace(None)
 
     @staticmethod
     def results():
-        return FunctionCallExaminer.calls.results
+        return FunctionCallExaminer.local.calls.results
+
+    def tracefunc(self, frame, event, arg):
+        self.trace(frame, event, arg)
+        return self.tracefunc
 
     def trace(self, frame, event, arg):
         name = frame.f_code.co_name
@@ -70,12 +81,12 @@ class FunctionCallExaminer:
                             types.append((list, type(var[0])))
                         else:
                             types.append(type(var))
-                    print("found {}".format(func))
+                    logger.debug("found %s", func)
                     call = FunctionCall(cls, name, arg_names, types, func)
                     self.results.append(call)
                     self.prev_call[(cls, name)] = call
                 else:
-                    print("found builtin function {}".format(func))
+                    logger.debug("found builtin function %s", func)
         elif event == "return":
             if (cls, name) in self.prev_call:
                 prev_call = self.prev_call[(cls, name)]
@@ -84,12 +95,6 @@ class FunctionCallExaminer:
 
 
 
-def tracefunc(frame, event, arg):
-    trace = FunctionCallExaminer.calls.trace
-    trace(frame, event, arg)
-    return tracefunc
-
-
 from test_util import TestClassA, TestClassB
 
 class RunFunctionCallExaminerTest:
@@ -0,0 +1,7 @@
+from pipeline import gpu_pipeline
+
+
+def gpufilter(func, _list, kernel=None, backend=None, stats=None):
+    # a pipeline with a single filter stage. the kept elements are compacted on the device
+    # and only those are copied back, writes the predicate makes to dropped elements are lost
+    return gpu_pipeline(_list, backend).filter(func).collect(kernel=kernel, stats=stats)
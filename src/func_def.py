@@ -2,6 +2,11 @@ import ast, _ast, inspect, itertools
 
 from data_model import primitive_map, built_in_functions
 from util import indent, dedent
+from stats import logger
+
+
+# python 3.8+ parses every literal as ast.Constant instead of Num/NameConstant
+_literal_types = tuple(getattr(ast, name) for name in ("Constant", "Num", "NameConstant") if hasattr(ast, name))
 
 
 def get_type_label(_type, use_refs=False):
@@ -14,6 +19,15 @@ def get_type_label(_type, use_refs=False):
         return name + "&&"
 
 
+def parse_function(func):
+    source = inspect.getsource(func)
+
+    #hack to remove indentation
+    while source[0] == " ":
+        source = dedent(source)
+    return ast.parse(source)
+
+
 class FunctionDefGenerator:
     def all_func_protos(self, func_reprs):
         lines = []
@@ -93,16 +107,11 @@ class FunctionConverter(ast.NodeVisitor):
         return indent(self.indent_level)
 
     def convert(self):
-        source = inspect.getsource(self.func_repr.func)
-
-        #hack to remove indentation
-        while source[0] == " ":
-            source = dedent(source)
-        self.ast = ast.parse(source)
+        self.ast = parse_function(self.func_repr.func)
 
         # put args as local vars
         for arg, _type in zip(self.func_repr.args, self.func_repr.arg_types):
-            print("adding type", _type)
+            logger.debug("adding type %s", _type)
             self.local_vars[arg] = _type
         out = self.visit(self.ast)
         return out
@@ -178,8 +187,8 @@ class FunctionConverter(ast.NodeVisitor):
             # see if it's a primitive
             if target.id not in self.local_vars:
                 # binops and boolops return primitives
-                if isinstance(node.value, _ast.Num) or isinstance(node.value, _ast.Compare) or isinstance(node.value, _ast.BinOp) \
-                        or isinstance(node.value, _ast.BoolOp) or isinstance(node.value, _ast.NameConstant):
+                if isinstance(node.value, _literal_types) or isinstance(node.value, _ast.Compare) or isinstance(node.value, _ast.BinOp) \
+                        or isinstance(node.value, _ast.BoolOp):
                     output += "auto "
 
                 # check if referenced list contains primitives
@@ -230,7 +239,10 @@ class FunctionConverter(ast.NodeVisitor):
         return name + "(" + ", ".join(map(lambda a: self.visit(a), node.args)) + ")"
 
     def visit_Subscript(self, node):
-        return self.visit(node.value) + self.visit(node.slice)
+        if isinstance(node.slice, ast.Index):
+            return self.visit(node.value) + self.visit(node.slice)
+        # python 3.9+ no longer wraps the subscript in an Index node
+        return self.visit(node.value) + "[" + self.visit(node.slice) + "]"
 
     def visit_Is(self, node):
         raise SyntaxError("GPUMAP: is is not supported")
@@ -521,7 +533,7 @@ class FunctionConverter(ast.NodeVisitor):
         lines.append(
             self.indent() + "while({iter}.has_next()) {{".format(target=target, iter=this_iterator))
         self.increase_indent()
-        lines.append(self.indent() + "int {} = {}.next();".format(target, this_iterator))
+        lines.append(self.indent() + "int64_t {} = {}.next();".format(target, this_iterator))
         for stmt in node.body:
             lines.append(self.indent() + self.visit(stmt) + self.semicolon(stmt))
         self.decrease_indent()
@@ -629,9 +641,9 @@ class MethodConverter(FunctionConverter):
                         raise RuntimeError("SHOULD NEVER HAPPEN!!!")
 
                 # binops and boolops return primitives
-                elif isinstance(node.value, _ast.Num) or isinstance(node.value, _ast.Compare) or isinstance(node.value,
+                elif isinstance(node.value, _literal_types) or isinstance(node.value, _ast.Compare) or isinstance(node.value,
                                                                                                           _ast.BinOp) \
-                        or isinstance(node.value, _ast.BoolOp) or isinstance(node.value, _ast.NameConstant):
+                        or isinstance(node.value, _ast.BoolOp):
                     output += "auto "
 
                 # check if referenced list contains primitives
@@ -0,0 +1,83 @@
+from data_model import ExtractedClasses
+from serialization import ListSerializer
+from device import get_device, free_on
+
+import weakref
+
+
+class GpuList:
+    # a serialized list kept in device memory across maps. gpumap reads and writes the
+    # device copy in place, the python objects are only updated by sync(). the device memory
+    # is released by free(), at the end of a with block or once the GpuList is garbage collected
+    def __init__(self, _list, device=None):
+        if not _list:
+            raise ValueError("GPUMAP: cannot keep an empty list on the device")
+        if isinstance(_list[0], list):
+            raise TypeError("GPUMAP: lists of lists cannot be kept on the device")
+        self.device = get_device(device)
+        self.list = _list
+        self.length = len(_list)
+        self.sample_object = _list[0]
+        self.class_repr = ExtractedClasses().extract(self.sample_object)
+        self.serializer = ListSerializer(self.class_repr, _list)
+        data = self.serializer.to_bytes()
+        self.size = len(data)
+        self.device.activate()
+        try:
+            self.ptr = self.device.to_device(data)
+        finally:
+            self.device.deactivate()
+        self.finalizer = weakref.finalize(self, free_on, self.device, self.ptr)
+
+    @classmethod
+    def from_device(cls, device, class_repr, ptr, size, length, sample_object):
+        # wraps the output of a map, the python objects are created on the first sync
+        gpu_list = cls.__new__(cls)
+        gpu_list.device = device
+        gpu_list.list = None
+        gpu_list.length = length
+        gpu_list.sample_object = sample_object
+        gpu_list.class_repr = class_repr
+        gpu_list.serializer = ListSerializer(class_repr, length=length)
+        gpu_list.size = size
+        gpu_list.ptr = ptr
+        gpu_list.finalizer = weakref.finalize(gpu_list, free_on, device, ptr)
+        return gpu_list
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.free()
+
+    def sync(self):
+        if self.ptr is None:
+            raise ValueError("GPUMAP: GpuList was freed")
+        self.device.activate()
+        try:
+            data = self.device.from_device(self.ptr, self.size)
+        finally:
+            self.device.deactivate()
+        if self.list is None:
+            self.list = self.serializer.create_output_list(data, self.sample_object)
+            self.serializer = ListSerializer(self.class_repr, self.list)
+        else:
+            self.list[:] = self.serializer.from_bytes(data)
+
+    def to_list(self):
+        self.sync()
+        return self.list
+
+    def get_host_list(self):
+        # possibly stale python objects, only good for discovering types
+        if self.list is None:
+            self.sync()
+        return self.list
+
+    def free(self):
+        # the finalizer only frees once
+        self.finalizer()
+        self.ptr = None
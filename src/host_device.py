@@ -0,0 +1,150 @@
+from device import DeviceBackend
+from disk_cache import disk_cache
+
+import ctypes
+import numbers
+import numpy
+import os
+import subprocess
+import tempfile
+
+
+# lets the generated cuda code compile as plain c++
+_host_prelude = """
+#define __device__
+#define __global__
+#include <math.h>
+#include <stdint.h>
+"""
+
+_host_main_func = """
+extern "C" {{
+void map_kernel(List<{in_type}> *in, List<{out_type}> *out, int64_t length{closure_params}) {{
+    #pragma omp parallel for
+    for (int64_t thread_id = 0; thread_id < length; thread_id++) {{
+        {in_type} &in_item = in->items[thread_id];
+        out->items[thread_id] = {func_name}(in_item{closure_args});
+    }}
+}}
+}}
+"""
+
+_host_foreach_func = """
+extern "C" {{
+void map_kernel(List<{in_type}> *in, int64_t length{closure_params}) {{
+    #pragma omp parallel for
+    for (int64_t thread_id = 0; thread_id < length; thread_id++) {{
+        {in_type} &in_item = in->items[thread_id];
+        {func_name}(in_item{closure_args});
+    }}
+}}
+}}
+"""
+
+_host_list_of_list_func = """
+extern "C" {{
+void map_kernel(ListOfLists<{in_type}> *in, List<{out_type}> *out, int64_t length{closure_params}) {{
+    #pragma omp parallel for
+    for (int64_t thread_id = 0; thread_id < length; thread_id++) {{
+        List_Ptr<{in_type}> in_list = {{in->list_length, &(in->items[thread_id * in->list_length])}};
+        out->items[thread_id] = {func_name}(in_list{closure_args});
+    }}
+}}
+}}
+"""
+
+_host_list_of_list_foreach = """
+extern "C" {{
+void map_kernel(ListOfLists<{in_type}> *in, int64_t length{closure_params}) {{
+    #pragma omp parallel for
+    for (int64_t thread_id = 0; thread_id < length; thread_id++) {{
+        List_Ptr<{in_type}> in_list = {{in->list_length, &(in->items[thread_id * in->list_length])}};
+        {func_name}(in_list{closure_args});
+    }}
+}}
+}}
+"""
+
+_host_kernel_def = """
+void {name}(int64_t num_threads, {params}) {{
+    #pragma omp parallel for
+    for (int64_t thread_id = 0; thread_id < num_threads; thread_id++) {{
+{body}
+    }}
+}}
+"""
+
+
+def compile_host(source, compiler, options):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_path = os.path.join(tmp_dir, "kernel.cpp")
+        library_path = os.path.join(tmp_dir, "kernel.so")
+        with open(source_path, "w") as f:
+            f.write(source)
+        result = subprocess.run([compiler] + options + ["-o", library_path, source_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("GPUMAP: host compilation failed\n" + result.stderr)
+        with open(library_path, "rb") as f:
+            return f.read()
+
+
+def load_library(library):
+    # every load gets its own file, otherwise dlopen hands back an already loaded library
+    fd, path = tempfile.mkstemp(suffix=".so")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(library)
+        return ctypes.CDLL(path)
+    finally:
+        os.unlink(path)
+
+
+def to_c_arg(arg):
+    if isinstance(arg, numpy.int64):
+        return ctypes.c_int64(int(arg))
+    if isinstance(arg, numbers.Integral):
+        return ctypes.c_int(int(arg))
+    return arg
+
+
+class HostDevice(DeviceBackend):
+    # host memory reference device. kernels are compiled with the system c++ compiler and
+    # every launch runs each of its num_threads once across the cores, the grid is ignored
+    name = "host"
+    prelude = _host_prelude
+    main_func = _host_main_func
+    foreach_func = _host_foreach_func
+    list_of_list_func = _host_list_of_list_func
+    list_of_list_foreach = _host_list_of_list_foreach
+    kernel_def = _host_kernel_def
+
+    compiler = os.getenv("CXX", "c++")
+    options = ["-O3", "-std=c++11", "-shared", "-fPIC", "-fopenmp", "-w"]
+
+    def to_device(self, data):
+        return ctypes.create_string_buffer(bytes(data), len(data))
+
+    def alloc(self, size):
+        return ctypes.create_string_buffer(size)
+
+    def from_device(self, ptr, size):
+        return ptr.raw[:size]
+
+    def free(self, ptr):
+        pass
+
+    def compile(self, source, func_name):
+        return self.compile_functions(source, [func_name])[0]
+
+    def compile_functions(self, source, func_names):
+        cache_options = [self.compiler] + self.options
+        library = disk_cache.get(source, cache_options)
+        if library is None:
+            library = compile_host(source, self.compiler, self.options)
+            disk_cache.put(source, cache_options, library)
+        library = load_library(library)
+        return [getattr(library, func_name) for func_name in func_names]
+
+    def launch(self, func, args, block, grid):
+        func(*map(to_c_arg, args))
@@ -0,0 +1,142 @@
+from data_model import MethodRepresentation
+from device import free_on
+
+from collections import OrderedDict
+from threading import Lock
+
+
+def get_code(func_repr):
+    # the code the name of a traced function or method refers to now. calls are translated by
+    # name, so a helper bound to a new function after the trace needs a new kernel
+    if isinstance(func_repr, MethodRepresentation):
+        func = getattr(func_repr.cls, func_repr.name, None)
+    else:
+        func = getattr(func_repr.func, "__globals__", {}).get(func_repr.name)
+    return getattr(func, "__code__", None)
+
+
+def get_codes(classes, functions):
+    codes = [(name, get_code(f)) for name, f in functions.functions.items()]
+    for class_repr in classes.classes.values():
+        codes.extend((class_repr.name + "." + m.name, get_code(m)) for m in class_repr.methods)
+    return tuple(codes)
+
+
+class Signature:
+    # result of tracing the first call, enough to rebuild a kernel without tracing again
+    def __init__(self, entry_point, candidate_out_repr, out_template, classes, functions):
+        self.entry_point = entry_point
+        self.candidate_out_repr = candidate_out_repr
+        self.out_template = out_template
+        self.classes = classes
+        self.functions = functions
+        self.codes = get_codes(classes, functions)
+        # names of the closure variables and fields of the input the kernel may write to, found
+        # on the first map
+        self.written_closures = None
+        self.written_fields = None
+
+    def is_current(self):
+        return get_codes(self.classes, self.functions) == self.codes
+
+
+class KernelCache:
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+class ClosureCache:
+    # device buffers of closure variables, kept after a map together with the bytes they
+    # hold. a later map over the same object finds its buffer by identity and uses it as is
+    # when the object still packs to the same bytes. a map takes the buffer out while it runs
+    # so maps in flight at the same time never share one
+    def __init__(self, max_size=16):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def take(self, device, obj, data):
+        with self.lock:
+            entry = self.entries.pop((id(obj), device), None)
+        if entry is not None:
+            cached_obj, cached_data, ptr = entry
+            if cached_obj is obj and cached_data == data:
+                with self.lock:
+                    self.hits += 1
+                return ptr
+            device.free(ptr)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, device, obj, data, ptr):
+        # the cache keeps obj alive so that its id is not reused while the entry exists
+        with self.lock:
+            old = self.entries.pop((id(obj), device), None)
+            self.entries[id(obj), device] = (obj, data, ptr)
+            evicted = [(device, old[2])] if old is not None else []
+            while len(self.entries) > self.max_size:
+                (_, old_device), (_, _, old_ptr) = self.entries.popitem(last=False)
+                evicted.append((old_device, old_ptr))
+        for old_device, old_ptr in evicted:
+            free_on(old_device, old_ptr)
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.entries.items())
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+        for (_, device), (_, _, ptr) in entries:
+            free_on(device, ptr)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# shared by every gpumap call in the process
+kernel_cache = KernelCache()
+signature_cache = KernelCache(max_size=256)
+closure_cache = ClosureCache()
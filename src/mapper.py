@@ -1,85 +1,47 @@
 from examiner import FunctionCallExaminer
-from data_model import ExtractedClasses, Functions, ClassRepresentation, convert_float
-from serialization import ListSerializer, ItemSerializer, ListOfListSerializer
+from data_model import ExtractedClasses, Functions, FunctionRepresentation, ClassRepresentation, convert_float, get_layout
+from serialization import ListSerializer, ItemSerializer, ListOfListSerializer, length_format
 from util import time_func
+from stats import logger, current_stats, run_call, MapStats
 from class_def import ClassDefGenerator
 from func_def import FunctionDefGenerator, MethodDefGenerator
+from kernel_cache import kernel_cache, signature_cache, closure_cache, Signature
+from tuner import launch_tuner
+from effects import find_written_closures, find_written_fields
 
-from pycuda import autoinit
-import pycuda.driver as cuda
-from pycuda.compiler import SourceModule
-import os
+import hashlib
 import numpy
+import pickle
+import struct
+import types
 from operator import itemgetter
+from threading import Lock
+from time import perf_counter
 
 from builtin import builtin
-
-
-_main_func = """
-extern "C" {{
-#include <stdio.h>
-__global__ void map_kernel(List<{in_type}> *in, List<{out_type}> *out, int length{closure_params}) {{
-    int thread_id = blockIdx.x * blockDim.x + threadIdx.x;
-    if (thread_id < length) {{
-        {in_type} &in_item = in->items[thread_id];
-        out->items[thread_id] = {func_name}(in_item{closure_args});
-    }}
-}}
-}}
-"""
-
-_foreach_func = """
-extern "C" {{
-#include <stdio.h>
-__global__ void map_kernel(List<{in_type}> *in, int length{closure_params}) {{
-    int thread_id = blockIdx.x * blockDim.x + threadIdx.x;
-    if (thread_id < length) {{
-        {in_type} &in_item = in->items[thread_id];
-        {func_name}(in_item{closure_args});
-    }}
-}}
-}}
-"""
-
-_list_of_list_func = """
-extern "C" {{
-#include <stdio.h>
-__global__ void map_kernel(ListOfLists<{in_type}> *in, List<{out_type}> *out, int length{closure_params}) {{
-    int thread_id = blockIdx.x * blockDim.x + threadIdx.x;
-    if (thread_id < length) {{
-        List_Ptr<{in_type}> in_list = {{in->list_length, &(in->items[thread_id * in->list_length])}};
-        out->items[thread_id] = {func_name}(in_list{closure_args});
-    }}
-}}
-}}
-"""
-
-_list_of_list_foreach = """
-extern "C" {{
-#include <stdio.h>
-__global__ void map_kernel(ListOfLists<{in_type}> *in, int length{closure_params}) {{
-    int thread_id = blockIdx.x * blockDim.x + threadIdx.x;
-    if (thread_id < length) {{
-        List_Ptr<{in_type}> in_list = {{in->list_length, &(in->items[thread_id * in->list_length])}};
-        {func_name}(in_list{closure_args});
-    }}
-}}
-}}
-"""
+from device import get_device
+from gpu_list import GpuList
 
 
 class MapperKernel:
-    def __init__(self, classes, functions, entry_point, list_classes, closure_vars, list_type, kernel):
+    # the first one is launched by get_func
+    func_names = ["map_kernel"]
+
+    def __init__(self, device, classes, functions, entry_point, list_classes, closure_vars, list_type, kernel):
+        self.device = device
         self.classes = classes
         self.functions = functions
-        self.source_module = None
         self.func = None
+        self.funcs = None
+        self.source_hash = None
         self.entry_point = entry_point
-        self.includes = [builtin]
+        self.includes = [device.prelude, builtin]
         self.list_classes = set(list_classes)
         self.closure_vars = closure_vars
         self.list_type = list_type
         self.kernel = kernel
+        # cached kernels are shared by maps running in other threads
+        self.lock = Lock()
 
     def _create_includes(self):
         items = []
@@ -105,18 +67,14 @@ class MapperKernel:
         args = ", ".join(map(lambda v: "*" + v[0], self.closure_vars))
         return ", " + args if args else ""
 
-    def _build_kernel(self):
-        if self.kernel is not None:
-            return self.kernel
-
-        cls_def_gen = ClassDefGenerator()
-
-        kernel = self._create_includes() + "\n"
-
-        kernel += cls_def_gen.all_cpp_class_defs(self.classes)
-
-        func_repr = self.functions.functions[self.entry_point.name]
-        for name, class_repr, is_list in self.closure_vars:
+    def bind_closure_vars(self, functions, func_name, closure_vars):
+        # the closure vars become extra args of the function. works on a copy since the
+        # function representations are shared through the signature cache
+        entry_repr = functions.functions[func_name]
+        func_repr = FunctionRepresentation(entry_repr.name, list(entry_repr.args), list(entry_repr.arg_types),
+                                           entry_repr.return_type, entry_repr.func)
+        functions.functions[func_repr.name] = func_repr
+        for name, class_repr, is_list in closure_vars:
             t = class_repr.raw_type if isinstance(class_repr, ClassRepresentation) else class_repr
             if is_list:
                 func_repr.arg_types.append("List<{type_name}>".format(type_name=t.__name__))
@@ -124,13 +82,30 @@ class MapperKernel:
                 func_repr.arg_types.append(t)
             func_repr.args.append(name)
 
+    def build_definitions(self, functions):
+        cls_def_gen = ClassDefGenerator()
+
+        kernel = self._create_includes() + "\n"
+
+        kernel += cls_def_gen.all_cpp_class_defs(self.classes)
+
         fn_def_gen = FunctionDefGenerator()
-        kernel += fn_def_gen.all_func_protos(self.functions) + "\n"
-        kernel += fn_def_gen.all_func_defs(self.functions) + "\n"
+        kernel += fn_def_gen.all_func_protos(functions) + "\n"
+        kernel += fn_def_gen.all_func_defs(functions) + "\n"
 
         method_gen = MethodDefGenerator()
         for class_repr in self.classes.classes.values():
             kernel += method_gen.all_method_defs(class_repr)
+        return kernel
+
+    def _build_kernel(self):
+        if self.kernel is not None:
+            return self.kernel
+
+        functions = Functions()
+        functions.functions = dict(self.functions.functions)
+        self.bind_closure_vars(functions, self.entry_point.name, self.closure_vars)
+        kernel = self.build_definitions(functions)
 
         in_type = self.entry_point.types[0].__name__ if not isinstance(self.entry_point.types[0], str) else self.entry_point.types[0]
         out_type = self.entry_point.return_type.__name__
@@ -140,53 +115,78 @@ class MapperKernel:
         closure_args = self.create_closure_args()
         if isinstance(self.entry_point.types[0], str):
             if self.entry_point.return_type == type(None):
-                func_def = _list_of_list_foreach
+                func_def = self.device.list_of_list_foreach
             else:
-                func_def = _list_of_list_func
-            print("found list of lists")
+                func_def = self.device.list_of_list_func
             in_type = self.list_type.__name__
         elif self.entry_point.return_type == type(None):
-            func_def = _foreach_func
+            func_def = self.device.foreach_func
         else:
-            func_def = _main_func
-            print("FOUND REAL RETURN TYPE!!")
+            func_def = self.device.main_func
         kernel += func_def.format(in_type=in_type, out_type=out_type,
                                   func_name=func_name, closure_params=closure_params, closure_args=closure_args)
-        #print(kernel)
+        logger.debug("generated kernel\n%s", kernel)
         return kernel
 
     def _build_module(self):
         kernel = time_func("code generator", self._build_kernel)
-        options = []
-        options.append("--std=c++11")
-        options.append("-Wno-deprecated-gpu-targets")
-        self.source_module = SourceModule(kernel, options=options, no_extern_c=True)
-        self.func = self.source_module.get_function("map_kernel")
-
-    def get_func(self):
-        self._build_module()
-        def f(*args, **kwargs):
-            self.func(*args, **kwargs)
-            cuda.Context.synchronize()
+        self.source_hash = hashlib.sha256(kernel.encode("utf-8")).hexdigest()[:16]
+        funcs = time_func("compile", self.device.compile_functions, kernel, self.func_names)
+        self.funcs = dict(zip(self.func_names, funcs))
+        self.func = self.funcs[self.func_names[0]]
+
+    def launch(self, name, args, block, grid, device=None):
+        # cached kernels run on every device with the same cache key, not just the one they were built for
+        device = self.device if device is None else device
+        device.launch(self.funcs[name], args, block, grid)
+
+    def get_func(self, device=None):
+        with self.lock:
+            if self.func is None:
+                self._build_module()
+        device = self.device if device is None else device
+        def f(*args, block, grid):
+            device.launch(self.func, args, block, grid)
         return f
 
 
 class Mapper:
-    def __init__(self, func, _list):
+    max_grid_size = 65535
+    # closure buffers are kept on the device for the next map over the same objects
+    cache_closures = True
+
+    def __init__(self, func, _list, device=None):
+        if isinstance(_list, GpuList):
+            self.in_gpu_list = _list
+            device = _list.device if device is None else device
+            self.candidate_in = _list.sample_object
+        else:
+            self.in_gpu_list = None
+            self.candidate_in = _list[0]
+        self.device = get_device(device)
+        # shared with the other mappers and threads of the same call
+        self.stats = current_stats() or MapStats()
+        self.stats.backend = self.device.name
         self.func = func
-        self.rest = _list[1:]
-        self.candidate_in = _list[0]
+        self.list = _list
+        self.rest = None
+        self.length = None
         self.candidate_out = None
         self.classes = ExtractedClasses()
         self.candidate_out_repr = None
+        # set when the first element was run in python to discover the types
+        self.traced = False
+        # data kept on the device is newer than its python objects, so every element
+        # has to go through the kernel
+        self.resident = self.in_gpu_list is not None or any(
+            isinstance(obj, GpuList) for name, obj in self.get_closure_binding(func))
 
         self.functions = Functions()
         if isinstance(self.candidate_in, list):
             self.candidate_in_repr = self.classes.extract(self.candidate_in[0])
-            self.in_serializer = ListOfListSerializer(self.candidate_in_repr, self.rest)
         else:
             self.candidate_in_repr = self.classes.extract(self.candidate_in)
-            self.in_serializer = ListSerializer(self.candidate_in_repr, self.rest)
+        self.in_serializer = None
         self.out_serializer = None
 
         self.entry_point = None
@@ -200,15 +200,27 @@ class Mapper:
         self.output_bytes_len = None
 
         self.closure_vars = None
+        self.signature = None
+        # the object and the bytes uploaded for each serialized closure variable
+        self.closure_data = {}
 
-    def get_dims(self):
-        total_length = len(self.rest)
-        block_size = 512
+        self.cache_key = None
+        self.cache_hit = False
+
+    def get_dims(self, length=None, block_size=512):
+        # kernels stride over the grid, so longer lists reuse the threads instead of growing it
+        total_length = self.length if length is None else length
         grid_size = total_length // block_size + (1 if total_length % block_size > 0 else 0)
-        return (block_size, 1, 1), (grid_size, 1)
+        return (block_size, 1, 1), (min(grid_size, self.max_grid_size), 1)
 
     def do_first_call(self):
-        self.candidate_out = FunctionCallExaminer.runfunc(self.func, self.candidate_in)
+        if self.resident:
+            # only discovers the types, element 0 is still mapped on the device
+            candidate_in = pickle.loads(pickle.dumps(self.candidate_in))
+            self.candidate_out = FunctionCallExaminer.runfunc(self.get_host_func(), candidate_in)
+        else:
+            self.traced = True
+            self.candidate_out = FunctionCallExaminer.runfunc(self.func, self.candidate_in)
         self.candidate_out_repr = self.classes.extract(self.candidate_out)
 
         called = FunctionCallExaminer.results()
@@ -219,14 +231,86 @@ class Mapper:
         self.functions.add_functions(called)
         return called[0]
 
+    def get_host_func(self):
+        # the same function with closures kept on the device swapped for copies of their python
+        # lists, which must not change before sync()
+        cells = []
+        for name, obj in self.get_closure_binding(self.func):
+            if isinstance(obj, GpuList):
+                obj = pickle.loads(pickle.dumps(obj.get_host_list()))
+            cells.append(types.CellType(obj))
+        return types.FunctionType(self.func.__code__, self.func.__globals__, self.func.__name__,
+                                  self.func.__defaults__, tuple(cells) or None)
+
+    def check_device(self, gpu_list):
+        if gpu_list.device is not self.device:
+            raise ValueError("GPUMAP: GpuList lives on a different device")
+        if gpu_list.ptr is None:
+            raise ValueError("GPUMAP: GpuList was freed")
+
+    def get_signature_key(self):
+        closure_layouts = tuple(map(lambda v: (v[0], get_layout(v[4]), v[5]), self.closure_vars))
+        return (self.func.__code__, isinstance(self.candidate_in, list), get_layout(self.candidate_in_repr),
+                closure_layouts)
+
+    def get_cache_key(self, signature_key, kernel):
+        return self.device.cache_key(), signature_key, self.signature.codes, kernel
+
+    def create_signature(self):
+        return Signature(self.entry_point, self.candidate_out_repr, pickle.dumps(self.candidate_out),
+                         self.classes, self.functions)
+
+    def load_signature(self, signature):
+        # the types are already known so element 0 is mapped along with the rest of the list
+        self.candidate_out = pickle.loads(signature.out_template)
+        self.candidate_out_repr = signature.candidate_out_repr
+        self.classes = signature.classes
+        self.functions = signature.functions
+        return signature.entry_point
+
+    def create_in_serializer(self):
+        if self.in_gpu_list is not None:
+            self.check_device(self.in_gpu_list)
+            self.length = len(self.in_gpu_list)
+            return
+        self.rest = self.list[1:] if self.traced else list(self.list)
+        self.length = len(self.rest)
+        if isinstance(self.candidate_in, list):
+            self.in_serializer = ListOfListSerializer(self.candidate_in_repr, self.rest)
+        else:
+            self.in_serializer = ListSerializer(self.candidate_in_repr, self.rest)
+
+    def to_device(self, data):
+        self.stats.add_bytes_in(len(data))
+        return time_func("transfer", self.device.to_device, data)
+
+    def alloc(self, size):
+        return self.device.alloc(size)
+
+    def from_device(self, ptr, size):
+        data = self.copy_from_device(ptr, size)
+        self.device.free(ptr)
+        return data
+
+    def copy_from_device(self, ptr, size):
+        self.stats.add_bytes_out(size)
+        return time_func("transfer", self.device.from_device, ptr, size)
+
     def serialize_input(self):
+        if self.in_gpu_list is not None:
+            self.in_ptr = self.in_gpu_list.ptr
+            return
         input_bytes = self.in_serializer.to_bytes()
-        self.in_ptr = cuda.to_device(input_bytes)
+        self.in_ptr = self.to_device(input_bytes)
         self.input_bytes_len = len(input_bytes)
 
     def serialize_output(self):
-        output_bytes_len = ListSerializer.project_size(self.candidate_out_repr, self.candidate_out, len(self.rest))
-        self.out_ptr = cuda.mem_alloc(output_bytes_len)
+        output_bytes_len = ListSerializer.project_size(self.candidate_out_repr, self.candidate_out, self.length)
+        if self.in_gpu_list is not None:
+            # the output stays on the device and can be used as a closure, which needs the length header
+            self.out_ptr = self.to_device(struct.pack(length_format, self.length).ljust(output_bytes_len, b"\0"))
+        else:
+            self.out_ptr = self.alloc(output_bytes_len)
         self.output_bytes_len = output_bytes_len
 
     @staticmethod
@@ -239,22 +323,41 @@ class Mapper:
     def prepare_closure_vars(self):
         self.closure_vars = []
         for name, obj in self.get_closure_binding(self.func):
-            print("added ", name, "to closure")
-            if callable(obj):
-                continue
-            elif isinstance(obj, list):
-                class_repr = self.classes.extract(obj[0])
-                serializer = ListSerializer(class_repr, obj)
-                is_list = True
-            else:
-                class_repr = self.classes.extract(obj)
-                serializer = ItemSerializer(class_repr, obj)
-                is_list = False
-
-            data = serializer.to_bytes()
-            data_len = len(data)
-            ptr = cuda.to_device(data)
-            self.closure_vars.append((name, serializer, ptr, data_len, convert_float(class_repr), is_list))
+            self.add_closure_var(name, obj)
+
+    def add_closure_var(self, name, obj):
+        logger.debug("added %s to closure", name)
+        if callable(obj):
+            return
+        elif isinstance(obj, GpuList):
+            # used in place, nothing to serialize or copy back
+            self.check_device(obj)
+            class_repr = self.classes.extract(obj.sample_object)
+            self.closure_vars.append((name, None, obj.ptr, obj.size, convert_float(class_repr), True))
+            return
+        elif isinstance(obj, list):
+            class_repr = self.classes.extract(obj[0])
+            serializer = ListSerializer(class_repr, obj)
+            is_list = True
+        else:
+            class_repr = self.classes.extract(obj)
+            serializer = ItemSerializer(class_repr, obj)
+            is_list = False
+
+        data = serializer.to_bytes()
+        data_len = len(data)
+        ptr = self.upload_closure(obj, data)
+        self.closure_data[name] = (obj, data)
+        self.closure_vars.append((name, serializer, ptr, data_len, convert_float(class_repr), is_list))
+
+    def upload_closure(self, obj, data):
+        # packing is still needed to tell whether python changed obj since the last map
+        if self.cache_closures:
+            ptr = closure_cache.take(self.device, obj, data)
+            if ptr is not None:
+                self.stats.add_closure_cache_hit()
+                return ptr
+        return self.to_device(data)
 
     def prepare_kernel(self, kernel):
         if isinstance(self.candidate_in, list):
@@ -264,66 +367,163 @@ class Mapper:
         list_types = [self.candidate_in_repr, self.candidate_out_repr]
         list_types.extend(map(itemgetter(4), self.closure_vars))
         closure_var_names = list(map(lambda x: (x[0], x[4], x[5]), self.closure_vars))
-        return MapperKernel(self.classes, self.functions, self.entry_point, list_types, closure_var_names, list_type, kernel)
-
-    def prepare_map(self, kernel):
-        print("preparing map!!!")
-        time_func("serialize closure vars", self.prepare_closure_vars)
+        return MapperKernel(self.device, self.classes, self.functions, self.entry_point, list_types, closure_var_names, list_type, kernel)
+
+    def prepare_signature(self):
+        signature_key = self.get_signature_key()
+        signature = signature_cache.get(signature_key)
+        if signature is not None and not signature.is_current():
+            # a function or method it called was redefined since, so it is traced again
+            signature = None
+        self.stats.signature_cache_hit = signature is not None
+        if signature is not None:
+            self.entry_point = self.load_signature(signature)
+        else:
+            self.entry_point = time_func("first_call", self.do_first_call)
+            signature = self.create_signature()
+            signature_cache.put(signature_key, signature)
+        self.signature = signature
+        return signature_key
 
-        self.entry_point = time_func("first_call", self.do_first_call)
+    def check_entry_point(self):
         assert len(self.entry_point.args) == 1 # must be a function with one argument
         assert len(self.entry_point.types) == 1
         assert self.entry_point.cls is None # must not be a method
-        self.out_serializer = ListSerializer(self.candidate_out_repr, length=len(self.rest))
+
+    def load_kernel(self, signature_key, kernel):
+        self.cache_key = self.get_cache_key(signature_key, kernel)
+        self.mapper_kernel = kernel_cache.get(self.cache_key)
+        self.cache_hit = self.mapper_kernel is not None
+        self.stats.kernel_cache_hit = self.cache_hit
+        if not self.cache_hit:
+            self.mapper_kernel = self.prepare_kernel(kernel)
+
+    def get_kernel_func(self):
+        func = self.mapper_kernel.get_func(self.device)
+        if not self.cache_hit:
+            kernel_cache.put(self.cache_key, self.mapper_kernel)
+        return func
+
+    def launch(self, name, args, block, grid):
+        self.mapper_kernel.launch(name, args, block, grid, self.device)
+
+    def prepare_map(self, kernel):
+        time_func("serialize closure vars", self.prepare_closure_vars)
+
+        signature_key = self.prepare_signature()
+        self.check_entry_point()
+        self.create_in_serializer()
+        self.out_serializer = ListSerializer(self.candidate_out_repr, length=self.length)
 
         time_func("serialize input", self.serialize_input)
         if self.entry_point.return_type != type(None):
             self.serialize_output()
-            print("FOUND REAL RETURN TYPE")
 
-        self.mapper_kernel = self.prepare_kernel(kernel)
+        self.load_kernel(signature_key, kernel)
 
     def perform_map(self):
-        func = self.mapper_kernel.get_func()
-        length = numpy.int32(len(self.rest))
-        block_dim, grid_dim = self.get_dims()
-        closure_args = list(map(itemgetter(2), self.closure_vars))
-
+        func = self.get_kernel_func()
+        time_func("run kernel", self.launch_map, func, self.get_kernel_args(), self.length)
+
+    def launch_map(self, func, args, length):
+        # the map kernel runs with the block size the tuner picked for it
+        max_block_size = self.device.max_block_size(self.mapper_kernel.func)
+        key = launch_tuner.get_key(self.mapper_kernel.source_hash, self.device.tuning_key(), length)
+        block_size = launch_tuner.get_block_size(key, max_block_size)
+        block_dim, grid_dim = self.get_dims(length, block_size)
+        start_time = perf_counter()
+        func(*args, block=block_dim, grid=grid_dim)
+        launch_tuner.record(key, block_size, perf_counter() - start_time, max_block_size)
+
+    def get_kernel_args(self):
         args = [self.in_ptr]
         if self.entry_point.return_type != type(None):
             args.append(self.out_ptr)
-        args.append(length)
-        args.extend(closure_args)
-
-        time_func("run kernel", func, *args, block=block_dim, grid=grid_dim)
+        args.append(numpy.int64(self.length))
+        args.extend(map(itemgetter(2), self.closure_vars))
+        return args
+
+    def find_written_closures(self):
+        names = [v[0] for v in self.closure_vars if v[1] is not None]
+        return find_written_closures(self.func, names, self.functions, self.classes)
+
+    def get_written_closures(self):
+        # the analysis only depends on what the signature cache key holds, so it is kept there
+        if self.signature is None:
+            return self.find_written_closures()
+        if self.signature.written_closures is None:
+            self.signature.written_closures = self.find_written_closures()
+        return self.signature.written_closures
+
+    def get_written_fields(self):
+        # fields of the input the kernel may write to, () stands for all of them
+        if self.signature is None:
+            return find_written_fields(self.func, self.functions, self.classes)
+        if self.signature.written_fields is None:
+            self.signature.written_fields = find_written_fields(self.func, self.functions, self.classes)
+        return self.signature.written_fields
+
+    def copy_input_back(self, in_ptr, size):
+        # nothing is copied back for functions that do not write to their argument
+        if not self.get_written_fields():
+            self.device.free(in_ptr)
+            return None
+        return self.from_device(in_ptr, size)
+
+    def unpack_input(self, in_serializer, result_in_bytes):
+        # only the fields the kernel can write are set again
+        written = self.get_written_fields()
+        if isinstance(in_serializer, ListOfListSerializer):
+            return list(in_serializer.list) if result_in_bytes is None else in_serializer.from_bytes(result_in_bytes)
+        if result_in_bytes is None:
+            return list(in_serializer._list)
+        if () in written:
+            return in_serializer.from_bytes(result_in_bytes)
+        return in_serializer.from_bytes(result_in_bytes, written)
 
     def deserialize_closure_vars(self):
+        # closures the kernel cannot write to are not copied back, and their upload is kept on
+        # the device. anything the analysis is not sure about counts as written, so what is
+        # kept always matches the python objects
+        written = self.get_written_closures()
         for name, serializer, ptr, data_len, class_repr, is_list in self.closure_vars:
-            incoming_bytes = bytearray(data_len)
-            cuda.memcpy_dtoh(incoming_bytes, ptr)
-            ptr.free()
-            serializer.from_bytes(incoming_bytes)
+            if serializer is None:
+                continue
+            if name not in written:
+                logger.debug("%s is read only", name)
+                if self.cache_closures:
+                    closure_cache.put(self.device, self.closure_data[name][0], self.closure_data[name][1], ptr)
+                else:
+                    self.device.free(ptr)
+                continue
+            if not self.cache_closures:
+                serializer.from_bytes(self.from_device(ptr, data_len))
+                continue
+            incoming_bytes = self.copy_from_device(ptr, data_len)
+            obj, data = self.closure_data[name]
+            # the python objects only need the fields written when the kernel changed something
+            if incoming_bytes != data:
+                serializer.from_bytes(incoming_bytes)
+            closure_cache.put(self.device, obj, incoming_bytes, ptr)
 
     def unpack_results(self):
-        result_in_bytes = bytearray(self.input_bytes_len)
-        cuda.memcpy_dtoh(result_in_bytes, self.in_ptr)
-        self.in_ptr.free()
+        if self.in_gpu_list is not None:
+            return self.unpack_resident_results()
 
         # unpack into previous objects
-        result_in_list = self.in_serializer.from_bytes(result_in_bytes)
-        result_in_list.insert(0, self.candidate_in)
+        result_in_bytes = self.copy_input_back(self.in_ptr, self.input_bytes_len)
+        result_in_list = self.unpack_input(self.in_serializer, result_in_bytes)
+        if self.traced:
+            result_in_list.insert(0, self.candidate_in)
 
         if self.entry_point.return_type != type(None):
-            print("FOUND REAL RETURN TYPE!!!!!")
-            result_out_bytes = bytearray(self.output_bytes_len)
-            cuda.memcpy_dtoh(result_out_bytes, self.out_ptr)
-            self.out_ptr.free()
+            result_out_bytes = self.from_device(self.out_ptr, self.output_bytes_len)
 
             #unpack into new list since the objects did not exist previously
             result_out_list = self.out_serializer.create_output_list(result_out_bytes, self.candidate_out)
-            result_out_list.insert(0, self.candidate_out)
+            if self.traced:
+                result_out_list.insert(0, self.candidate_out)
         else:
-            print("DID NOT FIND REAL RETURN TYPE")
             result_out_list = [None for _ in result_in_list]
 
         self.deserialize_closure_vars()
@@ -331,12 +531,72 @@ class Mapper:
         return result_in_list, result_out_list
 
 
-def gpumap(func, _list, kernel=None):
-    def do_map():
-        mapper = Mapper(func, _list)
+    def unpack_resident_results(self):
+        # results are left on the device
+        if self.entry_point.return_type != type(None):
+            result_out_list = GpuList.from_device(self.device, self.candidate_out_repr, self.out_ptr,
+                                                  self.output_bytes_len, self.length, self.candidate_out)
+        else:
+            result_out_list = None
+        self.deserialize_closure_vars()
+        return self.in_gpu_list, result_out_list
+
+
+def create_mapper(func, _list, backend=None, chunk_size=None, devices=None):
+    # numpy and pool run python on the host, everything else is a device for the kernel
+    if isinstance(_list, GpuList) and backend in ("numpy", "pool"):
+        raise TypeError("GPUMAP: the %s backend cannot map a GpuList" % backend)
+    if devices is not None:
+        if backend is not None or chunk_size is not None:
+            raise TypeError("GPUMAP: devices cannot be combined with backend or chunk_size")
+        from sharded_mapper import ShardedMapper
+        return ShardedMapper(func, _list, devices)
+    if chunk_size is not None:
+        if backend in ("numpy", "pool"):
+            raise TypeError("GPUMAP: the %s backend cannot map in chunks" % backend)
+        from chunked_mapper import ChunkedMapper
+        return ChunkedMapper(func, _list, chunk_size, device=backend)
+    if backend == "numpy":
+        from numpy_mapper import NumpyMapper
+        return NumpyMapper(func, _list)
+    elif backend == "pool":
+        from pool_mapper import PoolMapper
+        return PoolMapper(func, _list)
+    return Mapper(func, _list, device=backend)
+
+
+def run_mapper(mapper, kernel=None):
+    # the device is made current for the whole map, numpy, pool and sharded maps have no
+    # device of their own
+    device = getattr(mapper, "device", None)
+    if device is not None:
+        device.activate()
+    try:
         mapper.prepare_map(kernel=kernel)
         mapper.perform_map()
-        result_in, result_out = time_func("deserialize", mapper.unpack_results)
-        return result_out
-    return time_func("total", do_map)
-
+        return time_func("deserialize", mapper.unpack_results)
+    finally:
+        if device is not None:
+            device.deactivate()
+
+
+def map_list(func, _list, kernel=None, backend=None, chunk_size=None, devices=None):
+    mapper = create_mapper(func, _list, backend, chunk_size, devices)
+    if current_stats().backend is None:
+        # numpy and pool run without a device
+        current_stats().backend = backend
+    result_in, result_out = run_mapper(mapper, kernel)
+    return result_out
+
+
+def gpumap(func, _list, kernel=None, backend=None, chunk_size=None, devices=None, stats=None):
+    # chunk_size streams the list through the device chunk_size elements at a time, "auto"
+    # sizes the chunks from the free device memory. devices splits the list between several
+    # devices that map their part in parallel. backend="auto" picks the builtin map, the pool
+    # or the default device for each call. stats is filled in with what the call did
+    def do_map():
+        if backend == "auto":
+            from dispatcher import auto_map
+            return auto_map(func, _list, kernel, chunk_size, devices)
+        return map_list(func, _list, kernel, backend, chunk_size, devices)
+    return run_call("gpumap", do_map, stats, len(_list))
@@ -1,9 +1,12 @@
 from mapper import gpumap
-from util import get_time, Results
+from gpu_list import GpuList
+from util import get_time
+from stats import StatsRecorder, add_hook, remove_hook
 
 from random import uniform
 import pickle
 import math
+import os
 
 
 class Body:
@@ -86,8 +89,14 @@ class Simulation:
 
 
 class GPU_Simulation(Simulation):
+    def run(self):
+        # the bodies stay on the device between steps
+        with GpuList(self.bodies) as self.gpu_bodies:
+            Simulation.run(self)
+            self.gpu_bodies.sync()
+
     def advance(self, dt, padding):
-        bodies = self.bodies
+        bodies = self.gpu_bodies
 
         def calc_vel(i):
             b1 = bodies[i]
@@ -125,8 +134,14 @@ class CPU_Simulation(Simulation):
         list(map(update, bodies))
 
 
+# the per call breakdowns of test() go here
+results_dir = os.path.join(os.path.expanduser("~"), ".ivan_results")
+
+
 def test():
     num_steps = 10
+    recorder = StatsRecorder()
+    add_hook(recorder)
     with open("nbodies_out.csv", "w") as f:
         print("num_bodies,gpu_time,cpu_time", file=f)
         num_bodies = 2
@@ -156,9 +171,10 @@ def test():
 
             print("{},{},{}".format(num_bodies, gpu_time, cpu_time), file=f)
             f.flush()
-            Results.output_results("nbody", "num_bodies{}.csv".format(num_bodies))
-            Results.clear_results()
+            recorder.write_csv(os.path.join(results_dir, "nbody", "num_bodies{}.csv".format(num_bodies)))
+            recorder.clear()
             num_bodies *= 2
+    remove_hook(recorder)
 
 
 def warmup():
@@ -176,7 +192,6 @@ def warmup():
     cpu_bodies = body_gen.get_copy()
     cpu_sim = CPU_Simulation(cpu_bodies, num_steps)
     cpu_sim.run()
-    Results.clear_results()
 
 if __name__ == "__main__":
     warmup()
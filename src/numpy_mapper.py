@@ -0,0 +1,616 @@
+from data_model import ExtractedClasses, ClassRepresentation
+from serialization import ListSerializer
+from func_def import parse_function
+from util import time_func
+from stats import logger
+
+import ast
+import builtins
+import math
+import types
+import numpy
+
+
+class VectorizeError(SyntaxError):
+    pass
+
+
+class VectorObject:
+    # one python object per list element, stored as a column per field
+    def __init__(self, cls, fields=None, read_only=False):
+        self.cls = cls
+        self.fields = fields if fields is not None else {}
+        self.read_only = read_only
+
+
+class Frame:
+    def __init__(self, func, local_vars, base_depth):
+        self.func = func
+        self.local_vars = local_vars
+        # masks below base_depth belong to the caller
+        self.base_depth = base_depth
+        self.returned = None
+        self.return_value = None
+
+
+class _Return(Exception):
+    pass
+
+
+class _Break(Exception):
+    pass
+
+
+class _Continue(Exception):
+    pass
+
+
+_numpy_types = {int: numpy.int64, float: numpy.float64, bool: numpy.bool_}
+
+_math_functions = {
+    "exp": numpy.exp,
+    "sin": numpy.sin,
+    "cos": numpy.cos,
+    "tan": numpy.tan,
+    "ceil": numpy.ceil,
+    "floor": numpy.floor,
+    "sqrt": numpy.sqrt,
+    "pow": numpy.power,
+    "log": numpy.log,
+    "log10": numpy.log10,
+    "log1p": numpy.log1p,
+    "log2": numpy.log2,
+}
+
+_bin_ops = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b,
+    ast.LShift: lambda a, b: a << b,
+    ast.RShift: lambda a, b: a >> b,
+    ast.BitOr: lambda a, b: a | b,
+    ast.BitAnd: lambda a, b: a & b,
+    ast.BitXor: lambda a, b: a ^ b,
+}
+
+_compare_ops = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+}
+
+
+_function_nodes = {}
+
+
+def get_function_node(func):
+    if func.__code__ not in _function_nodes:
+        _function_nodes[func.__code__] = parse_function(func).body[0]
+    return _function_nodes[func.__code__]
+
+
+def numpy_type(_type):
+    return _numpy_types[float if _type not in _numpy_types else _type]
+
+
+def is_array(value):
+    return isinstance(value, numpy.ndarray) and value.ndim > 0
+
+
+def select(mask, new, old):
+    if isinstance(new, VectorObject) and isinstance(old, VectorObject):
+        if new is old:
+            return new
+        fields = {}
+        for name in set(new.fields) | set(old.fields):
+            if name not in new.fields or name not in old.fields:
+                raise VectorizeError("GPUMAP: objects merged by a branch must have the same fields")
+            fields[name] = select(mask, new.fields[name], old.fields[name])
+        return VectorObject(new.cls, fields)
+    elif isinstance(new, VectorObject) or isinstance(old, VectorObject) or new is None or old is None:
+        raise VectorizeError("GPUMAP: branches must produce values of the same type")
+    elif not isinstance(new, (int, float, numpy.ndarray, numpy.generic)) or \
+            not isinstance(old, (int, float, numpy.ndarray, numpy.generic)):
+        raise VectorizeError("GPUMAP: cannot select between python objects per element")
+    return numpy.where(mask, new, old)
+
+
+def to_columns(class_repr, _list):
+    data_items = ListSerializer.get_data_items(_list, class_repr)[1:]
+    leaf_types = get_leaf_types(class_repr)
+    num_fields = len(leaf_types)
+    return [numpy.array(data_items[i::num_fields], dtype=numpy_type(t)) for i, t in enumerate(leaf_types)]
+
+
+def get_leaf_types(class_repr):
+    if not isinstance(class_repr, ClassRepresentation):
+        return [class_repr]
+    leaf_types = []
+    for _type in class_repr.field_types:
+        leaf_types.extend(get_leaf_types(_type))
+    return leaf_types
+
+
+def from_columns(class_repr, columns, read_only=False):
+    columns = iter(columns)
+    return _from_columns(class_repr, columns, read_only)
+
+
+def _from_columns(class_repr, columns, read_only):
+    if not isinstance(class_repr, ClassRepresentation):
+        return next(columns)
+    fields = {}
+    for name, _type in zip(class_repr.field_names, class_repr.field_types):
+        fields[name] = _from_columns(_type, columns, read_only)
+    return VectorObject(class_repr.raw_type, fields, read_only)
+
+
+def flatten(class_repr, value, length):
+    # columns in the same order as ListSerializer.get_data_items
+    columns = []
+    _flatten(class_repr, value, length, columns)
+    return columns
+
+
+def _flatten(class_repr, value, length, columns):
+    if not isinstance(class_repr, ClassRepresentation):
+        if isinstance(value, VectorObject):
+            raise VectorizeError("GPUMAP: expected a primitive but found an object")
+        column = numpy.broadcast_to(numpy.asarray(value), (length,)).astype(numpy_type(class_repr))
+        columns.append(column)
+        return
+    if not isinstance(value, VectorObject):
+        raise VectorizeError("GPUMAP: expected an object of type %s" % class_repr.name)
+    for name, _type in zip(class_repr.field_names, class_repr.field_types):
+        if name not in value.fields:
+            raise VectorizeError("GPUMAP: field %s was never assigned" % name)
+        _flatten(_type, value.fields[name], length, columns)
+
+
+def interleave(columns, length):
+    data_items = [None] * (length * len(columns))
+    for i, column in enumerate(columns):
+        data_items[i::len(columns)] = column.tolist()
+    return data_items
+
+
+class VectorEvaluator(ast.NodeVisitor):
+    def __init__(self, length):
+        self.length = length
+        self.masks = []
+        self.frames = []
+        self.loop_depths = []
+        self.gathered = {}
+
+    @property
+    def frame(self):
+        return self.frames[-1]
+
+    def combine(self, masks):
+        if not masks:
+            return None
+        mask = masks[0]
+        for m in masks[1:]:
+            mask = mask & m
+        return mask
+
+    def current_mask(self):
+        mask = self.combine(self.masks)
+        if self.frame.returned is not None:
+            mask = ~self.frame.returned if mask is None else mask & ~self.frame.returned
+        return mask
+
+    def local_mask(self):
+        mask = self.combine(self.masks[self.frame.base_depth:])
+        if self.frame.returned is not None:
+            mask = ~self.frame.returned if mask is None else mask & ~self.frame.returned
+        return mask
+
+    def call(self, func, args):
+        if not isinstance(func, types.FunctionType):
+            raise VectorizeError("GPUMAP: cannot vectorize call to %s" % func)
+        node = get_function_node(func)
+        params = [arg.arg for arg in node.args.args]
+        if len(params) != len(args) or node.args.vararg or node.args.kwarg or node.args.kwonlyargs:
+            raise VectorizeError("GPUMAP: %s must be called with exactly its positional args" % func.__name__)
+
+        entry_mask = self.current_mask() if self.frames else None
+        if entry_mask is not None:
+            self.masks.append(entry_mask)
+        frame = Frame(func, dict(zip(params, args)), len(self.masks))
+        self.frames.append(frame)
+        try:
+            self.run_body(node.body)
+            if frame.returned is not None and frame.return_value is not None:
+                entry = self.combine(self.masks[:frame.base_depth])
+                missing = ~frame.returned if entry is None else entry & ~frame.returned
+                if missing.any():
+                    raise VectorizeError("GPUMAP: every path must return a value")
+        except _Return:
+            pass
+        finally:
+            self.frames.pop()
+            if entry_mask is not None:
+                self.masks.pop()
+        return frame.return_value
+
+    def run_body(self, body):
+        for stmt in body:
+            self.visit(stmt)
+
+    def generic_visit(self, node):
+        raise VectorizeError("GPUMAP: numpy backend does not support %s" % type(node).__name__)
+
+    def lookup(self, name):
+        frame = self.frame
+        if name in frame.local_vars:
+            return frame.local_vars[name]
+        func = frame.func
+        if func.__closure__ and name in func.__code__.co_freevars:
+            return func.__closure__[func.__code__.co_freevars.index(name)].cell_contents
+        if name in func.__globals__:
+            return func.__globals__[name]
+        if hasattr(builtins, name):
+            return getattr(builtins, name)
+        raise VectorizeError("GPUMAP: no such variable found: " + name)
+
+    # statements
+
+    def visit_Expr(self, node):
+        self.visit(node.value)
+
+    def visit_Pass(self, node):
+        pass
+
+    def visit_Return(self, node):
+        value = self.visit(node.value) if node.value is not None else None
+        frame = self.frame
+        mask = self.local_mask()
+        if mask is None:
+            frame.return_value = value
+            raise _Return()
+
+        if frame.returned is None:
+            frame.return_value = value
+        elif (value is None) != (frame.return_value is None):
+            raise VectorizeError("GPUMAP: every path must return a value")
+        elif value is not None:
+            frame.return_value = select(mask, value, frame.return_value)
+        frame.returned = mask if frame.returned is None else frame.returned | mask
+
+        if len(self.masks) == frame.base_depth:
+            raise _Return()
+
+    def assign(self, target, value):
+        if isinstance(target, ast.Name):
+            local_vars = self.frame.local_vars
+            mask = self.current_mask()
+            if mask is not None and target.id in local_vars:
+                value = select(mask, value, local_vars[target.id])
+            local_vars[target.id] = value
+        elif isinstance(target, ast.Attribute):
+            obj = self.visit(target.value)
+            if not isinstance(obj, VectorObject) or obj.read_only:
+                raise VectorizeError("GPUMAP: numpy backend cannot write to closure variables")
+            mask = self.current_mask()
+            if mask is not None and target.attr in obj.fields:
+                value = select(mask, value, obj.fields[target.attr])
+            obj.fields[target.attr] = value
+        else:
+            raise VectorizeError("GPUMAP: numpy backend only supports assignment into names and fields")
+
+    def visit_Assign(self, node):
+        if len(node.targets) > 1:
+            raise VectorizeError("GPUMAP: multiple assignment not supported")
+        self.assign(node.targets[0], self.visit(node.value))
+
+    def visit_AugAssign(self, node):
+        value = self.bin_op(node.op, self.visit(node.target), self.visit(node.value))
+        self.assign(node.target, value)
+
+    def visit_If(self, node):
+        test = self.visit(node.test)
+        if not is_array(test):
+            self.run_body(node.body if test else node.orelse)
+            return
+
+        test = test.astype(bool)
+        mask = self.current_mask()
+        for branch_mask, body in ((test, node.body), (~test, node.orelse)):
+            active = branch_mask if mask is None else branch_mask & mask
+            if not body or not active.any():
+                continue
+            self.masks.append(branch_mask)
+            try:
+                self.run_body(body)
+            finally:
+                self.masks.pop()
+
+    def run_loop_body(self, body):
+        self.loop_depths.append(len(self.masks))
+        try:
+            self.run_body(body)
+        except _Continue:
+            pass
+        finally:
+            self.loop_depths.pop()
+
+    def visit_For(self, node):
+        if not isinstance(node.target, ast.Name) or node.orelse:
+            raise VectorizeError("GPUMAP: Only one variable can be assigned in a for loop!")
+        if isinstance(node.iter, ast.Call) and isinstance(node.iter.func, ast.Name) and node.iter.func.id == "range":
+            bounds = list(map(self.visit, node.iter.args))
+            if any(map(is_array, bounds)):
+                raise VectorizeError("GPUMAP: range bounds must be the same for every element")
+            items = range(*map(int, bounds))
+        else:
+            items = self.visit(node.iter)
+            if not isinstance(items, list):
+                raise VectorizeError("GPUMAP: numpy backend can only loop over closure lists")
+        try:
+            for item in items:
+                self.frame.local_vars[node.target.id] = item
+                self.run_loop_body(node.body)
+        except _Break:
+            pass
+
+    def visit_While(self, node):
+        if node.orelse:
+            raise VectorizeError("GPUMAP: while ... else not supported")
+        try:
+            while True:
+                test = self.visit(node.test)
+                if is_array(test):
+                    raise VectorizeError("GPUMAP: while conditions must be the same for every element")
+                if not test:
+                    break
+                self.run_loop_body(node.body)
+        except _Break:
+            pass
+
+    def visit_Break(self, node):
+        if not self.loop_depths or len(self.masks) != self.loop_depths[-1]:
+            raise VectorizeError("GPUMAP: break inside a per-element branch not supported")
+        raise _Break()
+
+    def visit_Continue(self, node):
+        if not self.loop_depths or len(self.masks) != self.loop_depths[-1]:
+            raise VectorizeError("GPUMAP: continue inside a per-element branch not supported")
+        raise _Continue()
+
+    # expressions
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, bool)):
+            raise VectorizeError("GPUMAP: numpy backend does not support %r literals" % type(node.value).__name__)
+        return node.value
+
+    def visit_Num(self, node):
+        return node.n
+
+    def visit_NameConstant(self, node):
+        return node.value
+
+    def visit_Name(self, node):
+        return self.lookup(node.id)
+
+    def visit_Attribute(self, node):
+        obj = self.visit(node.value)
+        if isinstance(obj, VectorObject):
+            if node.attr not in obj.fields:
+                raise VectorizeError("GPUMAP: field %s was never assigned" % node.attr)
+            return obj.fields[node.attr]
+        if is_array(obj):
+            raise VectorizeError("GPUMAP: cannot get attribute %s of a primitive" % node.attr)
+        return getattr(obj, node.attr)
+
+    def visit_Index(self, node):
+        return self.visit(node.value)
+
+    def visit_Subscript(self, node):
+        _list = self.visit(node.value)
+        index = self.visit(node.slice)
+        if not isinstance(_list, list):
+            raise VectorizeError("GPUMAP: numpy backend can only index closure lists")
+        if not is_array(index):
+            return _list[index]
+
+        # every element reads a different item so the list is gathered into columns
+        if id(_list) not in self.gathered:
+            class_repr = ExtractedClasses().extract(_list[0])
+            self.gathered[id(_list)] = (class_repr, to_columns(class_repr, _list))
+        class_repr, columns = self.gathered[id(_list)]
+        index = index.astype(numpy.int64)
+        # masked off elements may hold indices their branch was guarding against
+        mask = self.current_mask()
+        if mask is not None:
+            index = numpy.where(mask, index, 0)
+        if numpy.any((index >= len(_list)) | (index < -len(_list))):
+            raise VectorizeError("GPUMAP: index out of range")
+        return from_columns(class_repr, [column[index] for column in columns], read_only=True)
+
+    def bin_op(self, op, left, right):
+        if type(op) not in _bin_ops:
+            raise VectorizeError("GPUMAP: %s is not supported" % type(op).__name__)
+        if isinstance(left, VectorObject) or isinstance(right, VectorObject):
+            raise VectorizeError("GPUMAP: operators are only supported on primitives")
+        return _bin_ops[type(op)](left, right)
+
+    def visit_BinOp(self, node):
+        return self.bin_op(node.op, self.visit(node.left), self.visit(node.right))
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            return numpy.logical_not(operand) if is_array(operand) else not operand
+        elif isinstance(node.op, ast.USub):
+            return -operand
+        elif isinstance(node.op, ast.UAdd):
+            return +operand
+        else:
+            return ~operand
+
+    def visit_BoolOp(self, node):
+        values = list(map(self.visit, node.values))
+        if not any(map(is_array, values)):
+            result = values[0]
+            for value in values[1:]:
+                result = (result and value) if isinstance(node.op, ast.And) else (result or value)
+            return result
+        op = numpy.logical_and if isinstance(node.op, ast.And) else numpy.logical_or
+        result = values[0]
+        for value in values[1:]:
+            result = op(result, value)
+        return result
+
+    def visit_Compare(self, node):
+        left = self.visit(node.left)
+        result = None
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _compare_ops:
+                raise VectorizeError("GPUMAP: %s is not supported" % type(op).__name__)
+            right = self.visit(comparator)
+            value = _compare_ops[type(op)](left, right)
+            result = value if result is None else numpy.logical_and(result, value)
+            left = right
+        return result
+
+    def visit_IfExp(self, node):
+        test = self.visit(node.test)
+        if not is_array(test):
+            return self.visit(node.body) if test else self.visit(node.orelse)
+        return select(test.astype(bool), self.visit(node.body), self.visit(node.orelse))
+
+    def visit_Call(self, node):
+        if node.keywords:
+            raise SyntaxError("GPUMAP: keywords not supported")
+        func_node = node.func
+        if isinstance(func_node, ast.Attribute):
+            receiver = self.visit(func_node.value)
+            args = list(map(self.visit, node.args))
+            if receiver is math:
+                if func_node.attr not in _math_functions:
+                    raise VectorizeError("GPUMAP: math.%s is not supported" % func_node.attr)
+                return _math_functions[func_node.attr](*args)
+            if isinstance(receiver, VectorObject):
+                method = getattr(receiver.cls, func_node.attr)
+            elif isinstance(receiver, (list, numpy.ndarray, numpy.generic, int, float, types.ModuleType)):
+                raise VectorizeError("GPUMAP: cannot call %s" % func_node.attr)
+            else:
+                method = getattr(type(receiver), func_node.attr)
+            return self.call(method, [receiver] + args)
+
+        func = self.visit(func_node)
+        if func is print:
+            return None
+        args = list(map(self.visit, node.args))
+        if func is len:
+            return len(args[0])
+        elif func is int or func is float or func is bool:
+            value = args[0]
+            if is_array(value):
+                return value.astype(numpy_type(func))
+            return func(value)
+        elif func is abs:
+            return numpy.abs(args[0])
+        elif func is min or func is max:
+            op = numpy.minimum if func is min else numpy.maximum
+            result = args[0]
+            for arg in args[1:]:
+                result = op(result, arg)
+            return result
+        elif isinstance(func, type):
+            obj = VectorObject(func)
+            self.call(func.__init__, [obj] + args)
+            return obj
+        else:
+            return self.call(func, args)
+
+
+class NumpyMapper:
+    backend = "numpy"
+    fallback = None
+
+    def __init__(self, func, _list):
+        self.func = func
+        self.list = _list
+        self.rest = _list[1:]
+        self.candidate_in = _list[0]
+        self.candidate_out = None
+        self.classes = ExtractedClasses()
+        self.candidate_in_repr = None
+        self.candidate_out_repr = None
+
+        self.columns = None
+        self.result = None
+        self.in_value = None
+        self.fallback_mapper = None
+        # set when the fallback backend also maps the first element
+        self.fallback_whole = False
+
+    def start_fallback(self, _list, reason):
+        from mapper import create_mapper
+        logger.debug("falling back from numpy backend: %s", reason)
+        self.fallback_mapper = create_mapper(self.func, _list, self.fallback)
+        self.fallback_mapper.prepare_map(kernel=None)
+
+    def prepare_map(self, kernel=None):
+        if isinstance(self.candidate_in, list):
+            self.fallback_whole = True
+            self.start_fallback(self.list, "lists of lists are not supported")
+            return
+        self.candidate_in_repr = self.classes.extract(self.candidate_in)
+        self.columns = time_func("serialize input", to_columns, self.candidate_in_repr, self.rest)
+        self.candidate_out = time_func("first_call", self.func, self.candidate_in)
+        if self.candidate_out is not None:
+            self.candidate_out_repr = self.classes.extract(self.candidate_out)
+
+    def vectorize(self):
+        self.in_value = from_columns(self.candidate_in_repr, self.columns)
+        evaluator = VectorEvaluator(len(self.rest))
+        with numpy.errstate(all="ignore"):
+            self.result = evaluator.call(self.func, [self.in_value])
+        if (self.result is None) != (self.candidate_out is None):
+            raise VectorizeError("GPUMAP: functions must always or never return a value")
+
+    def perform_map(self):
+        if self.fallback_mapper is None and self.rest:
+            try:
+                time_func("run kernel", self.vectorize)
+            except (VectorizeError, TypeError, AttributeError, IndexError) as e:
+                # nothing has been written back yet so the rest of the list can be mapped elsewhere
+                self.start_fallback(self.rest, e)
+        if self.fallback_mapper is not None:
+            self.fallback_mapper.perform_map()
+
+    def unpack_results(self):
+        if self.fallback_mapper is not None:
+            result_in_list, result_out_list = self.fallback_mapper.unpack_results()
+            if self.fallback_whole:
+                return result_in_list, result_out_list
+        elif not self.rest:
+            result_in_list, result_out_list = [], []
+        else:
+            length = len(self.rest)
+            if isinstance(self.candidate_in_repr, ClassRepresentation):
+                columns = flatten(self.candidate_in_repr, self.in_value, length)
+                ListSerializer(self.candidate_in_repr, self.rest).from_data_items(interleave(columns, length))
+            result_in_list = list(self.rest)
+
+            if self.candidate_out is None:
+                result_out_list = [None for _ in self.rest]
+            else:
+                columns = flatten(self.candidate_out_repr, self.result, length)
+                out_serializer = ListSerializer(self.candidate_out_repr, length=length)
+                result_out_list = out_serializer.create_output_list_from_data_items(interleave(columns, length),
+                                                                                   self.candidate_out)
+        result_in_list.insert(0, self.candidate_in)
+        result_out_list.insert(0, self.candidate_out)
+        return result_in_list, result_out_list
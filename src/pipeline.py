@@ -0,0 +1,341 @@
+from examiner import FunctionCallExaminer
+from data_model import Functions, FunctionRepresentation, convert_float, get_layout, int64_t
+from serialization import ListSerializer, length_format
+from util import time_func, indent
+from stats import run_call
+from kernel_cache import signature_cache
+from effects import find_written_closures
+from mapper import Mapper, MapperKernel, run_mapper
+from gpu_list import GpuList
+from compaction import define_compaction_kernels, compaction_funcs
+from scanner import Scan
+
+import numpy
+import struct
+
+
+def get_stage_names(stages):
+    # name of the function each stage calls in the kernel. closures made by the same factory
+    # share a __name__ but not their closure variables, so every function object gets its own
+    funcs = []
+    names = []
+    for kind, func in stages:
+        if not any(f is func for f in funcs):
+            funcs.append(func)
+        index = next(i for i, f in enumerate(funcs) if f is func)
+        names.append("stage{index}_{name}".format(index=index, name=func.__name__))
+    return names
+
+
+class PipelineKernel(MapperKernel):
+    # calls the translated stage functions back to back in one thread, the intermediate
+    # values are locals of the kernel and never leave the device
+    func_names = ["map_kernel"] + compaction_funcs
+
+    def __init__(self, device, classes, functions, stages, entry_points, stage_closures, closure_vars, kernel):
+        MapperKernel.__init__(self, device, classes, functions, entry_points, [], closure_vars, None, kernel)
+        self.stages = stages
+        self.stage_names = get_stage_names(stages)
+        self.stage_closures = stage_closures
+
+    def get_stage_closure_args(self, func_name):
+        args = ", ".join(map(lambda v: "*" + v[1], self.stage_closures[func_name]))
+        return ", " + args if args else ""
+
+    def get_value_type(self):
+        # type of the values that come out of the last stage
+        value_type = self.entry_point[0].types[0]
+        for (kind, func), entry_point in zip(self.stages, self.entry_point):
+            if kind == "map":
+                value_type = entry_point.return_type
+        return convert_float(value_type).__name__
+
+    def create_body(self, in_type):
+        lines = [indent(1) + "if (thread_id < length) {",
+                 indent(2) + "{type} &in_item = in->items[thread_id];".format(type=in_type),
+                 indent(2) + "keep->items[thread_id] = 0;"]
+        depth = 2
+        value = "in_item"
+        for i, ((kind, func), entry_point, stage_name) in enumerate(zip(self.stages, self.entry_point, self.stage_names)):
+            call = "{name}({value}{closure_args})".format(name=stage_name, value=value,
+                                                         closure_args=self.get_stage_closure_args(stage_name))
+            if kind == "map":
+                type_name = convert_float(entry_point.return_type).__name__
+                lines.append(indent(depth) + "{type} value{i} = {call};".format(type=type_name, i=i, call=call))
+                value = "value%d" % i
+            else:
+                lines.append(indent(depth) + "if ({call}) {{".format(call=call))
+                depth += 1
+        if value != "in_item":
+            lines.append(indent(depth) + "out->items[thread_id] = {value};".format(value=value))
+        lines.append(indent(depth) + "keep->items[thread_id] = 1;")
+        while depth > 1:
+            depth -= 1
+            lines.append(indent(depth) + "}")
+        return "\n".join(lines)
+
+    def _build_kernel(self):
+        if self.kernel is not None:
+            return self.kernel
+
+        functions = Functions()
+        functions.functions = dict(self.functions.functions)
+        for entry_point, stage_name in zip(self.entry_point, self.stage_names):
+            if self.stage_closures[stage_name]:
+                # only the stage function can be called without its closure variables
+                functions.functions.pop(entry_point.name, None)
+            functions.functions[stage_name] = FunctionRepresentation(
+                stage_name, entry_point.args, list(map(convert_float, entry_point.types)),
+                convert_float(entry_point.return_type), entry_point.function)
+        for func_name, closures in self.stage_closures.items():
+            closure_vars = list(map(lambda v: (v[0], v[2], v[3]), closures))
+            self.bind_closure_vars(functions, func_name, closure_vars)
+        kernel = self.build_definitions(functions)
+
+        in_type = convert_float(self.entry_point[0].types[0]).__name__
+        value_type = self.get_value_type()
+        params = "List<{type}> *in".format(type=in_type)
+        if any(kind == "map" for kind, func in self.stages):
+            params += ", List<{type}> *out".format(type=value_type)
+        params += ", List<int64_t> *keep, int64_t length" + self.create_closure_params()
+        kernel += 'extern "C" {\n'
+        kernel += self.device.define_kernel("map_kernel", params, self.create_body(in_type))
+        kernel += define_compaction_kernels(self.device, value_type)
+        kernel += "}\n"
+        return kernel
+
+
+
+class PipelineMapper(Mapper):
+    # self.entry_point holds one entry point per stage
+    def __init__(self, stages, _list, device=None):
+        if isinstance(_list, GpuList):
+            raise TypeError("GPUMAP: pipelines cannot run over a GpuList")
+        if _list and isinstance(_list[0], list):
+            raise TypeError("GPUMAP: pipelines do not support lists of lists")
+        self.stages = stages
+        self.empty = not _list
+        if self.empty:
+            return
+        Mapper.__init__(self, stages[0][1], _list, device)
+        # elements mapped in python while discovering the types
+        self.num_traced = 0
+        self.traced_out = []
+        self.stage_closures = None
+        self.keep_ptr = None
+        self.keep_bytes_len = None
+        self.compact_ptr = None
+        self.indices_ptr = None
+
+    def get_stage_funcs(self):
+        return dict(zip(get_stage_names(self.stages), [func for kind, func in self.stages]))
+
+    def has_output(self):
+        return any(kind == "map" for kind, func in self.stages)
+
+    def prepare_closure_vars(self):
+        # kernel params are prefixed with the function name, stages may use the same closure names
+        self.closure_vars = []
+        self.stage_closures = {}
+        for func_name, func in self.get_stage_funcs().items():
+            closures = []
+            for name, obj in self.get_closure_binding(func):
+                if isinstance(obj, GpuList):
+                    raise TypeError("GPUMAP: pipelines do not support GpuList closures")
+                param_name = "{func}_{name}".format(func=func_name, name=name)
+                num_closure_vars = len(self.closure_vars)
+                self.add_closure_var(param_name, obj)
+                if len(self.closure_vars) > num_closure_vars:
+                    class_repr, is_list = self.closure_vars[-1][4:]
+                    closures.append((name, param_name, class_repr, is_list))
+            self.stage_closures[func_name] = closures
+
+    def find_written_closures(self):
+        written = set()
+        for func_name, func in self.get_stage_funcs().items():
+            closures = self.stage_closures[func_name]
+            names = find_written_closures(func, [name for name, param_name, class_repr, is_list in closures],
+                                          self.functions, self.classes)
+            written.update(param_name for name, param_name, class_repr, is_list in closures if name in names)
+        return written
+
+    def get_signature_key(self):
+        closure_layouts = tuple(map(lambda v: (v[0], get_layout(v[4]), v[5]), self.closure_vars))
+        stages = tuple((kind, func.__code__) for kind, func in self.stages)
+        return stages, get_layout(self.candidate_in_repr), closure_layouts
+
+    def do_first_call(self):
+        # elements run in python until every stage has seen one, filters can drop the first few
+        self.traced = True
+        entry_points = [None] * len(self.stages)
+        last_map = max([i for i, (kind, func) in enumerate(self.stages) if kind == "map"], default=None)
+        for item in self.list:
+            self.num_traced += 1
+            value = item
+            for i, (kind, func) in enumerate(self.stages):
+                result = FunctionCallExaminer.runfunc(func, value)
+                if entry_points[i] is None:
+                    if kind == "map":
+                        self.classes.extract(result)
+                    called = FunctionCallExaminer.results()
+                    self.classes.add_methods(called)
+                    self.functions.add_functions(called)
+                    entry_points[i] = called[0]
+                if i == last_map and self.candidate_out is None:
+                    self.candidate_out = result
+                    self.candidate_out_repr = self.classes.extract(result)
+                if kind == "filter" and not result:
+                    break
+                elif kind == "map":
+                    value = result
+            else:
+                self.traced_out.append(value)
+            if None not in entry_points:
+                break
+        return entry_points
+
+    def check_entry_point(self):
+        for (kind, func), entry_point in zip(self.stages, self.entry_point):
+            assert len(entry_point.args) == 1 # must be a function with one argument
+            assert len(entry_point.types) == 1
+            assert entry_point.cls is None # must not be a method
+            if kind == "map" and entry_point.return_type == type(None):
+                raise SyntaxError("GPUMAP: pipeline map functions must return a value")
+
+    def create_in_serializer(self):
+        self.rest = self.list[self.num_traced:]
+        self.length = len(self.rest)
+        self.in_serializer = ListSerializer(self.candidate_in_repr, self.rest)
+
+    def serialize_keep(self):
+        self.keep_bytes_len = ListSerializer.project_size(int64_t, None, self.length)
+        self.keep_ptr = self.alloc(self.keep_bytes_len)
+
+    def prepare_kernel(self, kernel):
+        closure_var_names = list(map(lambda x: (x[0], x[4], x[5]), self.closure_vars))
+        return PipelineKernel(self.device, self.classes, self.functions, self.stages, self.entry_point,
+                              self.stage_closures, closure_var_names, kernel)
+
+    def prepare_map(self, kernel=None):
+        if self.empty:
+            return
+        time_func("serialize closure vars", self.prepare_closure_vars)
+
+        signature_key = self.get_signature_key()
+        signature = signature_cache.get(signature_key)
+        if signature is not None and not signature.is_current():
+            signature = None
+        self.stats.signature_cache_hit = signature is not None
+        if signature is not None:
+            self.entry_point = self.load_signature(signature)
+        else:
+            self.entry_point = time_func("first_call", self.do_first_call)
+            if None in self.entry_point:
+                # the whole list went through python before every stage was reached
+                self.rest = []
+                return
+            signature = self.create_signature()
+            signature_cache.put(signature_key, signature)
+        self.signature = signature
+        self.check_entry_point()
+        self.create_in_serializer()
+        if not self.rest:
+            return
+
+        time_func("serialize input", self.serialize_input)
+        if self.has_output():
+            self.out_serializer = ListSerializer(self.candidate_out_repr, length=self.length)
+            self.serialize_output()
+        self.serialize_keep()
+        self.load_kernel(signature_key, kernel)
+
+    def perform_map(self):
+        if not self.empty and self.rest:
+            Mapper.perform_map(self)
+            time_func("compact", self.compact)
+
+    def get_values(self):
+        if self.has_output():
+            return self.out_ptr, self.output_bytes_len
+        return self.in_ptr, self.input_bytes_len
+
+    def compact(self):
+        # gathers the kept values to the front so only those are copied back
+        Scan(self, self.launch, int64_t).run(self.keep_ptr, self.keep_ptr, self.length)
+        values_ptr, values_len = self.get_values()
+        self.compact_ptr = self.alloc(values_len)
+        self.indices_ptr = self.alloc(self.keep_bytes_len)
+        block_dim, grid_dim = self.get_dims()
+        self.launch("gather_kernel", [numpy.int64(self.length), values_ptr, self.keep_ptr, self.compact_ptr,
+                                      self.indices_ptr, numpy.int64(self.length)], block_dim, grid_dim)
+        self.device.free(self.keep_ptr)
+
+    def get_kernel_args(self):
+        # map_kernel is a define_kernel kernel, it takes its number of threads first
+        args = [numpy.int64(self.length), self.in_ptr]
+        if self.has_output():
+            args.append(self.out_ptr)
+        args.append(self.keep_ptr)
+        args.append(numpy.int64(self.length))
+        args.extend(map(lambda v: v[2], self.closure_vars))
+        return args
+
+    def unpack_results(self):
+        if self.empty:
+            return [], []
+        if not self.rest:
+            # nothing ran on the device, the closures were never written to
+            return list(self.list), self.traced_out
+
+        header = self.device.from_device(self.compact_ptr, struct.calcsize(length_format))
+        count = struct.unpack(length_format, header)[0]
+        if self.has_output():
+            # the maps may have written to their input
+            result_in_list = self.in_serializer.from_bytes(self.from_device(self.in_ptr, self.input_bytes_len))
+            values_bytes = self.from_device(self.compact_ptr,
+                                            ListSerializer.project_size(self.candidate_out_repr, None, count))
+            self.device.free(self.out_ptr)
+            self.device.free(self.indices_ptr)
+            values = ListSerializer(self.candidate_out_repr, length=count).create_output_list(values_bytes,
+                                                                                              self.candidate_out)
+        else:
+            # only the kept elements are unpacked, into their own objects
+            result_in_list = self.rest
+            indices = ListSerializer(int64_t, length=count).from_bytes(
+                self.from_device(self.indices_ptr, ListSerializer.project_size(int64_t, None, count)))
+            values_bytes = self.from_device(self.compact_ptr,
+                                            ListSerializer.project_size(self.candidate_in_repr, None, count))
+            self.device.free(self.in_ptr)
+            kept = [self.rest[i] for i in indices]
+            values = ListSerializer(self.candidate_in_repr, kept).from_bytes(values_bytes)
+        result_out_list = self.traced_out + values
+        self.deserialize_closure_vars()
+        return self.list[:self.num_traced] + result_in_list, result_out_list
+
+
+class Pipeline:
+    def __init__(self, _list, backend=None, stages=()):
+        self.list = _list
+        self.backend = backend
+        self.stages = tuple(stages)
+
+    def map(self, func):
+        return Pipeline(self.list, self.backend, self.stages + (("map", func),))
+
+    def filter(self, func):
+        return Pipeline(self.list, self.backend, self.stages + (("filter", func),))
+
+    def collect(self, kernel=None, stats=None):
+        if not self.stages:
+            return list(self.list)
+        if self.backend in ("numpy", "pool"):
+            raise TypeError("GPUMAP: the %s backend cannot run pipelines" % self.backend)
+
+        def do_map():
+            result_in, result_out = run_mapper(PipelineMapper(self.stages, self.list, device=self.backend), kernel)
+            return result_out
+        return run_call("pipeline", do_map, stats, len(self.list))
+
+
+def gpu_pipeline(_list, backend=None):
+    return Pipeline(_list, backend)
@@ -0,0 +1,286 @@
+from data_model import ExtractedClasses
+from serialization import ListSerializer
+from util import time_func
+
+from multiprocessing import shared_memory
+from threading import Lock
+import multiprocessing
+import threading
+import importlib
+import dis
+import itertools
+import marshal
+import pickle
+import struct
+import types
+import os
+
+
+# state handed to workers forked for one map, keyed by a token so concurrent maps do not collide
+_worker_states = {}
+_tokens = itertools.count()
+
+# the pool shared by every map whose function can be sent to its workers, with its size
+_pool = None
+_pool_processes = None
+_pool_lock = Lock()
+
+
+def get_global_names(code):
+    # (name, attribute) for every global code reads, attribute is what is read from it next in
+    # case it is a module. functions and comprehensions defined in code are included
+    names = set()
+    instructions = list(dis.get_instructions(code))
+    for i, instruction in enumerate(instructions):
+        if instruction.opname in ("LOAD_GLOBAL", "LOAD_NAME"):
+            following = instructions[i + 1] if i + 1 < len(instructions) else None
+            attr = following.argval if following and following.opname in ("LOAD_ATTR", "LOAD_METHOD") else None
+            names.add((instruction.argval, attr))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= get_global_names(const)
+    return names
+
+
+def add_func(func, funcs, values):
+    # adds func and the functions it reads from globals to funcs, and the current value of every
+    # global they read to values, by module
+    if id(func) in funcs:
+        return
+    closure = tuple(cell.cell_contents for cell in func.__closure__ or ())
+    funcs[id(func)] = (marshal.dumps(func.__code__), func.__module__, func.__name__, func.__defaults__, closure)
+    for name, attr in get_global_names(func.__code__):
+        if name not in func.__globals__:
+            continue
+        module, value = func.__module__, func.__globals__[name]
+        if isinstance(value, types.ModuleType):
+            if attr is None or not hasattr(value, attr):
+                continue
+            module, name, value = value.__name__, attr, getattr(value, attr)
+            if isinstance(value, types.ModuleType):
+                continue
+        if isinstance(value, types.FunctionType):
+            add_func(value, funcs, values)
+            values.setdefault(module, {})[name] = ("func", id(value))
+        else:
+            values.setdefault(module, {})[name] = ("value", value)
+
+
+def dump_func(func):
+    # functions go to the shared pool as their code and closure values, with the functions and
+    # globals they read as they are now. the workers were started before and keep the modules
+    # they imported then. None when this cannot be pickled, e.g. closures over nested functions,
+    # or for functions defined in __main__
+    if func.__module__ == "__main__":
+        return None
+    funcs = {}
+    values = {}
+    try:
+        add_func(func, funcs, values)
+        return pickle.dumps((id(func), funcs, values))
+    except (pickle.PicklingError, TypeError, AttributeError, ValueError):
+        return None
+
+
+def load_func(data):
+    # brings the modules of the worker up to date with the globals that were sent along
+    root, funcs, values = pickle.loads(data)
+    built = {}
+    for key, (code, module, name, defaults, closure) in funcs.items():
+        cells = tuple(types.CellType(value) for value in closure)
+        built[key] = types.FunctionType(marshal.loads(code), importlib.import_module(module).__dict__, name,
+                                        defaults, cells)
+    for module, names in values.items():
+        module_globals = importlib.import_module(module).__dict__
+        for name, (kind, value) in names.items():
+            module_globals[name] = built[value] if kind == "func" else value
+    return built[root]
+
+
+def can_fork():
+    # forking while other threads may hold locks leaves them locked in the child
+    return "fork" in multiprocessing.get_all_start_methods() and threading.current_thread() is threading.main_thread()
+
+
+def can_map(func):
+    return dump_func(func) is not None or can_fork()
+
+
+def get_pool(processes):
+    # created on first use. workers are forked from the main thread and started by a fork
+    # server from any other thread
+    global _pool, _pool_processes
+    with _pool_lock:
+        if _pool is None or _pool_processes != processes:
+            if _pool is not None:
+                _pool.terminate()
+            method = "fork" if can_fork() else "forkserver"
+            _pool = multiprocessing.get_context(method).Pool(processes)
+            _pool_processes = processes
+        return _pool
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def pack_list(class_repr, _list, buffer, offset):
+    serializer = ListSerializer(class_repr, _list)
+    struct.pack_into(serializer.format, buffer, offset, *ListSerializer.get_data_items(_list, class_repr))
+
+
+def unpack_new_list(class_repr, length, buffer, offset, sample_object):
+    serializer = ListSerializer(class_repr, length=length)
+    data_items = list(struct.unpack_from(serializer.format, buffer, offset))[1:]
+    return serializer.create_output_list_from_data_items(data_items, sample_object)
+
+
+def unpack_into_list(class_repr, _list, buffer, offset):
+    serializer = ListSerializer(class_repr, _list)
+    data_items = list(struct.unpack_from(serializer.format, buffer, offset))[1:]
+    return serializer.from_data_items(data_items)
+
+
+def _run_chunk(task):
+    token, chunk_idx, state = task
+    if state is None:
+        # inherited from the process that forked this worker for the map
+        state = _worker_states[token]
+        func = state.func
+    else:
+        func = load_func(state.func)
+    start, end, in_offset, out_offset = state.chunks[chunk_idx]
+    shm = shared_memory.SharedMemory(name=state.shm_name)
+    try:
+        buffer = shm.buf
+        items = unpack_new_list(state.in_repr, end - start, buffer, in_offset, state.candidate_in)
+        results = list(map(func, items))
+        pack_list(state.in_repr, items, buffer, in_offset)
+        if state.out_repr is not None:
+            pack_list(state.out_repr, results, buffer, out_offset)
+        del buffer
+    finally:
+        shm.close()
+    return chunk_idx
+
+
+class PoolMapper:
+    # maps go to one shared pool when their function can be sent to it, the others fork a
+    # pool of their own so that the closures are inherited. that only happens on the main
+    # thread. writes that workers make to closure variables stay in the worker
+    backend = "pool"
+    processes = None
+    chunks_per_process = 4
+
+    def __init__(self, func, _list):
+        self.func = func
+        self.list = _list
+        self.rest = _list[1:]
+        self.candidate_in = _list[0]
+        self.candidate_out = None
+        self.classes = ExtractedClasses()
+        self.in_repr = None
+        self.out_repr = None
+        self.candidate_in_template = None
+
+        self.shm = None
+        self.chunks = None
+
+    def get_chunk_ranges(self, processes):
+        num_chunks = max(1, min(len(self.rest), processes * self.chunks_per_process))
+        chunk_size = -(-len(self.rest) // num_chunks)
+        return [(start, min(start + chunk_size, len(self.rest))) for start in range(0, len(self.rest), chunk_size)]
+
+    def layout_chunks(self, processes):
+        # every chunk is its own serialized list so workers can unpack it without the rest
+        self.chunks = []
+        offset = 0
+        for start, end in self.get_chunk_ranges(processes):
+            in_offset = offset
+            offset = _align(in_offset + struct.calcsize(ListSerializer(self.in_repr, length=end - start).format))
+            out_offset = offset
+            if self.out_repr is not None:
+                offset = _align(out_offset + ListSerializer.project_size(self.out_repr, self.candidate_out, end - start))
+            self.chunks.append((start, end, in_offset, out_offset))
+        return offset
+
+    def serialize_input(self, processes):
+        size = self.layout_chunks(processes)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for start, end, in_offset, out_offset in self.chunks:
+            pack_list(self.in_repr, self.rest[start:end], self.shm.buf, in_offset)
+
+    def prepare_map(self, kernel=None):
+        if isinstance(self.candidate_in, list):
+            raise TypeError("GPUMAP: pool backend does not support lists of lists")
+        self.in_repr = self.classes.extract(self.candidate_in)
+        # workers rebuild elements from a pristine copy of the first one
+        self.candidate_in_template = pickle.loads(pickle.dumps(self.candidate_in))
+        self.candidate_out = time_func("first_call", self.func, self.candidate_in)
+        if self.candidate_out is not None:
+            self.out_repr = self.classes.extract(self.candidate_out)
+
+        if self.rest:
+            time_func("serialize input", self.serialize_input, self.processes or os.cpu_count() or 1)
+
+    def perform_map(self):
+        if not self.rest:
+            return
+        try:
+            func_data = dump_func(self.func)
+            if func_data is not None:
+                state = _WorkerState(func_data, self.shm.name, self.chunks, self.in_repr, self.out_repr,
+                                     self.candidate_in_template)
+                pool = get_pool(self.processes)
+                time_func("run kernel", pool.map, _run_chunk, [(None, i, state) for i in range(len(self.chunks))])
+            else:
+                self.fork_map()
+        except BaseException:
+            self.release()
+            raise
+
+    def fork_map(self):
+        if not can_fork():
+            raise TypeError("GPUMAP: the pool backend can only map %s from the main thread" % self.func.__name__)
+        token = next(_tokens)
+        _worker_states[token] = _WorkerState(self.func, self.shm.name, self.chunks, self.in_repr, self.out_repr,
+                                             self.candidate_in_template)
+        try:
+            with multiprocessing.get_context("fork").Pool(self.processes) as pool:
+                time_func("run kernel", pool.map, _run_chunk, [(token, i, None) for i in range(len(self.chunks))])
+        finally:
+            del _worker_states[token]
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def unpack_results(self):
+        result_in_list = list(self.rest)
+        result_out_list = []
+        if self.rest:
+            try:
+                buffer = self.shm.buf
+                for start, end, in_offset, out_offset in self.chunks:
+                    unpack_into_list(self.in_repr, self.rest[start:end], buffer, in_offset)
+                    if self.out_repr is not None:
+                        result_out_list.extend(unpack_new_list(self.out_repr, end - start, buffer, out_offset,
+                                                               self.candidate_out))
+            finally:
+                self.release()
+        if self.out_repr is None:
+            result_out_list = [None for _ in self.rest]
+        result_in_list.insert(0, self.candidate_in)
+        result_out_list.insert(0, self.candidate_out)
+        return result_in_list, result_out_list
+
+
+class _WorkerState:
+    # func is the function itself for forked pools and dump_func's bytes for the shared one
+    def __init__(self, func, shm_name, chunks, in_repr, out_repr, candidate_in):
+        self.func = func
+        self.shm_name = shm_name
+        self.chunks = chunks
+        self.in_repr = in_repr
+        self.out_repr = out_repr
+        self.candidate_in = candidate_in
@@ -0,0 +1,232 @@
+from examiner import FunctionCallExaminer
+from data_model import Functions, convert_float
+from serialization import ListSerializer, ItemSerializer
+from util import time_func
+from stats import run_call
+from mapper import Mapper, MapperKernel, run_mapper
+from gpu_list import GpuList
+
+import numpy
+import pickle
+
+
+# every thread folds a run of width items, thread 0 of the first pass also folds in the head
+_reduce_body = """
+    int64_t start = thread_id * width;
+    if (start < length) {{
+        int64_t end = start + width < length ? start + width : length;
+        {type} value = in->items[start];
+        for (int64_t i = start + 1; i < end; i++) {{
+            value = {func_name}(value, in->items[i]{closure_args});
+        }}
+        if (has_head && thread_id == 0) {{
+            value = {func_name}(*head, value{closure_args});
+        }}
+        out->items[thread_id] = value;
+    }}"""
+
+# threads per block of the shared memory kernels, their shared arrays are sized for it
+shared_block_size = 256
+
+# the shared array of a block, raw bytes since the item classes cannot be constructed there
+_shared_items = """
+        __shared__ __align__(16) unsigned char shared_bytes[{block_size} * sizeof({type})];
+        {type} *shared_items = reinterpret_cast<{type} *>(shared_bytes);
+        int64_t block_start = block * blockDim.x * width;
+        int64_t block_runs = (length - block_start + width - 1) / width;
+        if (block_runs > blockDim.x) {{
+            block_runs = blockDim.x;
+        }}
+        int64_t start = block_start + threadIdx.x * width;
+        int64_t end = start + width < length ? start + width : length;"""
+
+# with shared memory every thread of a block folds its run into the shared array, then the
+# block folds neighbouring pairs in log(block size) steps. the pairs keep their order, so the
+# combiner only has to be associative
+_block_reduce_body = _shared_items + """
+        if (threadIdx.x < block_runs) {{
+            {type} value = in->items[start];
+            for (int64_t i = start + 1; i < end; i++) {{
+                value = {func_name}(value, in->items[i]{closure_args});
+            }}
+            shared_items[threadIdx.x] = value;
+        }}
+        __syncthreads();
+        for (int64_t step = 1; step < block_runs; step *= 2) {{
+            if (threadIdx.x % (2 * step) == 0 && threadIdx.x + step < block_runs) {{
+                shared_items[threadIdx.x] = {func_name}(shared_items[threadIdx.x],
+                                                        shared_items[threadIdx.x + step]{closure_args});
+            }}
+            __syncthreads();
+        }}
+        if (threadIdx.x == 0) {{
+            {type} value = shared_items[0];
+            if (has_head && block == 0) {{
+                value = {func_name}(*head, value{closure_args});
+            }}
+            out->items[block] = value;
+        }}"""
+
+
+class ReduceKernel(MapperKernel):
+    def _build_kernel(self):
+        if self.kernel is not None:
+            return self.kernel
+
+        functions = Functions()
+        functions.functions = dict(self.functions.functions)
+        self.bind_closure_vars(functions, self.entry_point.name, self.closure_vars)
+        kernel = self.build_definitions(functions)
+
+        item_type = convert_float(self.entry_point.return_type).__name__
+        params = "List<{type}> *in, List<{type}> *out, {type} *head, int has_head, int64_t length, int width"
+        params = params.format(type=item_type) + self.create_closure_params()
+        kernel += 'extern "C" {\n'
+        if self.device.shared_memory:
+            body = _block_reduce_body.format(type=item_type, func_name=self.entry_point.name,
+                                             closure_args=self.create_closure_args(), block_size=shared_block_size)
+            kernel += self.device.define_block_kernel("map_kernel", params, body)
+        else:
+            body = _reduce_body.format(type=item_type, func_name=self.entry_point.name,
+                                       closure_args=self.create_closure_args())
+            kernel += self.device.define_kernel("map_kernel", params, body)
+        kernel += "}\n"
+        return kernel
+
+
+class Reducer(Mapper):
+    # the combiner has to be associative, the passes fold neighbouring runs of the list. a
+    # pass leaves one item for every run, or for every block of runs on devices with shared
+    # memory
+    width = 32
+
+    def __init__(self, func, _list, initial=None, device=None):
+        Mapper.__init__(self, func, _list, device)
+        self.initial = initial
+        # everything folded before the device part of the list
+        self.head = None
+        self.head_ptr = None
+
+    def get_signature_key(self):
+        return ("reduce",) + Mapper.get_signature_key(self)
+
+    def get_head_args(self):
+        if self.initial is not None:
+            return self.initial, self.list[0]
+        return self.list[0], self.list[1]
+
+    def do_first_call(self):
+        if self.resident:
+            # only discovers the types, the whole list is reduced on the device
+            args = [pickle.loads(pickle.dumps(self.candidate_in)) for _ in range(2)]
+            self.candidate_out = FunctionCallExaminer.runfunc(self.get_host_func(), *args)
+        else:
+            self.traced = True
+            self.candidate_out = FunctionCallExaminer.runfunc(self.func, *self.get_head_args())
+            self.head = self.candidate_out
+        self.candidate_out_repr = self.classes.extract(self.candidate_out)
+
+        called = FunctionCallExaminer.results()
+        self.classes.add_methods(called)
+        self.functions.add_functions(called)
+        return called[0]
+
+    def check_entry_point(self):
+        assert len(self.entry_point.args) == 2 # must be a function with two arguments
+        assert self.entry_point.cls is None # must not be a method
+        if self.entry_point.return_type is not type(self.candidate_in):
+            raise TypeError("GPUMAP: the combiner must return the type of the list items")
+
+    def create_in_serializer(self):
+        if self.in_gpu_list is not None:
+            Mapper.create_in_serializer(self)
+            return
+        num_folded = 0 if self.resident else 1 if self.initial is not None else 2
+        self.rest = self.list[num_folded:]
+        self.length = len(self.rest)
+        self.in_serializer = ListSerializer(self.candidate_in_repr, self.rest)
+
+    def serialize_head(self):
+        # the kernel always takes a head, it is ignored when there is none
+        head = self.head if self.head is not None else self.candidate_out
+        self.head_ptr = self.to_device(ItemSerializer(self.candidate_out_repr, head).to_bytes())
+
+    def prepare_kernel(self, kernel):
+        closure_var_names = list(map(lambda x: (x[0], x[4], x[5]), self.closure_vars))
+        return ReduceKernel(self.device, self.classes, self.functions, self.entry_point, [], closure_var_names,
+                            None, kernel)
+
+    def prepare_map(self, kernel=None):
+        time_func("serialize closure vars", self.prepare_closure_vars)
+
+        signature_key = self.prepare_signature()
+        if self.resident:
+            self.head = self.initial
+        elif not self.traced:
+            self.head = self.func(*self.get_head_args())
+        self.check_entry_point()
+        self.create_in_serializer()
+        if not self.length:
+            return
+
+        time_func("serialize input", self.serialize_input)
+        self.serialize_head()
+        self.load_kernel(signature_key, kernel)
+
+    def perform_map(self):
+        if not self.length:
+            return
+        time_func("run kernel", self.reduce, self.get_kernel_func())
+
+    def get_group_dims(self, length, width):
+        # the number of items left after a pass over length items and its launch dimensions
+        if self.device.shared_memory:
+            num_groups = -(-length // (width * shared_block_size))
+            return (num_groups,) + self.get_dims(num_groups * shared_block_size, shared_block_size)
+        num_groups = -(-length // width)
+        return (num_groups,) + self.get_dims(num_groups)
+
+    def reduce(self, func):
+        # block level runs first, every further pass reduces the partial results until one is left
+        in_ptr = self.in_ptr
+        length = self.length
+        has_head = self.head is not None
+        closure_args = list(map(lambda v: v[2], self.closure_vars))
+        while True:
+            num_partials, block_dim, grid_dim = self.get_group_dims(length, self.width)
+            out_ptr = self.alloc(ListSerializer.project_size(self.candidate_out_repr, None, num_partials))
+            args = [numpy.int64(num_partials), in_ptr, out_ptr, self.head_ptr, numpy.int32(has_head),
+                    numpy.int64(length), numpy.int32(self.width)]
+            func(*(args + closure_args), block=block_dim, grid=grid_dim)
+            if in_ptr is not self.in_ptr or self.in_gpu_list is None:
+                self.device.free(in_ptr)
+            in_ptr, length, has_head = out_ptr, num_partials, False
+            if length == 1:
+                break
+        self.out_ptr = in_ptr
+
+    def unpack_results(self):
+        if not self.length:
+            result = self.head
+        else:
+            self.device.free(self.head_ptr)
+            result_bytes = self.from_device(self.out_ptr, ListSerializer.project_size(self.candidate_out_repr, None, 1))
+            result = ListSerializer(self.candidate_out_repr, length=1).create_output_list(result_bytes,
+                                                                                         self.candidate_out)[0]
+        self.deserialize_closure_vars()
+        return self.list, result
+
+
+def gpureduce(func, _list, initial=None, kernel=None, backend=None, stats=None):
+    if backend in ("numpy", "pool"):
+        raise TypeError("GPUMAP: the %s backend cannot reduce" % backend)
+    if not isinstance(_list, GpuList) and len(_list) < (1 if initial is not None else 2):
+        # nothing to combine
+        if not _list and initial is None:
+            raise TypeError("GPUMAP: cannot reduce an empty list without an initial value")
+        return initial if initial is not None else _list[0]
+
+    def do_reduce():
+        result_in, result = run_mapper(Reducer(func, _list, initial, device=backend), kernel)
+        return result
+    return run_call("gpureduce", do_reduce, stats, len(_list))
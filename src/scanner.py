@@ -0,0 +1,247 @@
+from data_model import Functions, convert_float
+from serialization import ListSerializer, length_format
+from util import time_func
+from stats import run_call
+from mapper import MapperKernel, run_mapper
+from reducer import Reducer, shared_block_size, _shared_items
+from gpu_list import GpuList
+
+import numpy
+import struct
+
+
+# every thread scans a run of width items and leaves the total of its run in sums
+_scan_runs_body = """
+    int64_t start = thread_id * width;
+    if (start < length) {{
+        int64_t end = start + width < length ? start + width : length;
+        {type} value = in->items[start];
+        if (has_head && thread_id == 0) {{
+            value = {combine_head};
+        }}
+        out->items[start] = value;
+        for (int64_t i = start + 1; i < end; i++) {{
+            value = {combine_next};
+            out->items[i] = value;
+        }}
+        sums->items[thread_id] = value;
+    }}"""
+
+# once the run totals are scanned, everything before a run is folded into it
+_add_offsets_body = """
+    int64_t run = thread_id / width;
+    if (thread_id < length && run > 0) {{
+        out->items[thread_id] = {combine_offset};
+    }}"""
+
+# with shared memory the run totals of a block are scanned in the shared array in log(block
+# size) steps, then everything before a run in its block is folded into it. sums gets the
+# total of every block instead of every run
+_block_scan_body = _shared_items + """
+        if (threadIdx.x < block_runs) {{
+            {type} value = in->items[start];
+            if (has_head && start == 0) {{
+                value = {combine_head};
+            }}
+            out->items[start] = value;
+            for (int64_t i = start + 1; i < end; i++) {{
+                value = {combine_next};
+                out->items[i] = value;
+            }}
+            shared_items[threadIdx.x] = value;
+        }}
+        __syncthreads();
+        for (int64_t step = 1; step < block_runs; step *= 2) {{
+            int active = threadIdx.x >= step && threadIdx.x < block_runs;
+            {type} value = shared_items[threadIdx.x];
+            if (active) {{
+                value = {combine_step};
+            }}
+            __syncthreads();
+            if (active) {{
+                shared_items[threadIdx.x] = value;
+            }}
+            __syncthreads();
+        }}
+        if (threadIdx.x > 0 && threadIdx.x < block_runs) {{
+            {type} offset = shared_items[threadIdx.x - 1];
+            for (int64_t i = start; i < end; i++) {{
+                out->items[i] = {combine_block_offset};
+            }}
+        }}
+        if (threadIdx.x == block_runs - 1) {{
+            sums->items[block] = shared_items[threadIdx.x];
+        }}"""
+
+_shift_body = """
+    if (thread_id < length) {
+        out->items[thread_id] = thread_id == 0 ? *head : in->items[thread_id - 1];
+    }"""
+
+scan_funcs = ["scan_runs", "add_offsets"]
+
+
+def define_scan_kernels(device, item_type, combine, closure_params=""):
+    # combine builds the c expression that folds two values
+    scan_params = "List<{type}> *in, List<{type}> *out, List<{type}> *sums, {type} *head, int has_head, int64_t length, int width"
+    scan_params = scan_params.format(type=item_type) + closure_params
+    if device.shared_memory:
+        kernels = device.define_block_kernel("scan_runs", scan_params, _block_scan_body.format(
+            type=item_type, block_size=shared_block_size,
+            combine_head=combine("*head", "value"),
+            combine_next=combine("value", "in->items[i]"),
+            combine_step=combine("shared_items[threadIdx.x - step]", "value"),
+            combine_block_offset=combine("offset", "out->items[i]")))
+    else:
+        kernels = device.define_kernel("scan_runs", scan_params,
+                                       _scan_runs_body.format(type=item_type,
+                                                              combine_head=combine("*head", "value"),
+                                                              combine_next=combine("value", "in->items[i]")))
+    offset_params = "List<{type}> *out, List<{type}> *sums, int64_t length, int width"
+    kernels += device.define_kernel("add_offsets", offset_params.format(type=item_type) + closure_params,
+                                    _add_offsets_body.format(combine_offset=combine("sums->items[run - 1]",
+                                                                                    "out->items[thread_id]")))
+    return kernels
+
+
+class Scan:
+    # work efficient inclusive scan over a list on the device. the run totals are scanned the
+    # same way, so it takes a few passes of O(n) work instead of log(n) passes over everything.
+    # on devices with shared memory the totals are of whole blocks of runs
+    width = 32
+
+    def __init__(self, mapper, launch, item_repr, closure_args=()):
+        self.mapper = mapper
+        self.launch = launch
+        self.item_repr = item_repr
+        self.closure_args = list(closure_args)
+
+    def run(self, in_ptr, out_ptr, length, head_ptr=None):
+        # in and out may be the same buffer
+        group_width = self.width
+        if self.mapper.device.shared_memory:
+            group_width *= shared_block_size
+        num_runs = -(-length // group_width)
+        sums_ptr = self.mapper.alloc(ListSerializer.project_size(self.item_repr, None, num_runs))
+        has_head = head_ptr is not None
+        if self.mapper.device.shared_memory:
+            block_dim, grid_dim = self.mapper.get_dims(num_runs * shared_block_size, shared_block_size)
+        else:
+            block_dim, grid_dim = self.mapper.get_dims(num_runs)
+        args = [numpy.int64(num_runs), in_ptr, out_ptr, sums_ptr, head_ptr if has_head else sums_ptr,
+                numpy.int32(has_head), numpy.int64(length), numpy.int32(self.width)]
+        self.launch("scan_runs", args + self.closure_args, block_dim, grid_dim)
+        if num_runs > 1:
+            self.run(sums_ptr, sums_ptr, num_runs)
+            block_dim, grid_dim = self.mapper.get_dims(length)
+            args = [numpy.int64(length), out_ptr, sums_ptr, numpy.int64(length), numpy.int32(group_width)]
+            self.launch("add_offsets", args + self.closure_args, block_dim, grid_dim)
+        self.mapper.device.free(sums_ptr)
+
+
+class ScanKernel(MapperKernel):
+    func_names = scan_funcs + ["shift_kernel"]
+
+    def _build_kernel(self):
+        if self.kernel is not None:
+            return self.kernel
+
+        functions = Functions()
+        functions.functions = dict(self.functions.functions)
+        self.bind_closure_vars(functions, self.entry_point.name, self.closure_vars)
+        kernel = self.build_definitions(functions)
+
+        item_type = convert_float(self.entry_point.return_type).__name__
+        func_name = self.entry_point.name
+        closure_args = self.create_closure_args()
+        combine = lambda a, b: "{func}({a}, {b}{closure_args})".format(func=func_name, a=a, b=b,
+                                                                        closure_args=closure_args)
+        kernel += 'extern "C" {\n'
+        kernel += define_scan_kernels(self.device, item_type, combine, self.create_closure_params())
+        kernel += self.device.define_kernel("shift_kernel",
+                                            "List<{type}> *in, List<{type}> *out, {type} *head, int64_t length".format(
+                                                type=item_type), _shift_body)
+        kernel += "}\n"
+        return kernel
+
+
+class Scanner(Reducer):
+    def __init__(self, func, _list, initial=None, exclusive=False, device=None):
+        Reducer.__init__(self, func, _list, initial, device)
+        self.exclusive = exclusive
+
+    def get_signature_key(self):
+        return ("scan",) + Reducer.get_signature_key(self)[1:]
+
+    def prepare_kernel(self, kernel):
+        closure_var_names = list(map(lambda x: (x[0], x[4], x[5]), self.closure_vars))
+        return ScanKernel(self.device, self.classes, self.functions, self.entry_point, [], closure_var_names,
+                          None, kernel)
+
+    def alloc_list(self, length):
+        size = ListSerializer.project_size(self.candidate_out_repr, None, length)
+        if self.in_gpu_list is not None:
+            # stays on the device, so it needs its length header
+            return self.to_device(struct.pack(length_format, length).ljust(size, b"\0")), size
+        return self.alloc(size), size
+
+    def perform_map(self):
+        if not self.length:
+            return
+        self.get_kernel_func()
+        time_func("run kernel", self.scan)
+
+    def scan(self):
+        closure_args = map(lambda v: v[2], self.closure_vars)
+        self.out_ptr, self.output_bytes_len = self.alloc_list(self.length)
+        scan = Scan(self, self.launch, self.candidate_out_repr, closure_args)
+        scan.run(self.in_ptr, self.out_ptr, self.length, self.head_ptr if self.head is not None else None)
+        if self.in_gpu_list is None:
+            self.device.free(self.in_ptr)
+        if self.exclusive:
+            inclusive_ptr = self.out_ptr
+            self.out_ptr, self.output_bytes_len = self.alloc_list(self.length)
+            block_dim, grid_dim = self.get_dims()
+            self.launch("shift_kernel", [numpy.int64(self.length), inclusive_ptr, self.out_ptr, self.head_ptr,
+                                         numpy.int64(self.length)], block_dim, grid_dim)
+            self.device.free(inclusive_ptr)
+        self.device.free(self.head_ptr)
+
+    def get_prefix(self):
+        # the results computed in python before the device part of the list
+        if self.resident:
+            return []
+        elif self.exclusive:
+            return [self.initial]
+        elif self.initial is not None:
+            return [self.head]
+        return [self.list[0], self.head]
+
+    def unpack_results(self):
+        if self.in_gpu_list is not None:
+            result_out_list = GpuList.from_device(self.device, self.candidate_out_repr, self.out_ptr,
+                                                  self.output_bytes_len, self.length, self.candidate_out)
+        elif not self.length:
+            result_out_list = self.get_prefix()
+        else:
+            result_out_bytes = self.from_device(self.out_ptr, self.output_bytes_len)
+            out_serializer = ListSerializer(self.candidate_out_repr, length=self.length)
+            result_out_list = self.get_prefix() + out_serializer.create_output_list(result_out_bytes,
+                                                                                    self.candidate_out)
+        self.deserialize_closure_vars()
+        return self.list, result_out_list
+
+
+def gpuscan(func, _list, exclusive=False, initial=None, kernel=None, backend=None, stats=None):
+    # exclusive scans start with initial, so they need one
+    if backend in ("numpy", "pool"):
+        raise TypeError("GPUMAP: the %s backend cannot scan" % backend)
+    if exclusive and initial is None:
+        raise TypeError("GPUMAP: exclusive scans need an initial value")
+    if not isinstance(_list, GpuList) and len(_list) < (1 if initial is not None else 2):
+        return list(_list)
+
+    def do_scan():
+        result_in, result_out = run_mapper(Scanner(func, _list, initial, exclusive, device=backend), kernel)
+        return result_out
+    return run_call("gpuscan", do_scan, stats, len(_list))
@@ -1,5 +1,8 @@
 from data_model import ClassRepresentation, primitive_map
 
+# every list starts with its length, which is an int64_t on the device
+length_format = "q"
+
 import struct
 import pickle
 
@@ -68,7 +71,7 @@ class ListSerializer:
             format = primitive_map[class_repr]
         else:
             format = class_repr.get_format()
-        return "".join("i" if i == 0 else format for i in range(length+1))
+        return "".join(length_format if i == 0 else format for i in range(length+1))
 
     @staticmethod
     def get_data_items(_list, class_repr):
@@ -95,12 +98,29 @@ class ListSerializer:
     @staticmethod
     def project_size(class_repr, candidate_obj, list_length):
         format = primitive_map[class_repr] if class_repr in primitive_map else class_repr.get_format()
-        return struct.calcsize("i" + format * list_length)
+        return struct.calcsize(length_format + format * list_length)
 
-    def from_bytes(self, _bytes):
+    def from_bytes(self, _bytes, written=None):
         data_items = list(struct.unpack(self.format, _bytes))[1:] # skip list length
+        return self.from_data_items(data_items, written)
+
+    @staticmethod
+    def get_field_paths(class_repr, prefix=()):
+        # paths of the primitive fields in the order they are packed
+        paths = []
+        for field, _type in zip(class_repr.field_names, class_repr.field_types):
+            if isinstance(_type, ClassRepresentation):
+                paths.extend(ListSerializer.get_field_paths(_type, prefix + (field,)))
+            else:
+                paths.append(prefix + (field,))
+        return paths
+
+    def from_data_items(self, data_items, written=None):
+        # written limits the fields that are set to the ones under these paths
         if not isinstance(self.class_repr, ClassRepresentation):
             return data_items
+        elif written is not None:
+            return self._insert_fields(data_items, written)
         else:
             # unpacks into the same objects
             output_list = self._list
@@ -109,10 +129,26 @@ class ListSerializer:
                 self._insert_data(item, self.class_repr, data_items)
             return output_list
 
+    def _insert_fields(self, data_items, written):
+        paths = self.get_field_paths(self.class_repr)
+        fields = [(i, path[:-1], path[-1]) for i, path in enumerate(paths)
+                  if any(path[:len(written_path)] == written_path for written_path in written)]
+        for n, item in enumerate(self._list):
+            start = n * len(paths)
+            for i, parents, field in fields:
+                obj = item
+                for parent in parents:
+                    obj = obj.__dict__[parent]
+                obj.__dict__[field] = data_items[start + i]
+        return self._list
+
     def create_output_list(self, _bytes, sample_object):
         # unpacks into a new list
         format = self.get_format(self.class_repr, self.length)
         data_items = list(struct.unpack(format, _bytes))[1:] # skip list length
+        return self.create_output_list_from_data_items(data_items, sample_object)
+
+    def create_output_list_from_data_items(self, data_items, sample_object):
         if not isinstance(self.class_repr, ClassRepresentation):
             return data_items
         else:
@@ -148,7 +184,7 @@ class ListOfListSerializer:
         else:
             fmt = primitive_map[self.class_repr]
 
-        return "i" + fmt * (num_lists * list_len)
+        return length_format + fmt * (num_lists * list_len)
 
     @staticmethod
     def get_data_items(_list, class_repr):
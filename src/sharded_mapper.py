@@ -0,0 +1,67 @@
+from mapper import Mapper
+from device import get_device
+from gpu_list import GpuList
+from stats import collecting
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ShardMapper(Mapper):
+    # every device gets its own copy of the closure variables, so writes to them cannot be
+    # merged and are dropped like with the pool backend. the copies are not cached since they
+    # no longer match the python objects afterwards
+    cache_closures = False
+    def deserialize_closure_vars(self):
+        for name, serializer, ptr, data_len, class_repr, is_list in self.closure_vars:
+            if serializer is not None:
+                self.device.free(ptr)
+
+
+class ShardedMapper:
+    # splits the list into one contiguous shard per device and maps the shards in parallel
+    def __init__(self, func, _list, devices):
+        if isinstance(_list, GpuList):
+            raise TypeError("GPUMAP: a GpuList lives on one device and cannot be sharded")
+        if not devices:
+            raise ValueError("GPUMAP: no devices to shard over")
+        self.devices = [get_device(device) for device in devices]
+        shard_size = -(-len(_list) // len(self.devices))
+        self.mappers = [ShardMapper(func, _list[start:start + shard_size], device)
+                        for start, device in zip(range(0, len(_list), shard_size), self.devices)]
+        self.kernel = None
+        self.results = None
+
+    def prepare_map(self, kernel):
+        # the first shard traces and compiles, the others find its signature and kernel in the caches
+        self.kernel = kernel
+        device = self.mappers[0].device
+        device.activate()
+        try:
+            self.mappers[0].prepare_map(kernel)
+            self.mappers[0].get_kernel_func()
+        finally:
+            device.deactivate()
+
+    def run_shard(self, mapper):
+        mapper.device.activate()
+        try:
+            # the phases of every shard go to the stats of the call
+            with collecting(mapper.stats):
+                if mapper is not self.mappers[0]:
+                    mapper.prepare_map(self.kernel)
+                mapper.perform_map()
+                return mapper.unpack_results()
+        finally:
+            mapper.device.deactivate()
+
+    def perform_map(self):
+        with ThreadPoolExecutor(max_workers=len(self.mappers)) as executor:
+            self.results = list(executor.map(self.run_shard, self.mappers))
+
+    def unpack_results(self):
+        result_in_list = []
+        result_out_list = []
+        for shard_in, shard_out in self.results:
+            result_in_list.extend(shard_in)
+            result_out_list.extend(shard_out)
+        return result_in_list, result_out_list
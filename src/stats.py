@@ -0,0 +1,145 @@
+from threading import Lock, local
+from time import perf_counter
+import logging
+import os
+
+logger = logging.getLogger("gpumap")
+
+_local = local()
+_hooks = []
+
+
+class MapStats:
+    # what one gpumap, gpureduce, gpuscan or pipeline call did. phases are summed when a
+    # call goes through one several times, e.g. once per chunk
+    def __init__(self, name=None):
+        self.name = name
+        self.backend = None
+        self.phases = {}
+        self.elements = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.signature_cache_hit = None
+        self.kernel_cache_hit = None
+        # closure variables whose buffer from an earlier map was used without copying them again
+        self.closure_cache_hits = 0
+        # what backend="auto" estimated for each backend and which one it picked
+        self.dispatch = None
+        self.lock = Lock()
+
+    @property
+    def compile_time(self):
+        return self.phases.get("compile", 0.0)
+
+    @property
+    def total_time(self):
+        return self.phases.get("total", 0.0)
+
+    def add_phase(self, name, duration):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def add_bytes_in(self, size):
+        with self.lock:
+            self.bytes_in += size
+
+    def add_bytes_out(self, size):
+        with self.lock:
+            self.bytes_out += size
+
+    def add_closure_cache_hit(self):
+        with self.lock:
+            self.closure_cache_hits += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {"name": self.name, "backend": self.backend, "phases": dict(self.phases),
+                    "elements": self.elements, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                    "signature_cache_hit": self.signature_cache_hit, "kernel_cache_hit": self.kernel_cache_hit,
+                    "closure_cache_hits": self.closure_cache_hits, "compile_time": self.compile_time,
+                    "dispatch": self.dispatch}
+
+    def __repr__(self):
+        return "MapStats(%r)" % self.as_dict()
+
+
+def current_stats():
+    # stats of the call running in this thread, None outside of one
+    return getattr(_local, "stats", None)
+
+
+class collecting:
+    # makes stats the current stats of this thread, worker threads of a call enter it as well
+    def __init__(self, stats):
+        self.stats = stats
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = current_stats()
+        _local.stats = self.stats
+        return self.stats
+
+    def __exit__(self, *exc):
+        _local.stats = self.previous
+
+
+def add_hook(hook):
+    # hook(stats) is called after every call
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def time_func(name, func, *args, **kwargs):
+    start_time = perf_counter()
+    out = func(*args, **kwargs)
+    duration = perf_counter() - start_time
+    stats = current_stats()
+    if stats is not None:
+        stats.add_phase(name, duration)
+    logger.debug("%s took %.6fs", name, duration)
+    return out
+
+
+def finish_call(stats):
+    logger.debug("%r", stats)
+    for hook in list(_hooks):
+        hook(stats)
+
+
+def run_call(name, func, stats=None, elements=0):
+    # runs a whole call with its own stats and hands them to the hooks. stats can be passed
+    # in to read them afterwards
+    stats = MapStats() if stats is None else stats
+    stats.name = name
+    stats.elements = elements
+    with collecting(stats):
+        out = time_func("total", func)
+    finish_call(stats)
+    return out
+
+
+class StatsRecorder:
+    # hook that keeps the stats of every call, e.g. to write a benchmark out afterwards
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, stats):
+        self.calls.append(stats)
+
+    def clear(self):
+        self.calls = []
+
+    def write_csv(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            print("first_call,code_gen,compile,serialize,run,deserialize,total,bytes_in,bytes_out", file=f)
+            for stats in self.calls:
+                phases = stats.phases
+                serialize = phases.get("serialize input", 0.0) + phases.get("serialize closure vars", 0.0)
+                print("{},{},{},{},{},{},{},{},{}".format(
+                    phases.get("first_call", 0.0), phases.get("code generator", 0.0), stats.compile_time, serialize,
+                    phases.get("run kernel", 0.0), phases.get("deserialize", 0.0), stats.total_time,
+                    stats.bytes_in, stats.bytes_out), file=f)
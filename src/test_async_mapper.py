@@ -0,0 +1,84 @@
+from async_mapper import gpumap_async, gpumap_await
+from mapper import gpumap
+from gpu_list import GpuList
+from stats import MapStats
+from test_util import CacheIsolatedTestCase, TestClassB
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import random
+
+
+def add_one(n):
+    return n + 1
+
+
+def triple(n):
+    return n * 3
+
+
+def grow(b):
+    b.x += 1
+    return TestClassB(b.x, b.y * 2, b.z)
+
+
+class TestAsyncMapper(CacheIsolatedTestCase):
+    def test_future(self):
+        items = [random.randint(0, 100) for _ in range(1000)]
+        future = gpumap_async(add_one, items, backend="host")
+        self.assertIsInstance(future, Future)
+        self.assertEqual([n + 1 for n in items], future.result())
+
+    def test_many_in_flight(self):
+        lists = [[random.randint(0, 100) for _ in range(500)] for _ in range(8)]
+        objects = [[TestClassB(i, i, 1) for i in range(200)] for _ in range(4)]
+        futures = [gpumap_async(add_one if i % 2 else triple, l, backend="host") for i, l in enumerate(lists)]
+        object_futures = [gpumap_async(grow, l, backend="host") for l in objects]
+        for i, (l, future) in enumerate(zip(lists, futures)):
+            self.assertEqual([n + 1 if i % 2 else n * 3 for n in l], future.result())
+        for l, future in zip(objects, object_futures):
+            self.assertEqual([i * 2 for i in range(200)], [b.y for b in future.result()])
+            self.assertEqual([i + 1 for i in range(200)], [b.x for b in l])
+
+    def test_errors(self):
+        future = gpumap_async(add_one, [1, 2], backend="no such device")
+        self.assertRaises(ValueError, future.result)
+
+    def test_options(self):
+        items = list(range(300))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = gpumap_async(add_one, items, backend="host", chunk_size=64, executor=executor)
+            self.assertEqual([n + 1 for n in items], future.result())
+        gpu_items = GpuList(items, device="host")
+        self.assertEqual([n + 1 for n in items], gpumap_async(add_one, gpu_items).result().to_list())
+
+    def test_auto(self):
+        items = [random.randint(0, 100) for _ in range(1000)]
+        stats = MapStats()
+        self.assertEqual([n + 1 for n in items], gpumap_async(add_one, items, backend="auto", stats=stats).result())
+        self.assertIn(stats.dispatch["backend"], stats.dispatch["estimates"])
+
+    def test_await(self):
+        items = [random.randint(0, 100) for _ in range(1000)]
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+
+            ticker = asyncio.ensure_future(tick())
+            results = await asyncio.gather(gpumap_await(add_one, items, backend="host"),
+                                           gpumap_await(triple, items, backend="host"))
+            ticker.cancel()
+            return results, ticks
+
+        (added, tripled), ticks = asyncio.run(run())
+        self.assertEqual([n + 1 for n in items], added)
+        self.assertEqual([n * 3 for n in items], tripled)
+        # the loop kept running while the maps did
+        self.assertGreater(ticks, 0)
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, backend="host"))
@@ -0,0 +1,64 @@
+from benchmarks.workloads import workloads
+from benchmarks.harness import get_backends, run_benchmarks, compare, load, save
+from benchmarks.phases import phases, make_source, run_phase_benchmarks
+from test_util import CacheIsolatedTestCase
+
+import json
+import os
+
+
+class TestBenchmarks(CacheIsolatedTestCase):
+    def test_backends(self):
+        backends = get_backends()
+        self.assertEqual("builtin", backends[0])
+        self.assertIn("host", backends)
+        self.assertIn("numpy", backends)
+
+    def test_run(self):
+        results = run_benchmarks(backends=["builtin", "host", "pool"], sizes=[10], repeat=1)
+        runs = {(r["workload"], r["backend"]): r for r in results["results"]}
+        for name in workloads:
+            self.assertEqual(1.0, runs[name, "builtin"]["speedup"])
+            self.assertTrue(runs[name, "host"]["ok"])
+            self.assertGreater(runs[name, "host"]["speedup"], 0)
+            self.assertIn("run kernel", runs[name, "host"]["phases"])
+        # pool drops the writes of calc_vel and cannot map lists of lists
+        self.assertNotIn(("nbody", "pool"), runs)
+        self.assertIn("lists of lists", runs["bubblesort", "pool"]["error"])
+
+        path = os.path.join(self.cache_dir, "bench", "results.json")
+        save(results, path)
+        self.assertEqual(json.loads(json.dumps(results)), load(path))
+        self.assertEqual([], compare(results, results))
+
+    def test_compare(self):
+        def run(backend, speedup, **kwargs):
+            result = {"workload": "primitive", "backend": backend, "size": 10, "time": 1.0 / speedup,
+                      "speedup": speedup, "ok": True}
+            result.update(kwargs)
+            return result
+
+        baseline = {"results": [run("builtin", 1.0), run("host", 4.0), run("numpy", 2.0), run("pool", 1.0)]}
+        current = {"results": [run("builtin", 1.0, time=5.0), run("host", 3.5), run("numpy", 1.0),
+                               {"workload": "primitive", "backend": "pool", "size": 10, "error": "TypeError: x"}]}
+        regressions = compare(baseline, current)
+        self.assertEqual(["numpy", "pool"], [r["backend"] for r in regressions])
+        self.assertEqual("TypeError: x", regressions[1]["reason"])
+        self.assertEqual(["host", "numpy", "pool"], [r["backend"] for r in compare(baseline, current, threshold=0.1)])
+
+    def test_phases(self):
+        self.assertIn("class Level3:", make_source(3, 4))
+        self.assertNotIn("class Level4:", make_source(3, 4))
+        results = run_phase_benchmarks(depths=[1, 3], fields=[1, 4], lengths=[10, 20], repeat=1)["results"]
+        runs = {(r["phase"], r["depth"], r["fields"], r["length"]): r for r in results}
+        # trace and codegen do not depend on the length of the list
+        self.assertEqual(2 * 2 * (2 + 3 * 2), len(results))
+        self.assertIn(("codegen", 3, 4, 1), runs)
+        self.assertIn(("create_output_list", 3, 4, 20), runs)
+        self.assertEqual(set(phases), set(r["phase"] for r in results))
+        for r in results:
+            self.assertGreater(r["items_per_sec"], 0)
+            self.assertGreater(r["peak_bytes"], 0)
+        # deeper objects allocate more to unpack
+        self.assertGreater(runs["create_output_list", 3, 4, 20]["peak_bytes"],
+                           runs["create_output_list", 1, 4, 20]["peak_bytes"])
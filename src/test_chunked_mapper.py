@@ -0,0 +1,121 @@
+from mapper import gpumap
+from chunked_mapper import gpumap_iter
+from gpu_list import GpuList
+from test_util import CacheIsolatedTestCase, TestClassB
+from test_device import CountingDevice, ContextDevice
+
+import random
+
+
+def add_one(n):
+    return n + 1
+
+
+def grow(b):
+    b.x += 1
+    return TestClassB(b.x, b.y * 2, b.z)
+
+
+class SmallDevice(CountingDevice):
+    # pretends to have room for a few hundred elements
+    def get_free_memory(self):
+        return 4096
+
+
+class TestChunkedMapper(CacheIsolatedTestCase):
+    def test_chunk_sizes(self):
+        items = [random.randint(0, 100) for _ in range(1000)]
+        expected = [n + 1 for n in items]
+        for chunk_size in [1, 7, 512, 999, 1000, 5000]:
+            self.assertEqual(expected, gpumap(add_one, items, backend="host", chunk_size=chunk_size))
+
+    def test_chunks_are_streamed(self):
+        device = CountingDevice()
+        items = list(range(1000))
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, backend=device, chunk_size=100))
+        # element 0 is traced in python
+        self.assertEqual(10, len(device.launches))
+        self.assertEqual(10, device.copies_in)
+        # add_one does not write its argument, so only the results come back
+        self.assertEqual(10, device.copies_out)
+
+    def test_objects(self):
+        items = [TestClassB(i, i * 2, 3) for i in range(300)]
+        out = gpumap(grow, items, backend="host", chunk_size=64)
+        self.assertEqual([i + 1 for i in range(300)], [b.x for b in items])
+        self.assertEqual([i + 1 for i in range(300)], [b.x for b in out])
+        self.assertEqual([i * 4 for i in range(300)], [b.y for b in out])
+
+    def test_closure(self):
+        offsets = [random.randint(0, 100) for _ in range(50)]
+
+        def shift(n):
+            return n + offsets[n % 50]
+
+        items = list(range(500))
+        out = gpumap(shift, items, backend="host", chunk_size=30)
+        self.assertEqual([n + offsets[n % 50] for n in items], out)
+
+    def test_auto(self):
+        device = SmallDevice()
+        items = list(range(2000))
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, backend=device, chunk_size="auto"))
+        self.assertGreater(len(device.launches), 1)
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, backend="host", chunk_size="auto"))
+
+    def test_rejected(self):
+        self.assertRaises(TypeError, gpumap, add_one, GpuList([1, 2], device="host"), chunk_size=1)
+        self.assertRaises(TypeError, gpumap, add_one, [1, 2], backend="numpy", chunk_size=1)
+        self.assertRaises(ValueError, gpumap, add_one, [1, 2], backend="host", chunk_size=0)
+
+    def test_iter(self):
+        for length in [0, 1, 2, 99, 100, 101, 1000]:
+            numbers = (n * 3 for n in range(length))
+            out = gpumap_iter(add_one, numbers, 100, backend="host")
+            self.assertEqual([n * 3 + 1 for n in range(length)], list(out))
+
+    def test_iter_is_lazy(self):
+        pulled = []
+
+        def records():
+            for n in range(1000):
+                pulled.append(n)
+                yield n
+
+        out = gpumap_iter(add_one, records(), 50, backend="host")
+        self.assertEqual([], pulled)
+        self.assertEqual(1, next(out))
+        # the device runs at most one batch ahead
+        self.assertLessEqual(len(pulled), 150)
+        self.assertEqual(list(range(2, 1001)), list(out))
+
+    def test_iter_objects(self):
+        items = [TestClassB(i, i * 2, 3) for i in range(250)]
+        out = list(gpumap_iter(grow, iter(items), 32, backend="host"))
+        self.assertEqual([i + 1 for i in range(250)], [b.x for b in items])
+        self.assertEqual([i * 4 for i in range(250)], [b.y for b in out])
+
+    def test_iter_closure(self):
+        offsets = [random.randint(0, 100) for _ in range(50)]
+
+        def shift(n):
+            return n + offsets[n % 50]
+
+        out = list(gpumap_iter(shift, range(500), 64, backend="host"))
+        self.assertEqual([n + offsets[n % 50] for n in range(500)], out)
+        self.assertRaises(ValueError, next, gpumap_iter(add_one, [1], 0, backend="host"))
+
+    def test_iter_activates_device(self):
+        device = ContextDevice()
+        offsets = [TestClassB(i, i, i) for i in range(50)]
+
+        def shift(n):
+            b = offsets[n % 50]
+            b.z += 1
+            return n + b.x
+
+        out = list(gpumap_iter(shift, range(500), 64, backend=device))
+        self.assertEqual([n + n % 50 for n in range(500)], out)
+        # the write of the traced first element is overwritten by the copy back
+        self.assertEqual([i + 10 for i in range(1, 50)], [b.z for b in offsets[1:]])
+        self.assertEqual(0, device.active)
@@ -0,0 +1,244 @@
+from mapper import gpumap, Mapper
+from stats import MapStats
+from device import register_device, unregister_device, get_device, available_devices
+from host_device import HostDevice
+from reducer import shared_block_size
+from serialization import ListSerializer
+from test_util import CacheIsolatedTestCase, TestClassC
+
+import numpy
+import random
+import struct
+
+
+_add_body = """
+        if (thread_id < length) {
+            items[thread_id] += 1;
+        }"""
+
+
+# shared memory kernels as plain c++, every block is an openmp team of threads
+_block_prelude = """
+#include <omp.h>
+#define __shared__ static
+#define __align__(n) __attribute__((aligned(n)))
+#define __syncthreads() _Pragma("omp barrier")
+struct dim3 { unsigned x, y, z; };
+static const dim3 blockDim = {%d, 1, 1};
+"""
+
+_block_kernel_def = """
+void {name}(int64_t num_blocks, {params}) {{
+    for (int64_t block = 0; block < num_blocks; block++) {{
+        #pragma omp parallel num_threads(blockDim.x)
+        {{
+            dim3 threadIdx = {{(unsigned) omp_get_thread_num(), 0, 0}};
+{body}
+        }}
+    }}
+}}
+"""
+
+
+def triple(n):
+    return n * 3
+
+
+def count_up(n):
+    total = 0
+    for i in range(n, n + 3):
+        total += i
+    return total
+
+
+class CountingDevice(HostDevice):
+    name = "counting"
+
+    def __init__(self):
+        self.copies_in = 0
+        self.copies_out = 0
+        self.launches = []
+
+    def to_device(self, data):
+        self.copies_in += 1
+        return HostDevice.to_device(self, data)
+
+    def from_device(self, ptr, size):
+        self.copies_out += 1
+        return HostDevice.from_device(self, ptr, size)
+
+    def launch(self, func, args, block, grid):
+        self.launches.append((block, grid))
+        HostDevice.launch(self, func, args, block, grid)
+
+
+class ContextDevice(CountingDevice):
+    # like a cuda device, kernels and buffers only work while it is current
+    def __init__(self):
+        CountingDevice.__init__(self)
+        self.active = 0
+
+    def activate(self):
+        self.active += 1
+
+    def deactivate(self):
+        self.active -= 1
+
+    def compile_functions(self, source, func_names):
+        assert self.active, "compiled while not current"
+        return CountingDevice.compile_functions(self, source, func_names)
+
+    def to_device(self, data):
+        assert self.active, "copied while not current"
+        return CountingDevice.to_device(self, data)
+
+    def alloc(self, size):
+        assert self.active, "allocated while not current"
+        return CountingDevice.alloc(self, size)
+
+    def from_device(self, ptr, size):
+        assert self.active, "copied while not current"
+        return CountingDevice.from_device(self, ptr, size)
+
+    def free(self, ptr):
+        assert self.active, "freed while not current"
+        CountingDevice.free(self, ptr)
+
+    def launch(self, func, args, block, grid):
+        assert self.active, "launched while not current"
+        CountingDevice.launch(self, func, args, block, grid)
+
+
+class BlockDevice(HostDevice):
+    # runs the kernels the cuda device runs with shared memory
+    name = "block"
+    shared_memory = True
+    prelude = HostDevice.prelude + _block_prelude % shared_block_size
+    block_kernel_def = _block_kernel_def
+
+
+class TestDevice(CacheIsolatedTestCase):
+    def test_host_copies(self):
+        device = HostDevice()
+        data = bytes(range(16))
+        ptr = device.to_device(data)
+        self.assertEqual(data, device.from_device(ptr, len(data)))
+        self.assertEqual(bytes(8), device.from_device(device.alloc(8), 8))
+
+    def test_host_launch_runs_num_threads(self):
+        device = HostDevice()
+        kernel = 'extern "C" {\n' + device.define_kernel("add_one", "int *items, int length", _add_body) + "}\n"
+        func = device.compile(device.prelude + kernel, "add_one")
+        items = [random.randint(0, 100) for _ in range(10)]
+        ptr = device.to_device(struct.pack("10i", *items))
+        # more threads than items, the kernel has to bounds check like on the gpu
+        device.launch(func, [numpy.int64(12), ptr, 10], (4, 1, 1), (3, 1))
+        self.assertEqual([i + 1 for i in items], list(struct.unpack("10i", device.from_device(ptr, 40))))
+
+    def test_get_device(self):
+        self.assertIsInstance(get_device("host"), HostDevice)
+        self.assertIs(get_device("host"), get_device("host"))
+        device = CountingDevice()
+        self.assertIs(device, get_device(device))
+        self.assertRaises(ValueError, get_device, "nonexistent")
+
+    def test_custom_device(self):
+        register_device("counting", CountingDevice)
+        self.addCleanup(unregister_device, "counting")
+        device = get_device("counting")
+        self.assertIn("counting", available_devices())
+        c = TestClassC(4)
+
+        def scale(n):
+            return n * c.i
+
+        items = list(range(1000))
+        self.assertEqual(list(map(scale, items)), gpumap(scale, items, backend="counting"))
+        # input and closure in, only the output out. scale writes neither n nor c
+        self.assertEqual(2, device.copies_in)
+        self.assertEqual(1, device.copies_out)
+        self.assertEqual([((512, 1, 1), (2, 1))], device.launches)
+
+    def test_unregister_device(self):
+        register_device("counting", CountingDevice)
+        unregister_device("counting")
+        self.assertNotIn("counting", available_devices())
+        self.assertRaises(ValueError, get_device, "counting")
+
+    def test_bounded_grid(self):
+        device = CountingDevice()
+        mapper = Mapper(triple, list(range(5000)), device=device)
+        mapper.max_grid_size = 3
+        mapper.prepare_map(kernel=None)
+        mapper.perform_map()
+        result_in, result_out = mapper.unpack_results()
+        self.assertEqual([n * 3 for n in range(5000)], result_out)
+        # the kernel strides over the list instead of getting a thread per element
+        block, grid = device.launches[0]
+        self.assertEqual(3, grid[0])
+        self.assertLess(block[0] * grid[0], 5000)
+
+    def test_64_bit_lengths(self):
+        # list headers hold int64_t lengths, which keeps the items 8 byte aligned
+        self.assertEqual(8 + 3 * 4, ListSerializer.project_size(int, None, 3))
+        data = ListSerializer(int, [1, 2, 3]).to_bytes()
+        self.assertEqual((3, 1, 2, 3), struct.unpack("q3i", data))
+
+    def test_64_bit_ranges(self):
+        # range loops count in int64_t like len() does
+        mapper = Mapper(count_up, [1, 2, 3], device=CountingDevice())
+        mapper.prepare_map(kernel=None)
+        source = mapper.mapper_kernel._build_kernel()
+        self.assertIn("int64_t i = __iterator_1.next();", source)
+        self.assertIn("__device__ int64_t RangeIterator::next()", source)
+        mapper.perform_map()
+        self.assertEqual([6, 9, 12], mapper.unpack_results()[1])
+
+    def test_closure_cache(self):
+        device = CountingDevice()
+        items = [TestClassC(i) for i in range(100)]
+
+        def add_items(n):
+            for item in items:
+                n += item.i
+            return n
+
+        stats = MapStats()
+        out = gpumap(add_items, list(range(10)), backend=device, stats=stats)
+        self.assertEqual([n + 4950 for n in range(10)], out)
+        self.assertEqual(0, stats.closure_cache_hits)
+        self.assertEqual(2, device.copies_in)
+
+        # items did not change, so only the input goes to the device
+        stats = MapStats()
+        out = gpumap(add_items, list(range(10)), backend=device, stats=stats)
+        self.assertEqual([n + 4950 for n in range(10)], out)
+        self.assertEqual(1, stats.closure_cache_hits)
+        self.assertEqual(3, device.copies_in)
+
+        items[3].i = 103
+        stats = MapStats()
+        out = gpumap(add_items, list(range(10)), backend=device, stats=stats)
+        self.assertEqual([n + 5050 for n in range(10)], out)
+        self.assertEqual(0, stats.closure_cache_hits)
+        self.assertEqual(5, device.copies_in)
+
+        # writes the kernel makes are still copied back into the python objects. items[0] is
+        # left out, the first call maps it in python
+        def bump(n):
+            items[n].i += 1
+            return n
+
+        gpumap(bump, list(range(100)), backend=device)
+        gpumap(bump, list(range(100)), backend=device)
+        self.assertEqual([i + 2 for i in range(1, 100) if i != 3], [items[i].i for i in range(1, 100) if i != 3])
+        self.assertEqual(105, items[3].i)
+
+    def test_mapper_takes_device_instance(self):
+        device = CountingDevice()
+        mapper = Mapper(triple, [1, 2, 3], device=device)
+        mapper.prepare_map(kernel=None)
+        mapper.perform_map()
+        result_in, result_out = mapper.unpack_results()
+        self.assertEqual([3, 6, 9], result_out)
+        self.assertEqual(1, len(device.launches))
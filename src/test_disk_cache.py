@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from disk_cache import DiskCache
+
+import multiprocessing
+import tempfile
+import shutil
+import os
+
+
+def _hammer_cache(cache_dir, worker_id):
+    cache = DiskCache(cache_dir, max_bytes=4096)
+    for i in range(50):
+        source = "kernel %d" % (i % 10)
+        artifact = (source * 20).encode("utf-8")
+        found = cache.get(source, ["-O3"])
+        if found is not None and found != artifact:
+            os._exit(1)
+        cache.put(source, ["-O3"], artifact)
+    os._exit(0)
+
+
+class TestDiskCache(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DiskCache(self.cache_dir, max_bytes=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.get("source", ["-O3"]))
+        self.cache.put("source", ["-O3"], b"\x00compiled\xff")
+        self.assertEqual(b"\x00compiled\xff", self.cache.get("source", ["-O3"]))
+        self.assertEqual("source", self.cache.get_source("source", ["-O3"]))
+
+    def test_key_depends_on_options(self):
+        self.assertNotEqual(DiskCache.get_key("source", ["-O3"]), DiskCache.get_key("source", ["-O2"]))
+        self.assertNotEqual(DiskCache.get_key("source", ["-O3"]), DiskCache.get_key("source2", ["-O3"]))
+        self.assertNotEqual(DiskCache.get_key("a", ["bc"]), DiskCache.get_key("ab", ["c"]))
+        self.cache.put("source", ["-O3"], b"a")
+        self.assertIsNone(self.cache.get("source", ["-O2"]))
+
+    def test_evicts_by_size(self):
+        for i in range(10):
+            self.cache.put("source %d" % i, [], b"x" * 200)
+            os.utime(os.path.join(self.cache_dir, DiskCache.get_key("source %d" % i, []) + ".bin"), (i, i))
+            os.utime(os.path.join(self.cache_dir, DiskCache.get_key("source %d" % i, []) + ".src"), (i, i))
+        self.cache.evict()
+        self.assertLessEqual(self.cache.size(), 1024)
+        self.assertIsNone(self.cache.get("source 0", []))
+        self.assertEqual(b"x" * 200, self.cache.get("source 9", []))
+
+    def test_clear(self):
+        self.cache.put("source", [], b"a")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("source", []))
+        self.assertEqual(0, self.cache.size())
+
+    def test_concurrent_processes(self):
+        processes = [multiprocessing.Process(target=_hammer_cache, args=(self.cache_dir, i)) for i in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertEqual(0, p.exitcode)
+        self.assertLessEqual(DiskCache(self.cache_dir, max_bytes=4096).size(), 4096)
+        leftover = [name for name in os.listdir(self.cache_dir) if name.startswith(".tmp-")]
+        self.assertEqual([], leftover)
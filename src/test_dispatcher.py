@@ -0,0 +1,97 @@
+from mapper import gpumap
+from dispatcher import cost_model, CostModel, get_size
+from device import get_device
+from gpu_list import GpuList
+from stats import MapStats
+from test_util import CacheIsolatedTestCase, TestClassB
+
+
+
+def add_one(n):
+    return n + 1
+
+
+def grow(b):
+    b.x += 1
+    return b.x + b.y
+
+
+def busy(n):
+    for i in range(1000):
+        n += 1
+    return n
+
+
+class TestDispatcher(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        cost_model.reset()
+
+    def tearDown(self):
+        cost_model.reset()
+        super().tearDown()
+
+    def test_small_maps(self):
+        items = [TestClassB(i, i, 1) for i in range(10)]
+        stats = MapStats()
+        self.assertEqual([i + 1 + i for i in range(10)], gpumap(grow, items, backend="auto", stats=stats))
+        # every element is mapped once
+        self.assertEqual(list(range(1, 11)), [b.x for b in items])
+        self.assertEqual("builtin", stats.backend)
+        self.assertEqual("builtin", stats.dispatch["backend"])
+        self.assertIn(get_device().name, stats.dispatch["estimates"])
+        self.assertGreater(stats.dispatch["cpu_time"], 0)
+        self.assertNotIn("first_call", stats.phases)
+
+        self.assertEqual([], gpumap(add_one, [], backend="auto"))
+        self.assertEqual([2], gpumap(add_one, [1], backend="auto"))
+
+    def test_expensive_maps(self):
+        cost_model.rates["compile_time"] = 0.0
+        items = list(range(2000))
+        stats = MapStats()
+        self.assertEqual([n + 1000 for n in items], gpumap(busy, items, backend="auto", stats=stats))
+        device = get_device()
+        self.assertEqual(device.name, stats.backend)
+        self.assertEqual(device.name, stats.dispatch["backend"])
+        self.assertGreater(stats.dispatch["estimates"]["builtin"], stats.dispatch["estimates"][device.name])
+        self.assertIn(CostModel.get_key(busy, device), cost_model.compiled)
+        self.assertIn(CostModel.get_key(busy, device), cost_model.kernel_times)
+        self.assertNotEqual(CostModel.serialize_rate, cost_model.rates["serialize_rate"])
+
+    def test_estimate(self):
+        device = get_device("host")
+        estimates = cost_model.estimate(busy, device, 1000, 1e-3, 12, 100, True)
+        self.assertAlmostEqual(1.0, estimates["builtin"])
+        self.assertAlmostEqual(1e-3 + 1.0 + 12100 / 10e6 + 12100 / 1e9, estimates["host"])
+        self.assertIn("pool", estimates)
+        # compiling is spread over the calls the function had so far
+        estimates = cost_model.estimate(busy, device, 1000, 1e-3, 12, 100, False)
+        self.assertAlmostEqual(1e-3 + 0.5 + 12100 / 10e6 + 12100 / 1e9, estimates["host"])
+        self.assertNotIn("pool", estimates)
+
+    def test_pool(self):
+        items = [1, 2]
+        self.assertTrue(cost_model.can_use_pool(add_one, items))
+        self.assertFalse(cost_model.can_use_pool(add_one, [[1], [2]]))
+
+        def add_all(n):
+            for m in items:
+                n += m
+            return n
+        # the pool would drop writes to items
+        self.assertFalse(cost_model.can_use_pool(add_all, items))
+
+    def test_get_size(self):
+        self.assertEqual(4, get_size(1))
+        self.assertEqual(8 + 3 * 8, get_size([1.0, 2.0, 3.0]))
+        self.assertEqual(0, get_size(add_one))
+        self.assertEqual(16, get_size(TestClassB(1, 2, 3)))
+
+    def test_gpu_list(self):
+        device = get_device("host")
+        items = GpuList(list(range(100)), device)
+        stats = MapStats()
+        out = gpumap(add_one, items, backend="auto", stats=stats)
+        self.assertEqual(list(range(1, 101)), out.to_list())
+        self.assertEqual({"backend": "host", "reason": "GpuList"}, stats.dispatch)
@@ -0,0 +1,204 @@
+from mapper import Mapper, gpumap
+from effects import WriteAnalyzer, find_written_fields
+from serialization import ListSerializer
+from data_model import ExtractedClasses, Functions
+from nbody import Body
+from stats import MapStats
+from test_util import CacheIsolatedTestCase, TestClassA, TestClassB, TestClassC
+from test_device import CountingDevice
+
+import math
+
+
+class Flag:
+    def __init__(self, thing):
+        self.thing = thing
+
+
+def set_i(c, i):
+    c.i = i
+
+
+def get_i(c):
+    return c.i
+
+
+def grow(b):
+    b.x += 1
+    return b.x + b.y
+
+
+def bump(a):
+    a.increment_all(2)
+    return a.q
+
+
+class Counted:
+    def __init__(self, c):
+        c.i += 1
+        self.i = c.i
+
+
+def count(c):
+    return Counted(c)
+
+
+class TestEffects(CacheIsolatedTestCase):
+    def get_written(self, func, items):
+        mapper = Mapper(func, items, "host")
+        mapper.prepare_closure_vars()
+        mapper.prepare_signature()
+        return mapper.get_written_closures()
+
+    def test_map(self):
+        a_list = [TestClassC(i + 1) for i in range(20)]
+        b_list = [TestClassC(1) for _ in range(10)]
+        something = Flag(True)
+        another_something = Flag(True)
+
+        def thing(a):
+            a_list[10].i = 1234
+            if something.thing:
+                for i in range(0, a_list[19].i, 2):
+                    a.increment_all(1)
+            b = TestClassA(a.a, a.a + a.b, a.a + a.b + a.c, TestClassB(a.o.x, a.o.x + a.o.y, a.o.x + a.o.y + a.o.z))
+            # increment_all writes to b, not to what it is given
+            for c in b_list:
+                b.increment_all(c.i)
+            another_something.thing = False
+            return b
+
+        items = [TestClassA(1, 2, 3, TestClassB(4, 5, 6)) for _ in range(3)]
+        self.assertEqual({"a_list", "another_something"}, self.get_written(thing, items))
+
+    def test_aliases(self):
+        bodies = [Body(float(i), float(i), float(i), 0.0, 0.0, 0.0, 1.0) for i in range(4)]
+        dt = 0.01
+
+        def calc_vel(i):
+            b1 = bodies[i]
+            for b2 in bodies:
+                d_pos = b1.pos.sub(b2.pos)
+                distance = d_pos.length() + 1.0
+                mag = dt / math.pow(distance, 3)
+                b1.vel = b1.vel.sub(d_pos.scale(b2.mass).scale(mag))
+
+        self.assertEqual({"bodies"}, self.get_written(calc_vel, list(range(4))))
+
+        def total_mass(i):
+            m = 0.0
+            for b in bodies:
+                # rebinding a local that refers to the bodies is not a write
+                b = bodies[i]
+                m += b.mass
+            return m
+
+        self.assertEqual(set(), self.get_written(total_mass, list(range(4))))
+
+    def test_calls(self):
+        c_list = [TestClassC(i) for i in range(4)]
+        d_list = [TestClassC(i) for i in range(4)]
+        b_list = [TestClassB(i, i, i) for i in range(4)]
+        e_list = [TestClassB(i, i, i) for i in range(4)]
+
+        def calls(n):
+            set_i(c_list[n], 1)
+            # the receiver is written by increment_all
+            b_list[n].increment_all(e_list[n])
+            return get_i(d_list[n])
+
+        self.assertEqual({"c_list", "b_list"}, self.get_written(calls, list(range(4))))
+
+    def test_copies(self):
+        device = CountingDevice()
+        weights = [TestClassC(i) for i in range(100)]
+        counts = [TestClassC(0) for _ in range(100)]
+
+        def weigh(n):
+            counts[n].i += 1
+            return n * weights[n].i
+
+        stats = MapStats()
+        self.assertEqual([n * n for n in range(100)], gpumap(weigh, list(range(100)), backend=device, stats=stats))
+        # output and counts come back, n and weights are only read. counts[0] is left out, the
+        # first call maps it in python
+        self.assertEqual(2, device.copies_out)
+        self.assertEqual([1] * 99, [c.i for c in counts[1:]])
+        self.assertEqual(list(range(100)), [w.i for w in weights])
+
+    def get_written_fields(self, func, items):
+        mapper = Mapper(func, items, "host")
+        mapper.prepare_closure_vars()
+        mapper.prepare_signature()
+        return mapper.get_written_fields()
+
+    def test_written_fields(self):
+        self.assertEqual(set(), self.get_written_fields(get_i, [TestClassC(i) for i in range(4)]))
+        self.assertEqual({("x",)}, self.get_written_fields(grow, [TestClassB(i, i, i) for i in range(4)]))
+        items = [TestClassA(1, 2, 3, TestClassB(4, 5, 6)) for _ in range(4)]
+        # methods are found by name, so TestClassB.increment_all counts for a as well. a has no
+        # x, y or z, so nothing more is copied for them
+        self.assertEqual({("a",), ("b",), ("c",), ("d",), ("x",), ("y",), ("z",), ("o", "x"), ("o", "y"),
+                          ("o", "z")}, self.get_written_fields(bump, items))
+        # the source of a builtin cannot be read
+        self.assertEqual({()}, find_written_fields(len, None, None))
+
+    def test_insert_fields(self):
+        items = [TestClassB(i, i, i) for i in range(4)]
+        class_repr = ExtractedClasses().extract(items[0])
+        self.assertEqual([("x",), ("y",), ("z",), ("q", "i")], ListSerializer.get_field_paths(class_repr))
+        serializer = ListSerializer(class_repr, items)
+        data = serializer.to_bytes()
+        for b in items:
+            b.x = b.y = -1
+        # only x is set again
+        self.assertIs(items, serializer.from_bytes(data, {("x",)}))
+        self.assertEqual(list(range(4)), [b.x for b in items])
+        self.assertEqual([-1] * 4, [b.y for b in items])
+
+    def test_pure_map(self):
+        device = CountingDevice()
+        items = [TestClassB(i, i, i) for i in range(100)]
+        q = items[50].q
+        self.assertEqual([2 * i + 1 for i in range(100)], gpumap(grow, items, backend=device))
+        self.assertEqual(list(range(1, 101)), [b.x for b in items])
+        self.assertIs(q, items[50].q)
+        self.assertEqual(2, device.copies_out)
+
+        device = CountingDevice()
+        self.assertEqual(list(range(1, 101)), gpumap(get_i, [TestClassC(i + 1) for i in range(100)], backend=device))
+        # get_i does not write its argument, only the results come back
+        self.assertEqual(1, device.copies_out)
+
+    def test_constructors(self):
+        # the constructor writes to what it is given
+        self.assertEqual({("i",)}, self.get_written_fields(count, [TestClassC(0) for _ in range(4)]))
+        items = [TestClassC(0) for _ in range(100)]
+        self.assertEqual([1] * 100, [o.i for o in gpumap(count, items, backend="host")])
+        self.assertEqual([1] * 100, [c.i for c in items])
+
+    def test_constructor_closures(self):
+        counts = [TestClassC(0) for _ in range(100)]
+
+        def count_closure(n):
+            return Counted(counts[n])
+
+        self.assertEqual({"counts"}, self.get_written(count_closure, list(range(100))))
+        # get_written already ran element 0 in python
+        self.assertEqual([1] * 99, [o.i for o in gpumap(count_closure, list(range(100)), backend="host")][1:])
+        self.assertEqual([1] * 99, [c.i for c in counts[1:]])
+        # the buffer kept on the device holds what the kernel wrote
+        self.assertEqual([2] * 99, [o.i for o in gpumap(count_closure, list(range(1, 100)), backend="host")])
+        self.assertEqual([2] * 99, [c.i for c in counts[1:]])
+
+    def test_unknown_calls(self):
+        counts = [TestClassC(0) for _ in range(4)]
+        self.assertEqual({("i",)}, WriteAnalyzer(Functions(), ExtractedClasses()).get_writes(set_i, "c"))
+        # set_i was not traced, so it may write anything it is given
+        analyzer = WriteAnalyzer(Functions(), ExtractedClasses())
+
+        def untraced(n):
+            set_i(counts[n], 1)
+            return len(counts)
+
+        self.assertEqual({()}, analyzer.get_writes(untraced, "n") | analyzer.get_writes(untraced, "counts"))
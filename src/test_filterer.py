@@ -0,0 +1,57 @@
+from filterer import gpufilter
+from test_device import CountingDevice, BlockDevice
+from test_util import CacheIsolatedTestCase, TestClassB
+
+import random
+
+
+def is_even(n):
+    return n % 2 == 0
+
+
+def never(n):
+    return n < 0
+
+
+def inside(b):
+    return b.x * b.x + b.y * b.y < 400
+
+
+class SizeDevice(CountingDevice):
+    def __init__(self):
+        CountingDevice.__init__(self)
+        self.bytes_out = 0
+
+    def from_device(self, ptr, size):
+        self.bytes_out += size
+        return CountingDevice.from_device(self, ptr, size)
+
+
+class TestFilterer(CacheIsolatedTestCase):
+    def test_primitives(self):
+        items = [random.randint(0, 1000) for _ in range(3000)]
+        self.assertEqual(list(filter(is_even, items)), gpufilter(is_even, items, backend="host"))
+
+    def test_shared_memory(self):
+        # the compaction scans in shared memory on cuda
+        items = [random.randint(0, 1000) for _ in range(20000)]
+        self.assertEqual(list(filter(is_even, items)), gpufilter(is_even, items, backend=BlockDevice()))
+
+    def test_keeps_objects(self):
+        items = [TestClassB(random.randint(-30, 30), random.randint(-30, 30), i) for i in range(2000)]
+        out = gpufilter(inside, items, backend="host")
+        expected = list(filter(inside, items))
+        self.assertEqual(len(expected), len(out))
+        for b1, b2 in zip(out, expected):
+            self.assertIs(b1, b2)
+
+    def test_nothing_kept(self):
+        items = [random.randint(0, 1000) for _ in range(100)]
+        self.assertEqual([], gpufilter(never, items, backend="host"))
+
+    def test_only_kept_copied_back(self):
+        items = [1] * 1000 + [2]
+        device = SizeDevice()
+        self.assertEqual([2], gpufilter(is_even, items, backend=device))
+        # the count and one compacted element and index instead of the whole list
+        self.assertLess(device.bytes_out, 64)
@@ -0,0 +1,120 @@
+from mapper import gpumap
+from gpu_list import GpuList
+from device import get_device
+from nbody import BodyGenerator, GPU_Simulation, CPU_Simulation
+from test_util import CacheIsolatedTestCase, TestClassB, TestClassC
+from test_device import CountingDevice, ContextDevice
+
+import gc
+import random
+
+
+def add_one(n):
+    return n + 1
+
+
+def grow(b):
+    b.x += 1
+    return TestClassB(b.x, b.y * 2, b.z)
+
+
+class FreeingDevice(CountingDevice):
+    def __init__(self):
+        CountingDevice.__init__(self)
+        self.frees = 0
+
+    def free(self, ptr):
+        self.frees += 1
+        CountingDevice.free(self, ptr)
+
+
+class TestGpuList(CacheIsolatedTestCase):
+    def test_results_stay_on_device(self):
+        items = [random.randint(0, 100) for _ in range(100)]
+        gpu_items = GpuList(items, device="host")
+        out = gpumap(add_one, gpu_items)
+        self.assertIsInstance(out, GpuList)
+        out = gpumap(add_one, out)
+        self.assertEqual([i + 2 for i in items], out.to_list())
+
+    def test_sync_updates_objects(self):
+        items = [TestClassB(random.randint(0, 30), random.randint(0, 30), random.randint(0, 30)) for _ in range(50)]
+        expected = [(b.x + 2, b.y * 2, b.z) for b in items]
+        gpu_items = GpuList(items, device="host")
+        gpumap(grow, gpu_items)
+        out = gpumap(grow, gpu_items)
+        # nothing is copied back until sync
+        self.assertEqual(expected[0][0] - 2, items[0].x)
+        gpu_items.sync()
+        self.assertEqual(expected, [(b.x, b.y * 2, b.z) for b in items])
+        self.assertEqual(expected, [(b.x, b.y, b.z) for b in out.to_list()])
+
+    def test_closure(self):
+        c_list = [TestClassC(i) for i in range(10)]
+        gpu_c_list = GpuList(c_list, device="host")
+
+        def bump(i):
+            c = gpu_c_list[i]
+            c.i += 1
+            total = 0
+            for other in gpu_c_list:
+                total += other.i
+            return total
+
+        indices = list(range(10))
+        gpumap(bump, indices, backend="host")
+        self.assertEqual(list(range(10)), [c.i for c in c_list])
+        gpumap(bump, indices, backend="host")
+        gpu_c_list.sync()
+        self.assertEqual([i + 2 for i in range(10)], [c.i for c in c_list])
+
+    def test_single_round_trip(self):
+        device = CountingDevice()
+        items = [random.randint(0, 100) for _ in range(100)]
+        gpu_items = GpuList(items, device=device)
+        for _ in range(5):
+            gpumap(add_one, gpu_items)
+        gpu_items.sync()
+        self.assertEqual(1, device.copies_out)
+
+    def test_nbody(self):
+        gen = BodyGenerator(32)
+        gen.generate_bodies()
+        gpu_bodies = gen.get_copy()
+        cpu_bodies = gen.get_copy()
+        GPU_Simulation(gpu_bodies, 3).run()
+        CPU_Simulation(cpu_bodies, 3).run()
+        for b1, b2 in zip(gpu_bodies, cpu_bodies):
+            self.assertAlmostEqual(b1.pos.x, b2.pos.x)
+            self.assertAlmostEqual(b1.vel.y, b2.vel.y)
+
+    def test_device_mismatch(self):
+        gpu_items = GpuList([1, 2, 3], device=CountingDevice())
+        self.assertRaises(ValueError, gpumap, add_one, gpu_items, backend="host")
+        self.assertRaises(TypeError, gpumap, add_one, gpu_items, backend="numpy")
+        self.assertIs(get_device("host"), GpuList([1], device="host").device)
+
+    def test_free(self):
+        device = FreeingDevice()
+        with GpuList(list(range(10)), device=device) as gpu_items:
+            out = gpumap(add_one, gpu_items)
+        self.assertEqual(1, device.frees)
+        self.assertRaises(ValueError, gpu_items.sync)
+        self.assertRaises(ValueError, gpumap, add_one, gpu_items)
+        gpu_items.free()
+        self.assertEqual(1, device.frees)
+        # outputs are freed once nothing refers to them
+        del out
+        gc.collect()
+        self.assertEqual(2, device.frees)
+
+    def test_activates_device(self):
+        device = ContextDevice()
+        gpu_items = GpuList(list(range(10)), device=device)
+        out = gpumap(add_one, gpu_items)
+        self.assertEqual(list(range(2, 12)), gpumap(add_one, out).to_list())
+        gpu_items.sync()
+        gpu_items.free()
+        del out
+        gc.collect()
+        self.assertEqual(0, device.active)
@@ -0,0 +1,154 @@
+from mapper import gpumap
+from kernel_cache import kernel_cache, signature_cache
+from disk_cache import disk_cache
+from test_util import CacheIsolatedTestCase, TestClassA, TestClassB, TestClassC
+
+import random
+import pickle
+import math
+
+
+def primitive_thing(n):
+    a = n
+    for i in range(100):
+        a += 1
+    return a
+
+
+def make_bigger(a):
+    b = TestClassA(a.a, a.a + a.b, a.a + a.b + a.c, TestClassB(a.o.x, a.o.x + a.o.y, a.o.x + a.o.y + a.o.z))
+    b.increment_all(3)
+    return b
+
+
+def helper(n):
+    return n + 1
+
+
+def call_helper(n):
+    return helper(n)
+
+
+class Scaler:
+    def __init__(self, n):
+        self.n = n
+
+    def scale(self):
+        return self.n * 2
+
+
+class TripleScaler:
+    def scale(self):
+        return self.n * 3
+
+
+def call_scale(s):
+    return s.scale()
+
+
+def bubblesort(lst):
+    for i in range(len(lst)):
+        for j in range(i+1, len(lst)):
+            if lst[j] < lst[i]:
+                temp = lst[j]
+                lst[j] = lst[i]
+                lst[i] = temp
+
+
+class TestHostMapper(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.items = [TestClassA(random.randint(0, 30), random.randint(0, 30), random.randint(0, 30),
+                                 TestClassB(random.randint(0, 30), random.randint(0, 30), random.randint(0, 30)))
+                      for _ in range(100)]
+
+    def assertSameA(self, a1, a2):
+        self.assertEqual((a1.a, a1.b, a1.c, a1.d, a1.o.x, a1.o.y, a1.o.z),
+                         (a2.a, a2.b, a2.c, a2.d, a2.o.x, a2.o.y, a2.o.z))
+
+    def test_map_primitives(self):
+        items = [random.randint(0, 30) for _ in range(1000)]
+        self.assertEqual(list(map(primitive_thing, items)), gpumap(primitive_thing, items, backend="host"))
+
+    def test_map_objects(self):
+        items_copy = pickle.loads(pickle.dumps(self.items))
+        out = gpumap(make_bigger, self.items, backend="host")
+        expected = list(map(make_bigger, items_copy))
+        self.assertEqual(len(expected), len(out))
+        for o1, o2 in zip(out, expected):
+            self.assertSameA(o1, o2)
+        for i1, i2 in zip(self.items, items_copy):
+            self.assertSameA(i1, i2)
+
+    def test_closure_vars(self):
+        c_list = [TestClassC(i) for i in range(10)]
+        something = TestClassC(2)
+        scale = 0.5
+
+        def foreach(a):
+            x = int(math.floor(scale * something.i))
+            for c in c_list:
+                a.increment_all(c.i + x)
+            something.i = 2
+
+        items_copy = pickle.loads(pickle.dumps(self.items))
+        out = gpumap(foreach, self.items, backend="host")
+        list(map(foreach, items_copy))
+        self.assertEqual([None] * len(self.items), out)
+        for i1, i2 in zip(self.items, items_copy):
+            self.assertSameA(i1, i2)
+
+    def test_list_of_lists(self):
+        lists = [[random.randint(0, 1000) for _ in range(20)] for _ in range(50)]
+        expected = [sorted(l) for l in lists]
+        gpumap(bubblesort, lists, backend="host")
+        self.assertEqual(expected, lists)
+
+    def test_repeated_calls_hit_caches(self):
+        for _ in range(3):
+            items = [random.randint(0, 30) for _ in range(100)]
+            self.assertEqual(list(map(primitive_thing, items)), gpumap(primitive_thing, items, backend="host"))
+        self.assertEqual(2, kernel_cache.hits)
+        self.assertEqual(1, kernel_cache.misses)
+        self.assertEqual(2, signature_cache.hits)
+
+        # first element goes through the kernel once the signature is known
+        items_copy = pickle.loads(pickle.dumps(self.items))
+        gpumap(make_bigger, self.items, backend="host")
+        out = gpumap(make_bigger, self.items, backend="host")
+        expected = list(map(make_bigger, items_copy))
+        for o1, o2 in zip(out, expected):
+            self.assertSameA(o1, o2)
+
+    def test_redefined_helper(self):
+        global helper
+        old_helper = helper
+        items = [1, 2, 3]
+        self.assertEqual([2, 3, 4], gpumap(call_helper, items, backend="host"))
+
+        def helper(n):
+            return n * 100
+
+        try:
+            self.assertEqual([100, 200, 300], gpumap(call_helper, items, backend="host"))
+        finally:
+            helper = old_helper
+        self.assertEqual([2, 3, 4], gpumap(call_helper, items, backend="host"))
+
+    def test_redefined_method(self):
+        old_scale = Scaler.scale
+        items = [Scaler(n) for n in [1, 2, 3]]
+        self.assertEqual([2, 4, 6], gpumap(call_scale, items, backend="host"))
+        Scaler.scale = TripleScaler.scale
+        try:
+            self.assertEqual([3, 6, 9], gpumap(call_scale, items, backend="host"))
+        finally:
+            Scaler.scale = old_scale
+
+    def test_disk_cache_reused(self):
+        items = [random.randint(0, 30) for _ in range(100)]
+        gpumap(primitive_thing, items, backend="host")
+        self.assertGreater(disk_cache.size(), 0)
+        kernel_cache.clear()
+        signature_cache.clear()
+        self.assertEqual(list(map(primitive_thing, items)), gpumap(primitive_thing, items, backend="host"))
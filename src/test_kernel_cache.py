@@ -0,0 +1,90 @@
+from unittest import TestCase
+
+from kernel_cache import KernelCache, ClosureCache
+from data_model import ExtractedClasses, get_layout, double
+from device import DeviceBackend
+
+from test_util import TestClassA, TestClassB, TestClassC
+
+
+class FreeingDevice(DeviceBackend):
+    def __init__(self):
+        self.freed = []
+
+    def free(self, ptr):
+        self.freed.append(ptr)
+
+
+class TestKernelCache(TestCase):
+    def test_hits_and_misses(self):
+        cache = KernelCache(max_size=4)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual({"hits": 2, "misses": 1, "size": 1, "max_size": 4}, cache.stats())
+
+    def test_lru_eviction(self):
+        cache = KernelCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a") # b is now the least recently used
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(2, len(cache))
+
+    def test_clear(self):
+        cache = KernelCache()
+        cache.put("a", 1)
+        cache.get("a")
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+
+class TestLayout(TestCase):
+    def test_same_shape_same_layout(self):
+        a1 = TestClassA(1, 2, 3, TestClassB(4, 5, 6))
+        a2 = TestClassA(7, 8, 9, TestClassB(10, 11, 12))
+        layout1 = get_layout(ExtractedClasses().extract(a1))
+        layout2 = get_layout(ExtractedClasses().extract(a2))
+        self.assertEqual(layout1, layout2)
+        self.assertEqual(hash(layout1), hash(layout2))
+
+    def test_field_types_change_layout(self):
+        layout1 = get_layout(ExtractedClasses().extract(TestClassC(1)))
+        layout2 = get_layout(ExtractedClasses().extract(TestClassC(1.0)))
+        self.assertNotEqual(layout1, layout2)
+
+    def test_primitive_layout(self):
+        self.assertIs(int, get_layout(int))
+        self.assertIs(double, get_layout(float))
+
+    def test_closure_cache(self):
+        cache = ClosureCache(max_size=2)
+        device = FreeingDevice()
+        a, b, c = [1], [2], [3]
+        self.assertIsNone(cache.take(device, a, b"a"))
+        cache.put(device, a, b"a", "ptr a")
+        # a map takes the buffer out while it runs
+        self.assertEqual("ptr a", cache.take(device, a, b"a"))
+        self.assertIsNone(cache.take(device, a, b"a"))
+        cache.put(device, a, b"a", "ptr a")
+        # a changed object does not match and its old buffer is freed
+        self.assertIsNone(cache.take(device, a, b"changed"))
+        self.assertEqual(["ptr a"], device.freed)
+        # buffers are per device
+        cache.put(device, a, b"a", "ptr a2")
+        self.assertIsNone(cache.take(FreeingDevice(), a, b"a"))
+        cache.put(device, b, b"b", "ptr b")
+        cache.put(device, c, b"c", "ptr c")
+        self.assertEqual(["ptr a", "ptr a2"], device.freed)
+        self.assertEqual({"hits": 1, "misses": 4, "size": 2, "max_size": 2}, cache.stats())
+        cache.clear()
+        self.assertEqual(["ptr a", "ptr a2", "ptr b", "ptr c"], device.freed)
+        self.assertEqual(0, len(cache))
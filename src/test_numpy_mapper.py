@@ -0,0 +1,113 @@
+from unittest import TestCase
+
+from mapper import gpumap
+from numpy_mapper import VectorEvaluator, VectorizeError
+from nbody import BodyGenerator
+from test_util import TestClassB, TestClassC
+
+import random
+import math
+import numpy
+
+
+def branchy(n):
+    if n > 10:
+        return n * 2
+    elif n < 3:
+        return -n
+    x = n
+    for i in range(5):
+        x += i
+    return x if x % 2 == 0 else x + 1
+
+
+def scale_b(b):
+    c = TestClassB(b.x * 2, b.y, b.z)
+    if b.x > b.y:
+        c.increment_all(b)
+    b.x = math.sqrt(b.x)
+    return c
+
+
+def count_down(n):
+    while n > 0:
+        n -= 1
+    return n
+
+
+class TestVectorEvaluator(TestCase):
+    def test_branches(self):
+        values = numpy.array([1, 5, 12, 4, 3])
+        out = VectorEvaluator(len(values)).call(branchy, [values])
+        self.assertEqual(list(map(branchy, values.tolist())), out.tolist())
+
+    def test_per_element_while(self):
+        self.assertRaises(VectorizeError, VectorEvaluator(2).call, count_down, [numpy.array([1, 2])])
+
+    def test_uniform_while(self):
+        self.assertEqual(0, VectorEvaluator(1).call(count_down, [3]))
+
+
+class TestNumpyMapper(TestCase):
+    def assertSameB(self, b1, b2):
+        self.assertEqual((b1.x, b1.y, b1.z, b1.q.i), (b2.x, b2.y, b2.z, b2.q.i))
+
+    def test_primitives(self):
+        items = [random.randint(0, 30) for _ in range(1000)]
+        self.assertEqual(list(map(branchy, items)), gpumap(branchy, items, backend="numpy"))
+
+    def test_objects(self):
+        items = [TestClassB(random.uniform(0, 30), random.uniform(0, 30), random.randint(0, 30)) for _ in range(500)]
+        items_copy = [TestClassB(b.x, b.y, b.z) for b in items]
+        out = gpumap(scale_b, items, backend="numpy")
+        expected = list(map(scale_b, items_copy))
+        for b1, b2 in zip(out, expected):
+            self.assertSameB(b1, b2)
+        for b1, b2 in zip(items, items_copy):
+            self.assertSameB(b1, b2)
+
+    def test_nbody_update(self):
+        gen = BodyGenerator(200)
+        gen.generate_bodies()
+        bodies = gen.get_copy()
+        expected = gen.get_copy()
+        dt = 0.01
+
+        def update(body):
+            body.pos = body.pos.add(body.vel.scale(dt))
+
+        self.assertEqual([None] * len(bodies), gpumap(update, bodies, backend="numpy"))
+        list(map(update, expected))
+        for b1, b2 in zip(bodies, expected):
+            self.assertAlmostEqual(b1.pos.x, b2.pos.x)
+            self.assertAlmostEqual(b1.pos.y, b2.pos.y)
+            self.assertAlmostEqual(b1.pos.z, b2.pos.z)
+
+    def test_gathers_closure_list(self):
+        c_list = [TestClassC(random.randint(0, 100)) for _ in range(50)]
+
+        def lookup(i):
+            c = c_list[i]
+            total = 0
+            for other in c_list:
+                total += other.i
+            return c.i * 2 + total
+
+        indices = list(range(50))
+        self.assertEqual(list(map(lookup, indices)), gpumap(lookup, indices, backend="numpy"))
+
+    def test_falls_back_on_unsupported_code(self):
+        items = [random.randint(0, 30) for _ in range(100)]
+        self.assertEqual(list(map(count_down, items)), gpumap(count_down, items, backend="numpy"))
+
+    def test_guarded_index(self):
+        c_list = [TestClassC(i) for i in range(5)]
+
+        def guarded(i):
+            if i < len(c_list):
+                return c_list[i].i * 2
+            return 0
+
+        indices = list(range(10))
+        self.assertEqual([0, 2, 4, 6, 8, 0, 0, 0, 0, 0], gpumap(guarded, indices, backend="numpy"))
+
@@ -0,0 +1,105 @@
+from pipeline import gpu_pipeline
+from kernel_cache import kernel_cache
+from test_util import CacheIsolatedTestCase, TestClassB
+
+import random
+
+
+def add_one(n):
+    return n + 1
+
+
+def halve(n):
+    return n * 0.5
+
+
+def is_even(n):
+    return n % 2 == 0
+
+
+def is_small(n):
+    return n < 20
+
+
+def to_b(n):
+    return TestClassB(n, n * 2, n + 1)
+
+
+def scale_b(b):
+    b.z += 1
+    return TestClassB(b.x * 2, b.y, b.z)
+
+
+def big_x(b):
+    return b.x > 30
+
+
+def make_adder(m):
+    def adder(n):
+        return n + m
+    return adder
+
+
+class TestPipeline(CacheIsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.items = [random.randint(0, 100) for _ in range(500)]
+
+    def test_maps(self):
+        expected = [halve(add_one(add_one(n))) for n in self.items]
+        out = gpu_pipeline(self.items, backend="host").map(add_one).map(add_one).map(halve).collect()
+        self.assertEqual(expected, out)
+
+    def test_map_filter(self):
+        expected = [n + 1 for n in self.items if is_even(n + 1)]
+        out = gpu_pipeline(self.items, backend="host").map(add_one).filter(is_even).collect()
+        self.assertEqual(expected, out)
+
+    def test_filter_first(self):
+        # the first elements are dropped before reaching the map
+        items = [1, 3, 5] + self.items
+        expected = [n + 1 for n in items if is_even(n)]
+        self.assertEqual(expected, gpu_pipeline(items, backend="host").filter(is_even).map(add_one).collect())
+
+    def test_filters_only(self):
+        items = [TestClassB(n, n, n) for n in self.items]
+        out = gpu_pipeline(items, backend="host").filter(big_x).collect()
+        self.assertEqual([b for b in items if big_x(b)], out)
+
+    def test_objects(self):
+        expected = [(b.x, b.y, b.z) for b in map(scale_b, map(to_b, self.items)) if big_x(b)]
+        out = gpu_pipeline(self.items, backend="host").map(to_b).map(scale_b).filter(big_x).collect()
+        self.assertEqual(expected, [(b.x, b.y, b.z) for b in out])
+
+    def test_closures(self):
+        offset = 3
+        limit = 50
+
+        def shift(n):
+            return n + offset
+
+        def below(n):
+            return n < limit
+
+        expected = [n + 3 for n in self.items if n + 3 < 50]
+        self.assertEqual(expected, gpu_pipeline(self.items, backend="host").map(shift).filter(below).collect())
+
+    def test_same_name(self):
+        # both closures are called adder, each stage still adds its own m
+        expected = [n + 3 for n in self.items]
+        out = gpu_pipeline(self.items, backend="host").map(make_adder(1)).map(make_adder(2)).collect()
+        self.assertEqual(expected, out)
+        adder = make_adder(0.5)
+        out = gpu_pipeline(self.items, backend="host").map(adder).map(make_adder(1)).map(adder).collect()
+        self.assertEqual([n + 2.0 for n in self.items], out)
+
+    def test_all_traced(self):
+        items = [1, 3, 5, 7]
+        self.assertEqual([], gpu_pipeline(items, backend="host").filter(is_even).map(add_one).collect())
+        self.assertEqual([], gpu_pipeline([], backend="host").map(add_one).collect())
+
+    def test_reuses_kernel(self):
+        pipeline = gpu_pipeline(self.items, backend="host").map(add_one).filter(is_small)
+        pipeline.collect()
+        self.assertEqual([n + 1 for n in self.items if n + 1 < 20], pipeline.collect())
+        self.assertEqual(1, kernel_cache.hits)
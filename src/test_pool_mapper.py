@@ -0,0 +1,143 @@
+from unittest import TestCase
+
+from mapper import gpumap
+from pool_mapper import PoolMapper, can_map
+from test_util import TestClassA, TestClassB
+
+from threading import Thread
+import pool_mapper
+import random
+import pickle
+
+
+def primitive_thing(n):
+    a = n
+    for i in range(100):
+        a += 1
+    return a * 0.5
+
+
+def make_bigger(a):
+    a.increment_all(2)
+    return TestClassB(a.a, a.b + a.c, a.o.z)
+
+
+SCALE = 2
+
+
+def scale_by_global(n):
+    return n * SCALE
+
+
+def add_one(n):
+    return n + 1
+
+
+def call_add(n):
+    return add_one(n) * SCALE
+
+
+def make_scaler(scale):
+    def half(n):
+        return n * 0.5
+
+    # closes over a nested function, so it cannot be sent to the shared pool
+    def scaled(n):
+        return half(n) * scale
+
+    return scaled
+
+
+def in_thread(func):
+    out = []
+
+    def run():
+        try:
+            out.append(func())
+        except Exception as e:
+            out.append(e)
+
+    thread = Thread(target=run)
+    thread.start()
+    thread.join()
+    return out[0]
+
+
+class TestPoolMapper(TestCase):
+    def setUp(self):
+        self.old_processes = PoolMapper.processes
+        PoolMapper.processes = 3
+
+    def tearDown(self):
+        PoolMapper.processes = self.old_processes
+
+    def test_map_primitives(self):
+        items = [random.randint(0, 30) for _ in range(1000)]
+        self.assertEqual(list(map(primitive_thing, items)), gpumap(primitive_thing, items, backend="pool"))
+
+    def test_map_objects(self):
+        items = [TestClassA(random.randint(0, 30), random.randint(0, 30), random.randint(0, 30),
+                            TestClassB(random.uniform(0, 30), random.uniform(0, 30), random.randint(0, 30)))
+                 for _ in range(101)]
+        items_copy = pickle.loads(pickle.dumps(items))
+        out = gpumap(make_bigger, items, backend="pool")
+        expected = list(map(make_bigger, items_copy))
+        self.assertEqual([(b.x, b.y, b.z, b.q.i) for b in expected], [(b.x, b.y, b.z, b.q.i) for b in out])
+        self.assertEqual([(a.a, a.b, a.c, a.d, a.o.x, a.o.y, a.o.z) for a in items_copy],
+                         [(a.a, a.b, a.c, a.d, a.o.x, a.o.y, a.o.z) for a in items])
+
+    def test_short_lists(self):
+        self.assertEqual([primitive_thing(3)], gpumap(primitive_thing, [3], backend="pool"))
+        self.assertEqual([primitive_thing(3), primitive_thing(4)], gpumap(primitive_thing, [3, 4], backend="pool"))
+
+    def test_reuses_pool(self):
+        items = list(range(50))
+        gpumap(primitive_thing, items, backend="pool")
+        pool = pool_mapper._pool
+        self.assertIsNotNone(pool)
+        self.assertEqual(list(map(primitive_thing, items)), gpumap(primitive_thing, items, backend="pool"))
+        self.assertIs(pool, pool_mapper._pool)
+
+    def test_changed_globals(self):
+        global SCALE, add_one
+        old_add_one = add_one
+        items = list(range(50))
+        self.assertEqual([n * 2 for n in items], gpumap(scale_by_global, items, backend="pool"))
+        self.assertEqual([(n + 1) * 2 for n in items], gpumap(call_add, items, backend="pool"))
+        # the workers are already running, the new values go to them with the function
+        SCALE = 10
+
+        def add_one(n):
+            return n + 3
+
+        try:
+            self.assertEqual([n * 10 for n in items], gpumap(scale_by_global, items, backend="pool"))
+            self.assertEqual([(n + 3) * 10 for n in items], gpumap(call_add, items, backend="pool"))
+        finally:
+            SCALE = 2
+            add_one = old_add_one
+        self.assertEqual([(n + 1) * 2 for n in items], gpumap(call_add, items, backend="pool"))
+
+    def test_forks_for_nested_closures(self):
+        scaled = make_scaler(3)
+        items = list(range(50))
+        self.assertEqual(list(map(scaled, items)), gpumap(scaled, items, backend="pool"))
+
+    def test_other_threads(self):
+        items = list(range(50))
+        self.assertEqual(list(map(primitive_thing, items)),
+                         in_thread(lambda: gpumap(primitive_thing, items, backend="pool")))
+        scaled = make_scaler(3)
+        self.assertTrue(can_map(scaled))
+        self.assertFalse(in_thread(lambda: can_map(scaled)))
+        self.assertIsInstance(in_thread(lambda: gpumap(scaled, items, backend="pool")), TypeError)
+
+    def test_pool_started_off_main_thread(self):
+        with pool_mapper._pool_lock:
+            if pool_mapper._pool is not None:
+                pool_mapper._pool.terminate()
+            pool_mapper._pool = None
+        items = list(range(50))
+        self.assertEqual(list(map(primitive_thing, items)),
+                         in_thread(lambda: gpumap(primitive_thing, items, backend="pool")))
+        self.assertEqual(list(map(primitive_thing, items)), gpumap(primitive_thing, items, backend="pool"))
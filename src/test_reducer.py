@@ -0,0 +1,90 @@
+from reducer import gpureduce
+from gpu_list import GpuList
+from nbody import BodyGenerator, Body
+from test_util import CacheIsolatedTestCase, TestClassC
+from test_device import BlockDevice
+
+from functools import reduce
+import random
+
+
+def add(a, b):
+    return a + b
+
+
+def keep_first(a, b):
+    return a
+
+
+def keep_last(a, b):
+    return b
+
+
+def add_c(a, b):
+    return TestClassC(a.i + b.i)
+
+
+def merge_bodies(a, b):
+    # mass weighted centre, carried in pos
+    mass = a.mass + b.mass
+    pos = a.pos.scale(a.mass).add(b.pos.scale(b.mass)).scale(1.0 / mass)
+    return Body(pos.x, pos.y, pos.z, 0.0, 0.0, 0.0, mass)
+
+
+class TestReducer(CacheIsolatedTestCase):
+    def test_sum(self):
+        for length in [2, 3, 33, 1000, 5000]:
+            items = [random.randint(-100, 100) for _ in range(length)]
+            self.assertEqual(sum(items), gpureduce(add, items, backend="host"))
+            self.assertEqual(sum(items) + 7, gpureduce(add, items, 7, backend="host"))
+
+    def test_short_lists(self):
+        self.assertEqual(5, gpureduce(add, [], 5, backend="host"))
+        self.assertEqual(3, gpureduce(add, [3], backend="host"))
+        self.assertRaises(TypeError, gpureduce, add, [], backend="host")
+
+    def test_objects(self):
+        items = [TestClassC(random.randint(0, 100)) for _ in range(2000)]
+        self.assertEqual(sum(c.i for c in items), gpureduce(add_c, items, TestClassC(0), backend="host").i)
+
+    def test_bodies(self):
+        gen = BodyGenerator(1000)
+        gen.generate_bodies()
+        bodies = gen.get_copy()
+        for b in bodies:
+            b.mass = abs(b.mass) + 1.0
+        expected = reduce(merge_bodies, bodies)
+        out = gpureduce(merge_bodies, bodies, backend="host")
+        self.assertAlmostEqual(expected.mass, out.mass, places=6)
+        self.assertAlmostEqual(expected.pos.x, out.pos.x, places=6)
+        self.assertAlmostEqual(expected.pos.z, out.pos.z, places=6)
+
+    def test_closure(self):
+        values = [random.randint(0, 100) for _ in range(500)]
+
+        def argmax(a, b):
+            if values[b] > values[a]:
+                return b
+            return a
+
+        indices = list(range(len(values)))
+        self.assertEqual(values.index(max(values)), gpureduce(argmax, indices, backend="host"))
+
+    def test_gpu_list(self):
+        items = [random.randint(0, 100) for _ in range(1000)]
+        gpu_items = GpuList(items, device="host")
+        self.assertEqual(sum(items), gpureduce(add, gpu_items))
+        self.assertEqual(sum(items) + 1, gpureduce(add, gpu_items, 1))
+
+    def test_shared_memory(self):
+        # the blocks of the cuda kernels fold in shared memory
+        device = BlockDevice()
+        for length in [2, 3, 300, 9000, 20000]:
+            items = [random.randint(-100, 100) for _ in range(length)]
+            self.assertEqual(sum(items), gpureduce(add, items, backend=device))
+            self.assertEqual(sum(items) + 7, gpureduce(add, items, 7, backend=device))
+            # the combiner does not have to be commutative
+            self.assertEqual(items[0], gpureduce(keep_first, items, backend=device))
+            self.assertEqual(items[-1], gpureduce(keep_last, items, backend=device))
+        items = [TestClassC(random.randint(0, 100)) for _ in range(2000)]
+        self.assertEqual(sum(c.i for c in items), gpureduce(add_c, items, TestClassC(0), backend=device).i)
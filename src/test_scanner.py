@@ -0,0 +1,77 @@
+from scanner import gpuscan
+from gpu_list import GpuList
+from test_util import CacheIsolatedTestCase, TestClassB, TestClassC
+from test_device import BlockDevice
+
+from itertools import accumulate
+import random
+
+
+def add(a, b):
+    return a + b
+
+
+def compose(f, g):
+    # g after f for the maps x -> f.x * x + f.y modulo 1009, associative but not commutative
+    return TestClassB(f.x * g.x % 1009, (g.x * f.y + g.y) % 1009, 0)
+
+
+def add_c(a, b):
+    return TestClassC(a.i + b.i)
+
+
+class TestScanner(CacheIsolatedTestCase):
+    def test_inclusive(self):
+        # lengths around the run width and the number of runs that need a second level
+        for length in [2, 3, 33, 100, 1025, 5000]:
+            items = [random.randint(-100, 100) for _ in range(length)]
+            self.assertEqual(list(accumulate(items)), gpuscan(add, items, backend="host"))
+            self.assertEqual(list(accumulate(items, initial=5))[1:], gpuscan(add, items, initial=5, backend="host"))
+
+    def test_exclusive(self):
+        for length in [1, 2, 40, 3000]:
+            items = [random.randint(-100, 100) for _ in range(length)]
+            self.assertEqual(list(accumulate(items, initial=0))[:-1],
+                             gpuscan(add, items, exclusive=True, initial=0, backend="host"))
+        self.assertRaises(TypeError, gpuscan, add, [1, 2], exclusive=True)
+
+    def test_short_lists(self):
+        self.assertEqual([], gpuscan(add, [], backend="host"))
+        self.assertEqual([4], gpuscan(add, [4], backend="host"))
+
+    def test_objects(self):
+        items = [TestClassC(random.randint(0, 100)) for _ in range(1000)]
+        out = gpuscan(add_c, items, exclusive=True, initial=TestClassC(0), backend="host")
+        self.assertEqual(list(accumulate((c.i for c in items), initial=0))[:-1], [c.i for c in out])
+
+    def test_closure(self):
+        modulus = 7
+
+        def add_mod(a, b):
+            return (a + b) % modulus
+
+        items = [random.randint(0, 100) for _ in range(500)]
+        expected = list(accumulate(items, lambda a, b: (a + b) % modulus, initial=0))[1:]
+        self.assertEqual(expected, gpuscan(add_mod, items, initial=0, backend="host"))
+
+    def test_gpu_list(self):
+        items = [random.randint(0, 100) for _ in range(1000)]
+        out = gpuscan(add, GpuList(items, device="host"))
+        self.assertIsInstance(out, GpuList)
+        self.assertEqual(list(accumulate(items)), out.to_list())
+        out = gpuscan(add, GpuList(items, device="host"), exclusive=True, initial=1)
+        self.assertEqual(list(accumulate(items, initial=1))[:-1], out.to_list())
+
+    def test_shared_memory(self):
+        # the blocks of the cuda kernels scan in shared memory, lengths around the block sizes
+        device = BlockDevice()
+        for length in [2, 3, 300, 8193, 20000]:
+            items = [random.randint(-100, 100) for _ in range(length)]
+            self.assertEqual(list(accumulate(items)), gpuscan(add, items, backend=device))
+            self.assertEqual(list(accumulate(items, initial=5))[1:], gpuscan(add, items, initial=5, backend=device))
+        # the runs keep their order
+        items = [TestClassB(random.randint(1, 1008), random.randint(0, 1008), 0) for _ in range(9000)]
+        expected = [(f.x, f.y) for f in accumulate(items, compose)]
+        self.assertEqual(expected, [(f.x, f.y) for f in gpuscan(compose, items, backend=device)])
+        out = gpuscan(add_c, [TestClassC(i) for i in range(1000)], exclusive=True, initial=TestClassC(0), backend=device)
+        self.assertEqual(list(accumulate(range(1000), initial=0))[:-1], [c.i for c in out])
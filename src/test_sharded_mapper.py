@@ -0,0 +1,72 @@
+from mapper import gpumap
+from async_mapper import gpumap_async
+from gpu_list import GpuList
+from test_util import CacheIsolatedTestCase, TestClassB
+from test_device import CountingDevice, ContextDevice
+
+import random
+
+
+def add_one(n):
+    return n + 1
+
+
+def grow(b):
+    b.x += 1
+    return TestClassB(b.x, b.y * 2, b.z)
+
+
+class TestShardedMapper(CacheIsolatedTestCase):
+    def test_shards(self):
+        for num_devices in [1, 2, 3, 4]:
+            for length in [1, 2, 5, 1000, 1001]:
+                devices = [CountingDevice() for _ in range(num_devices)]
+                items = [random.randint(0, 100) for _ in range(length)]
+                self.assertEqual([n + 1 for n in items], gpumap(add_one, items, devices=devices))
+
+    def test_every_device_launches(self):
+        devices = [CountingDevice() for _ in range(3)]
+        items = list(range(3000))
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, devices=devices))
+        for device in devices:
+            self.assertEqual(1, len(device.launches))
+            # one shard in, the out list back. add_one does not write the shard
+            self.assertEqual(1, device.copies_in)
+            self.assertEqual(1, device.copies_out)
+
+    def test_objects(self):
+        items = [TestClassB(i, i * 2, 3) for i in range(500)]
+        out = gpumap(grow, items, devices=[CountingDevice(), CountingDevice()])
+        self.assertEqual([i + 1 for i in range(500)], [b.x for b in items])
+        self.assertEqual([i * 4 for i in range(500)], [b.y for b in out])
+
+    def test_closure(self):
+        offsets = [random.randint(0, 100) for _ in range(50)]
+
+        def shift(n):
+            return n + offsets[n % 50]
+
+        devices = [CountingDevice() for _ in range(3)]
+        items = list(range(600))
+        self.assertEqual([n + offsets[n % 50] for n in items], gpumap(shift, items, devices=devices))
+        # every device got its own copy of offsets
+        for device in devices:
+            self.assertEqual(2, device.copies_in)
+
+    def test_async(self):
+        items = list(range(700))
+        future = gpumap_async(add_one, items, devices=["host", CountingDevice()])
+        self.assertEqual([n + 1 for n in items], future.result())
+
+    def test_rejected(self):
+        self.assertRaises(TypeError, gpumap, add_one, GpuList([1, 2], device="host"), devices=["host"])
+        self.assertRaises(TypeError, gpumap, add_one, [1, 2], backend="host", devices=["host"])
+        self.assertRaises(ValueError, gpumap, add_one, [1, 2], devices=[])
+
+    def test_activates_devices(self):
+        devices = [ContextDevice() for _ in range(2)]
+        items = list(range(100))
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, devices=devices))
+        self.assertEqual([0, 0], [device.active for device in devices])
+        self.assertEqual([n + 1 for n in items], gpumap(add_one, items, backend=devices[0]))
+        self.assertEqual(0, devices[0].active)
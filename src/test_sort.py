@@ -1,7 +1,10 @@
 from mapper import gpumap
 from random import randint
 from pickle import dumps, loads
-from util import get_time, Results
+from util import get_time
+from stats import StatsRecorder, add_hook, remove_hook
+from nbody import results_dir
+import os
 
 class TestSort:
     def prepare(self, size):
@@ -14,9 +17,10 @@ class TestSort:
         self.prepare(256)
         gpumap(bubblesort, self.lists)
         list(map(bubblesort, self.lists2))
-        Results.clear_results()
 
     def run(self):
+        recorder = StatsRecorder()
+        add_hook(recorder)
         with open("bubble_out.csv", "w") as f:
             print("list_size,num_lists,gpu,cpu",file=f)
             size = 2
@@ -32,9 +36,10 @@ class TestSort:
                 print("{},{},{},{}".format(size, len(self.lists), gpu, cpu), file=f)
                 f.flush()
 
-                Results.output_results("bubblesort", "results-%d.csv" % size)
-                Results.clear_results()
+                recorder.write_csv(os.path.join(results_dir, "bubblesort", "results-%d.csv" % size))
+                recorder.clear()
                 size *= 2
+        remove_hook(recorder)
 
 def bubblesort(lst):
     for i in range(len(lst)):
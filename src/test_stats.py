@@ -0,0 +1,105 @@
+from mapper import gpumap
+from reducer import gpureduce
+from scanner import gpuscan
+from filterer import gpufilter
+from chunked_mapper import gpumap_iter
+from stats import MapStats, StatsRecorder, add_hook, remove_hook, current_stats
+from test_util import CacheIsolatedTestCase, TestClassB
+from test_device import CountingDevice
+
+from contextlib import redirect_stdout
+import io
+import os
+
+
+def add_one(n):
+    return n + 1
+
+
+def add(a, b):
+    return a + b
+
+
+def is_even(n):
+    return n % 2 == 0
+
+
+def grow(b):
+    b.x += 1
+    return TestClassB(b.x, b.y * 2, b.z)
+
+
+class TestStats(CacheIsolatedTestCase):
+    def test_map_stats(self):
+        items = list(range(1000))
+        stats = MapStats()
+        gpumap(add_one, items, backend="host", stats=stats)
+        self.assertEqual("gpumap", stats.name)
+        self.assertEqual("host", stats.backend)
+        self.assertEqual(1000, stats.elements)
+        self.assertFalse(stats.signature_cache_hit)
+        self.assertFalse(stats.kernel_cache_hit)
+        self.assertGreater(stats.compile_time, 0)
+        for phase in ["first_call", "serialize input", "code generator", "run kernel", "deserialize", "total"]:
+            self.assertIn(phase, stats.phases)
+        # element 0 is traced, the rest goes in as a list. add_one does not write it, so only
+        # the results come back
+        self.assertEqual(8 + 999 * 4, stats.bytes_in)
+        self.assertEqual(8 + 999 * 4, stats.bytes_out)
+
+        stats = MapStats()
+        gpumap(add_one, items, backend="host", stats=stats)
+        self.assertTrue(stats.signature_cache_hit)
+        self.assertTrue(stats.kernel_cache_hit)
+        self.assertNotIn("compile", stats.phases)
+        self.assertIsNone(current_stats())
+
+    def test_hooks(self):
+        calls = []
+        hook = calls.append
+        add_hook(hook)
+        try:
+            items = list(range(100))
+            gpumap(add_one, items, backend="host")
+            gpureduce(add, items, backend="host")
+            gpuscan(add, items, backend="host")
+            gpufilter(is_even, items, backend="host")
+            list(gpumap_iter(add_one, iter(items), 30, backend="host"))
+            gpumap(add_one, items, devices=[CountingDevice(), CountingDevice()])
+            gpumap(add_one, items, backend="numpy")
+        finally:
+            remove_hook(hook)
+        self.assertEqual(["gpumap", "gpureduce", "gpuscan", "pipeline", "gpumap_iter", "gpumap", "gpumap"],
+                         [stats.name for stats in calls])
+        self.assertTrue(all(stats.elements == 100 for stats in calls))
+        self.assertTrue(all(stats.total_time > 0 for stats in calls))
+        # every shard counts towards the same call. add_one was traced by the first map, so
+        # both shards copy all of their elements
+        self.assertEqual("counting", calls[5].backend)
+        self.assertEqual(2 * (8 + 50 * 4), calls[5].bytes_in)
+        self.assertEqual("numpy", calls[6].backend)
+
+    def test_quiet(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            gpumap(grow, [TestClassB(i, i, 1) for i in range(10)], backend="host")
+        self.assertEqual("", out.getvalue())
+        with self.assertLogs("gpumap", "DEBUG") as logs:
+            gpumap(add_one, [1, 2, 3], backend="host")
+        self.assertTrue(any("MapStats" in line for line in logs.output))
+
+    def test_recorder(self):
+        recorder = StatsRecorder()
+        add_hook(recorder)
+        try:
+            gpumap(add_one, [1, 2, 3], backend="host")
+            gpumap(add_one, [1, 2, 3], backend="host")
+        finally:
+            remove_hook(recorder)
+        self.assertEqual(2, len(recorder.calls))
+        path = os.path.join(self.cache_dir, "results", "out.csv")
+        recorder.write_csv(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith("first_call,"))
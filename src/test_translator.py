@@ -1335,7 +1335,7 @@ for i in range(5, 1000, 5):
         output_code = """\
 auto __iterator_1 = RangeIterator(5, 1000, 5);
 while(__iterator_1.has_next()) {
-    int i = __iterator_1.next();
+    int64_t i = __iterator_1.next();
     auto&& b = func(i);
     auto __iterator_2 = ListIterator<SomeClass>(a_list);
     while (__iterator_2.has_next()) {
@@ -1344,7 +1344,7 @@ while(__iterator_1.has_next()) {
         a.some_other_method(b);
         auto __iterator_3 = RangeIterator(0, len(another_list), 1);
         while(__iterator_3.has_next()) {
-            int j = __iterator_3.next();
+            int64_t j = __iterator_3.next();
             another_list[j].some_method();
         }
     }
@@ -0,0 +1,110 @@
+from mapper import gpumap
+from tuner import LaunchTuner, launch_tuner
+from kernel_cache import kernel_cache
+from test_device import CountingDevice
+from test_util import CacheIsolatedTestCase
+
+import json
+import os
+
+
+def add_one(n):
+    return n + 1
+
+
+class BlockDevice(CountingDevice):
+    # launches blocks of up to 1024 threads, like a gpu
+    def max_block_size(self, func):
+        return 1024
+
+
+class SmallBlockDevice(CountingDevice):
+    # a kernel that uses too many registers for big blocks
+    def max_block_size(self, func):
+        return 256
+
+
+class TestTuner(CacheIsolatedTestCase):
+    def test_picks_fastest(self):
+        tuner = LaunchTuner()
+        key = tuner.get_key("abc", "host", 1000)
+        durations = {512: 3.0, 128: 2.0, 256: 1.0, 1024: 4.0}
+        tried = []
+        for _ in range(5):
+            block_size = tuner.get_block_size(key, 1024)
+            tried.append(block_size)
+            tuner.record(key, block_size, durations[block_size], 1024)
+        # the first call is a warm up and does not count
+        self.assertEqual([512, 512, 128, 256, 1024], tried)
+        self.assertEqual(256, tuner.get_block_size(key, 1024))
+
+        # the table outlives the process
+        with open(os.path.join(self.cache_dir, LaunchTuner.file_name)) as f:
+            self.assertEqual({key: 256}, json.load(f))
+        self.assertEqual(256, LaunchTuner().get_block_size(key, 1024))
+
+    def test_buckets(self):
+        tuner = LaunchTuner()
+        self.assertEqual(tuner.get_key("abc", "host", 1000), tuner.get_key("abc", "host", 600))
+        self.assertNotEqual(tuner.get_key("abc", "host", 1000), tuner.get_key("abc", "host", 1100))
+        self.assertNotEqual(tuner.get_key("abc", "host", 1000), tuner.get_key("abc", "cuda", 1000))
+
+    def test_max_block_size(self):
+        tuner = LaunchTuner()
+        key = tuner.get_key("abc", "host", 10)
+        tried = []
+        for _ in range(3):
+            block_size = tuner.get_block_size(key, 256)
+            tried.append(block_size)
+            tuner.record(key, block_size, 1.0 / block_size, 256)
+        self.assertEqual([128, 128, 256], tried)
+        self.assertEqual(256, tuner.get_block_size(key, 256))
+        self.assertEqual(64, tuner.get_block_size(tuner.get_key("abc", "host", 1), 64))
+
+    def test_disabled(self):
+        tuner = LaunchTuner(enabled=False)
+        key = tuner.get_key("abc", "host", 10)
+        tuner.record(key, 128, 0.0, 1024)
+        tuner.record(key, 128, 0.0, 1024)
+        self.assertEqual(512, tuner.get_block_size(key, 1024))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, LaunchTuner.file_name)))
+
+    def test_map_kernels(self):
+        device = BlockDevice()
+        items = list(range(5000))
+        for _ in range(7):
+            self.assertEqual([n + 1 for n in items], gpumap(add_one, items, backend=device))
+        block_sizes = [block[0] for block, grid in device.launches]
+        self.assertEqual([512, 512, 128, 256, 1024], block_sizes[:5])
+        self.assertIn(block_sizes[5], [512, 128, 256, 1024])
+        self.assertEqual(block_sizes[5], block_sizes[6])
+        for block, grid in device.launches:
+            self.assertGreaterEqual(block[0] * grid[0], len(items))
+
+        device = SmallBlockDevice()
+        kernel_cache.clear()
+        launch_tuner.clear()
+        for _ in range(3):
+            gpumap(add_one, items, backend=device)
+        self.assertTrue(all(block[0] <= 256 for block, grid in device.launches))
+
+    def test_host_is_not_tuned(self):
+        # the host ignores the block size, timing it would only measure noise
+        device = CountingDevice()
+        items = list(range(5000))
+        for _ in range(6):
+            gpumap(add_one, items, backend=device)
+        self.assertEqual([512] * 6, [block[0] for block, grid in device.launches])
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, LaunchTuner.file_name)))
+
+    def test_merges_table(self):
+        # another process saved its entries in the meantime
+        tuner = LaunchTuner()
+        key = tuner.get_key("abc", "cuda", 10)
+        tuner.get_block_size(key, 128)
+        with open(os.path.join(self.cache_dir, LaunchTuner.file_name), "w") as f:
+            json.dump({"other": 256}, f)
+        for _ in range(2):
+            tuner.record(key, 128, 1.0, 128)
+        with open(os.path.join(self.cache_dir, LaunchTuner.file_name)) as f:
+            self.assertEqual({"other": 256, key: 128}, json.load(f))
@@ -1,3 +1,28 @@
+from unittest import TestCase
+
+from disk_cache import disk_cache
+from kernel_cache import kernel_cache, signature_cache, closure_cache
+
+import shutil
+import tempfile
+
+
+class CacheIsolatedTestCase(TestCase):
+    # every test gets an empty disk cache in a fresh directory and empty in-memory caches
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_cache_dir = disk_cache.cache_dir
+        disk_cache.cache_dir = self.cache_dir
+        kernel_cache.clear()
+        signature_cache.clear()
+        closure_cache.clear()
+
+    def tearDown(self):
+        closure_cache.clear()
+        disk_cache.cache_dir = self.old_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+
 class TestClassA:
     def __init__(self, a, b, c, o):
         self.a = a
@@ -0,0 +1,113 @@
+from disk_cache import disk_cache, _FileLock
+
+from threading import Lock
+import json
+import os
+import tempfile
+
+
+class LaunchTuner:
+    # picks the block size of map kernels. the first calls of a kernel for a size bucket each
+    # try the next candidate, once all of them ran the fastest one is kept in a table next to
+    # the disk cache. map kernels change their input, so a call is never launched twice just
+    # to time it. the first call for a key also pays for loading the kernel, so it is not
+    # counted and the first candidate runs again. devices without a block size limit, like
+    # the host, ignore the block size and are not tuned
+    # the first call of a kernel runs with the old fixed default
+    block_sizes = [512, 128, 256, 1024]
+    default_block_size = 512
+    file_name = "launch_table.json"
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.trials = {}
+        self.warmed_up = set()
+        self.table = {}
+        self.table_path = None
+        self.lock = Lock()
+
+    @staticmethod
+    def get_key(source_hash, device_key, length):
+        # lengths within a power of two share their launch configuration
+        return "%s:%s:%d" % (source_hash, device_key, max(length, 1).bit_length())
+
+    def get_path(self):
+        return os.path.join(disk_cache.cache_dir, self.file_name)
+
+    def _load(self):
+        path = self.get_path()
+        if path == self.table_path:
+            return
+        self.table_path = path
+        self.trials = {}
+        self.warmed_up = set()
+        self.table = self._read()
+
+    def _read(self):
+        try:
+            with open(self.table_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self):
+        # other processes may have added entries since the table was read
+        directory = os.path.dirname(self.table_path)
+        os.makedirs(directory, exist_ok=True)
+        with _FileLock(os.path.join(directory, ".lock")):
+            table = self._read()
+            table.update(self.table)
+            self.table = table
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.table, f, indent=1, sort_keys=True)
+                os.replace(tmp_path, self.table_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def get_candidates(self, max_block_size):
+        return [size for size in self.block_sizes if size <= max_block_size] or [max_block_size]
+
+    def get_block_size(self, key, max_block_size):
+        if not self.enabled or max_block_size is None:
+            return min(self.default_block_size, max_block_size or self.default_block_size)
+        with self.lock:
+            self._load()
+            if key in self.table:
+                return self.table[key]
+            tried = self.trials.get(key, {})
+            for size in self.get_candidates(max_block_size):
+                if size not in tried:
+                    return size
+            return min(tried, key=tried.get)
+
+    def record(self, key, block_size, duration, max_block_size):
+        if not self.enabled or max_block_size is None:
+            return
+        with self.lock:
+            self._load()
+            if key in self.table:
+                return
+            if key not in self.warmed_up:
+                self.warmed_up.add(key)
+                return
+            tried = self.trials.setdefault(key, {})
+            tried.setdefault(block_size, duration)
+            if all(size in tried for size in self.get_candidates(max_block_size)):
+                self.table[key] = min(tried, key=tried.get)
+                del self.trials[key]
+                self._save()
+
+    def clear(self):
+        with self.lock:
+            self._load()
+            self.trials = {}
+            self.warmed_up = set()
+            self.table = {}
+            if os.path.exists(self.table_path):
+                os.unlink(self.table_path)
+
+
+launch_tuner = LaunchTuner(enabled=os.getenv("GPUMAP_TUNE", "1") != "0")